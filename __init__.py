@@ -12,7 +12,8 @@ Notes
 
 #%% Imports
 from .bpe       import Logger, OptiOpts, OptiParam, BpeResults, CurrentResults, \
-                           validate_opti_opts, run_bpe, plot_bpe_results
+                           load_bpe_iteration, validate_opti_opts, run_bpe, run_bpe_async, \
+                           serve_bpe_worker, plot_bpe_results
 from .classes   import Frozen, SaveAndLoad, SaveAndLoadPickle, Counter, FixedDict
 from .constants import MONTHS_PER_YEAR, INT_TOKEN, DEFAULT_COLORMAP, QUAT_SIZE
 from .enums     import IntEnumPlus, consecutive, dist_enum_and_mons
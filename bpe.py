@@ -13,17 +13,110 @@ Notes
 # pylint: disable=E1101, C0301, C0326
 
 #%% Imports
-from copy import deepcopy
+import asyncio
+from collections import OrderedDict
+from contextlib import contextmanager
+from copy import copy, deepcopy
 import doctest
+from functools import partial
+import glob
+import hashlib
+import inspect
+from itertools import zip_longest
+import json
+import logging
+import multiprocessing
+from multiprocessing.connection import Client, Listener, wait as mp_wait
 import numpy as np
 import os
+import re
 from scipy.linalg import norm
+import shutil
+import sys
+import tempfile
+import threading
 import time
+import traceback
+from types import ModuleType
 import unittest
+import warnings
 from dstauffman.classes  import Frozen, SaveAndLoad
 from dstauffman.plotting import Opts, plot_correlation_matrix, plot_multiline_history, \
                                     plot_bpe_convergence
 from dstauffman.utils    import rss, setup_dir
+try:
+    import h5py
+except ImportError: # pragma: no cover
+    warnings.warn('h5py was not imported, so the estimator history cannot be saved.')
+try:
+    from multiprocessing import shared_memory
+except ImportError: # pragma: no cover
+    shared_memory = None # only available in Python v3.8+
+# the workers can only attach to shared memory blocks without their resource tracker also taking ownership of
+# them in Python v3.13+, so memory mapped files are used for the shared arrays before that
+_SHM_BLOCKS = shared_memory is not None and sys.version_info >= (3, 13)
+
+#%% Constants
+# fields of the current results and counters of the BPE results that are recorded every iteration
+_HISTORY_ROWS   = ('params', 'delta_param', 'cost', 'trust_rad')
+_HISTORY_COUNTS = ('num_evals', 'num_cache_hits', 'num_cache_misses', 'num_accepted', 'num_rejected', \
+    'num_aborted')
+# types of timed events, and the fields of the BPE results that their elapsed times are recorded in
+_TIMING_FIELDS  = OrderedDict([('model', 'model_times'), ('cost', 'cost_times'), ('finite_diff', 'fd_times'), \
+    ('search', 'search_times'), ('linalg', 'linalg_times'), ('save', 'save_times')])
+
+# offset between the BPE verbosity levels and the standard logging levels, so that a message shown at
+# verbosity N is logged at level 20-N, i.e. from logging.INFO for 0 down to logging.DEBUG for 10
+_LEVEL_OFFSET   = logging.INFO
+
+#%% Logging
+class _StdoutHandler(logging.StreamHandler):
+    r"""
+    Logging handler that writes to whatever sys.stdout currently is, so that it can still be redirected.
+    """
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(logging.Formatter('%(message)s'))
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass # always resolved when emitting
+
+class _JsonLinesFormatter(logging.Formatter):
+    r"""
+    Formats the structured BPE records as a single line of JSON each.
+    """
+    def format(self, record):
+        data = OrderedDict([('event', record.getMessage()), ('time', record.created)])
+        data.update(getattr(record, 'bpe_record', {}))
+        return json.dumps(data, default=lambda x: x.tolist() if hasattr(x, 'tolist') else str(x))
+
+# messages displayed while running, which go to stdout unless other handlers are configured
+_LOGGER = logging.getLogger(__name__)
+if not _LOGGER.handlers:
+    _LOGGER.addHandler(_StdoutHandler())
+_LOGGER.propagate = False
+# machine readable records of each iteration, which are written to the output folder while running
+_RECORDS = logging.getLogger(__name__ + '.records')
+_RECORDS.setLevel(logging.INFO)
+_RECORDS.propagate = False
+
+def _log(level, msg, *args):
+    r"""Logs the message at the given BPE verbosity level, with any arguments formatted lazily in % style."""
+    _LOGGER.log(_LEVEL_OFFSET - level, msg, *args)
+
+def _is_logging(level):
+    r"""Whether messages at the given BPE verbosity level are displayed, to guard any costly formatting."""
+    return _LOGGER.isEnabledFor(_LEVEL_OFFSET - level)
+
+def _record(event, **kwargs):
+    r"""Writes a structured record of the given event to any open JSON lines record file."""
+    if _RECORDS.handlers:
+        _RECORDS.info(event, extra={'bpe_record': kwargs})
 
 #%% Logger
 class Logger(Frozen):
@@ -35,6 +128,11 @@ class Logger(Frozen):
     level : int
         Level of logger
 
+    Notes
+    -----
+    #.  The messages are sent through the standard "dstauffman.bpe" logger, with a level of 20-N for
+        a message shown at level N, so setting this level also sets the level of that logger.
+
     Examples
     --------
     >>> from dstauffman import Logger
@@ -49,7 +147,7 @@ class Logger(Frozen):
     def __init__(self, level=None):
         r"""Creates options instance with ability to override defaults."""
         if level is not None:
-            type(self).level = self._check_level(level)
+            type(self).set_level(level)
 
     def __str__(self):
         r"""Prints the current level."""
@@ -71,6 +169,10 @@ class Logger(Frozen):
     def set_level(cls, level):
         r"""Sets the logging level."""
         cls.level = cls._check_level(level)
+        _LOGGER.setLevel(_LEVEL_OFFSET - cls.level)
+
+# start the standard logger at the default level
+_LOGGER.setLevel(_LEVEL_OFFSET - Logger.level)
 
 #%% OptiOpts
 class OptiOpts(Frozen):
@@ -85,16 +187,24 @@ class OptiOpts(Frozen):
         self.cost_args       = None # {} # TODO: add note, these are additional cost args, plus model_args
         self.get_param_func  = None
         self.set_param_func  = None
+        self.bind_params     = False # treat the names as paths into model_args, instead of the get/set functions
         self.output_folder   = ''
         self.output_results  = 'bpe_results.hdf5'
+        self.output_history  = 'bpe_history.hdf5' # per iteration history within the output folder, '' to disable
+        self.output_log      = 'bpe_log.jsonl' # JSON lines record of each iteration within the output folder
         self.params          = None # []
         self.start_func      = None
         self.final_func      = None
+        self.cost_setup_func = None # optional, called once with the model and cost args, returns extra cost args
+        self.batch_model_func = None # optional vectorized model, called with a (num_sets, num_param) values matrix
 
         # less common optimization settings
-        self.slope_method    = 'one_sided' # from {'one_sided', 'two_sided'}
+        self.slope_method    = 'one_sided' # from {'one_sided', 'two_sided', 'complex_step'}
         self.is_max_like     = False
-        self.search_method   = 'trust_region' # from {'trust_region', 'levenberg_marquardt'}
+        self.log_det_func    = None # optional, for is_max_like, returns log(det(B)) of the innovation covariance B
+        self.hessian_update  = 'gauss_newton' # from {'gauss_newton', 'bfgs', 'sr1'}, used for is_max_like
+        self.hessian_refresh = 0 # max iterations between Gauss-Newton resets of a quasi-Newton Hessian, 0 for as needed
+        self.search_method   = 'trust_region' # from {'trust_region', 'levenberg_marquardt', 'geodesic_lm'}
         self.max_iters       = 10
         self.tol_cosmax_grad = 1e-4
         self.tol_delta_step  = 1e-20
@@ -104,6 +214,44 @@ class OptiOpts(Frozen):
         self.grow_radius     = 2
         self.shrink_radius   = 0.5
         self.trust_radius    = 1.0
+        self.geodesic_alpha  = 0.75 # max ratio of 2*|acceleration|/|velocity| to accept a geodesic_lm step
+        self.jacobian_update = 'finite_diff' # from {'finite_diff', 'broyden'}
+        self.jacobian_refresh = 5 # max iterations between finite difference refreshes in Broyden mode
+        self.broyden_min_ratio = 0.25 # refresh if the actual/predicted cost reduction ratio drops below this
+        self.jacobian_sparsity = None # optional (num_innov, num_param) boolean pattern of nonzero Jacobian entries
+        self.innov_groups    = None # optional (num_innov,) group label of each innovation, matching OptiParam.group
+        self.jacobian_func   = None # optional, returns the (num_innov, num_param) derivatives at the current parameters
+        self.model_jacobian  = False # model_func returns (results, jacobian), giving the derivatives from the same call
+        self.check_jacobian  = 0. # relative tolerance to check jacobian_func against finite differences, 0 to disable
+        self.stream_innovs   = False # cost_func returns an iterable of innovation chunks, only J'J and J'r are kept
+        self.abort_trials    = True # stop trial steps of a generator model_func once their partial cost is too high
+        self.freeze_tol      = 0. # freeze parameters with a relative sensitivity below this, 0 to disable
+        self.freeze_recheck  = 5 # max iterations between rechecking the sensitivity of the frozen parameters
+
+        # parallelization settings
+        self.max_cores       = 0 # number of worker processes for model runs, 0 for serial, -1 for all cores
+        self.speculative_steps = False # evaluate the likely dogleg trial steps all at once, needs a parallel method
+        self.max_concurrency = 8 # max number of in flight evaluations when model_func is a coroutine function
+        self.eval_timeout    = None # seconds before cancelling an evaluation of a coroutine model_func
+        self.share_arrays    = False # put large arrays in model_args and cost_args in shared memory for the workers
+        self.share_min_bytes = 2**20 # minimum size of the arrays to put into shared memory
+        self.worker_addresses = None # list of (host, port) of serve_bpe_worker processes to run the model on
+        self.worker_authkey  = None # authentication key shared with the workers, required with worker_addresses
+        self.worker_timeout  = 30. # seconds without a heartbeat before a worker is considered dead
+
+        # evaluation cache settings
+        self.cache_max_bytes = 0 # memory bound for caching model evaluations, 0 to disable
+        self.cache_results   = False # whether to also cache the model results, not just the innovations
+        self.disk_cache      = False # whether to keep a persistent cache of evaluations in the output folder
+        self.disk_cache_max_bytes = 1e9 # size cap for the persistent cache
+        self.model_version   = '' # version tag of the model, used as part of the persistent cache key
+
+        # history settings
+        self.history_innovs  = False # whether to record the innovations every iteration, not just the latest
+        self.history_jacobian = False # whether to record the Jacobian every iteration
+
+        # instrumentation settings
+        self.event_hook      = None # optional, called as event_hook(event, elapsed) for every timed event and trial
 
     def __eq__(self, other):
         r"""
@@ -124,13 +272,14 @@ class OptiParam(Frozen):
     r"""
     Optimization parameter to be estimated by the batch parameters estimator.
     """
-    def __init__(self, name, *, best=np.nan, min_=-np.inf, max_=np.inf, minstep=1e-4, typical=1.):
+    def __init__(self, name, *, best=np.nan, min_=-np.inf, max_=np.inf, minstep=1e-4, typical=1., group=None):
         self.name = name
         self.best = best
         self.min_ = min_
         self.max_ = max_
         self.minstep = minstep
         self.typical = typical
+        self.group = group # None for a global parameter, else the label of the innovation group it belongs to
 
     def __eq__(self, other):
         r"""
@@ -143,7 +292,10 @@ class OptiParam(Frozen):
         for key in vars(self):
             v1 = getattr(self, key)
             v2 = getattr(other, key)
-            if v1 != v2 and (not np.isnan(v1) or not np.isnan(v2)):
+            if key == 'group':
+                if v1 != v2:
+                    return False
+            elif v1 != v2 and (not np.isnan(v1) or not np.isnan(v2)):
                 return False
         # if it made it all the way through the fields, then things must be equal
         return True
@@ -185,8 +337,20 @@ class BpeResults(Frozen, metaclass=SaveAndLoad):
         self.begin_innovs = None
         self.begin_cost   = None
         self.num_evals    = 0
+        self.num_cache_hits   = 0
+        self.num_cache_misses = 0
         self.num_iters    = 0
+        self.num_accepted = 0
+        self.num_rejected = 0
+        self.num_aborted  = 0
         self.costs        = []
+        self.frozen_params = [] # for each iteration, which parameters were frozen by the sensitivity screening
+        self.model_times  = []
+        self.cost_times   = []
+        self.fd_times     = []
+        self.search_times = []
+        self.linalg_times = []
+        self.save_times   = []
         self.correlation  = None
         self.info_svd     = None
         self.covariance   = None
@@ -199,8 +363,8 @@ class BpeResults(Frozen, metaclass=SaveAndLoad):
         Print all the fields of the Results.
         """
         # fields to print
-        keys = ['begin_params', 'begin_cost', 'num_evals', 'num_iters', 'final_params', \
-            'final_cost', 'correlation', 'info_svd', 'covariance', 'costs']
+        keys = ['begin_params', 'begin_cost', 'num_evals', 'num_cache_hits', 'num_cache_misses', \
+            'num_iters', 'num_accepted', 'num_rejected', 'num_aborted', 'final_params', 'final_cost', 'correlation', 'info_svd', 'covariance', 'costs']
         # initialize output text
         text = [' BpeResults:']
         # loop through fields
@@ -216,6 +380,31 @@ class BpeResults(Frozen, metaclass=SaveAndLoad):
         print('Final parameters:')
         _pprint_args(names, self.final_params)
 
+    def timing_report(self):
+        r"""
+        Prints a summary of the recorded times for each type of event, and returns it as text.
+
+        Examples
+        --------
+
+        >>> from dstauffman import BpeResults
+        >>> bpe_results = BpeResults()
+        >>> bpe_results.model_times = [0.5, 1.5]
+        >>> text = bpe_results.timing_report() # doctest: +NORMALIZE_WHITESPACE
+        Timing summary:
+          model:         2 calls,     2.000 s total,    1.0000 s mean,    1.5000 s max
+          cost:          0 calls,     0.000 s total,    0.0000 s mean,    0.0000 s max
+          finite_diff:   0 calls,     0.000 s total,    0.0000 s mean,    0.0000 s max
+          search:        0 calls,     0.000 s total,    0.0000 s mean,    0.0000 s max
+          linalg:        0 calls,     0.000 s total,    0.0000 s mean,    0.0000 s max
+          save:          0 calls,     0.000 s total,    0.0000 s mean,    0.0000 s max
+          trial steps:   0 accepted,  0 rejected
+
+        """
+        text = _timing_summary(self)
+        print(text)
+        return text
+
 #%% CurrentResults
 class CurrentResults(Frozen, metaclass=SaveAndLoad):
     r"""
@@ -229,6 +418,8 @@ class CurrentResults(Frozen, metaclass=SaveAndLoad):
         self.params    = None
         self.innovs    = None
         self.cost      = None
+        self.delta_param = None
+        self.jacobian  = None
 
     def __str__(self):
         r"""
@@ -240,10 +431,26 @@ class CurrentResults(Frozen, metaclass=SaveAndLoad):
         text.append('  Best Params: {}'.format(self.params))
         return '\n'.join(text)
 
+#%% _timing_summary
+def _timing_summary(bpe_results):
+    r"""
+    Summarizes the recorded times for each type of event as text.
+    """
+    lines = ['Timing summary:']
+    for (event, key) in _TIMING_FIELDS.items():
+        times = np.asarray(getattr(bpe_results, key), dtype=float)
+        (total, mean, max_) = (times.sum(), times.mean(), times.max()) if times.size > 0 else (0., 0., 0.)
+        lines.append('  {:<12}{:5d} calls, {:9.3f} s total, {:9.4f} s mean, {:9.4f} s max'.format(\
+            event + ':', times.size, total, mean, max_))
+    lines.append('  {:<12}{:5d} accepted, {:2d} rejected'.format('trial steps:', int(bpe_results.num_accepted), \
+        int(bpe_results.num_rejected)))
+    return '\n'.join(lines)
+
 #%% _pprint_args
-def _pprint_args(names, values):
+def _pprint_args(names, values, *, level=None):
     r"""
-    Prints the current name and value pairs for all the estimated parameters.
+    Prints the current name and value pairs for all the estimated parameters, or logs them instead at
+    the given BPE verbosity level.
     """
     # get the maximum length of any parameter name
     max_len = max(len(x) for x in names)
@@ -262,11 +469,14 @@ def _pprint_args(names, values):
     # combine all the lines into one string
     text = '\n'.join(lines)
     # print the resulting string and return it
-    print(text)
+    if level is None:
+        print(text)
+    else:
+        _log(level, '%s', text)
     return text
 
 #%% _print_divider
-def _print_divider(new_line=True):
+def _print_divider(new_line=True, *, level=0):
     r"""
     Prints some characters to the std out to break apart the different stpes within the model.
 
@@ -274,6 +484,8 @@ def _print_divider(new_line=True):
     ----------
     new_line : bool, optional
         Whether to include a newline in the print statement
+    level : int, optional
+        BPE verbosity level to log the divider at
 
     Examples
     --------
@@ -287,13 +499,652 @@ def _print_divider(new_line=True):
     # hard-coded text
     text = '\n******************************'
     # print with or without newline
-    print(text) if new_line else print(text[1:])
+    _log(level, text if new_line else text[1:])
+
+#%% _as_values
+def _as_values(params):
+    r"""
+    Converts the parameter values to a float array, or a complex one for complex step perturbations.
+
+    Examples
+    --------
+
+    >>> from dstauffman.bpe import _as_values
+    >>> print(_as_values([1, 2]))
+    [1. 2.]
+
+    >>> print(_as_values([1, 2+1e-20j]))
+    [1.+0.e+00j 2.+1.e-20j]
+
+    """
+    return np.asarray(params, dtype=complex if np.iscomplexobj(params) else float)
+
+#%% _CachedEval
+class _CachedEval(Frozen, metaclass=SaveAndLoad):
+    r"""
+    Single model evaluation as stored in the persistent cache.
+    """
+    def __init__(self):
+        self.param_names   = None
+        self.model_version = None
+        self.params        = None
+        self.innovs        = None
+
+#%% _DiskCache
+class _DiskCache(Frozen):
+    r"""
+    Persistent content addressed cache of model evaluations, stored as one HDF5 file per evaluation.
+
+    Parameters
+    ----------
+    folder : str
+        Folder to store the evaluations in
+    names : list of str
+        Names of the parameters being estimated
+    model_version : str
+        User supplied version tag of the model
+    max_bytes : int
+        Size cap for all the stored files, the least recently used ones are deleted to stay below it
+
+    Notes
+    -----
+    #.  Entries are keyed on a hash of the model version, the parameter names and the exact parameter
+        values, so changing any of them gives a new entry instead of an invalid one.
+    #.  The file modification times are updated on each use, and used to decide which entries to evict.
+    """
+    def __init__(self, folder, names, model_version, max_bytes):
+        self.folder        = folder
+        self.names         = names
+        self.model_version = model_version
+        self.max_bytes     = max_bytes
+
+    def _filename(self, params):
+        r"""Gets the filename for the given parameter values."""
+        hasher = hashlib.sha256()
+        hasher.update(str(self.model_version).encode('utf-8'))
+        hasher.update('\n'.join(self.names).encode('utf-8'))
+        hasher.update(_as_values(params).tobytes())
+        return os.path.join(self.folder, hasher.hexdigest() + '.hdf5')
+
+    def get(self, params):
+        r"""Gets the stored innovations for the given parameters, or None if not available."""
+        filename = self._filename(params)
+        if not os.path.isfile(filename):
+            return None
+        entry = _CachedEval.load(filename)
+        if not np.array_equal(entry.params, _as_values(params)):
+            return None # pragma: no cover
+        # update the last used time
+        os.utime(filename, None)
+        return entry.innovs
+
+    def put(self, params, innovs):
+        r"""Stores the innovations for the given parameters and evicts old entries as necessary."""
+        filename = self._filename(params)
+        if os.path.isfile(filename):
+            return
+        if not os.path.isdir(self.folder):
+            setup_dir(self.folder)
+        entry = _CachedEval()
+        entry.param_names   = [name.encode('utf-8') for name in self.names]
+        entry.model_version = str(self.model_version).encode('utf-8')
+        entry.params        = _as_values(params)
+        entry.innovs        = innovs
+        entry.save(filename)
+        self.evict()
+
+    def evict(self):
+        r"""Deletes the least recently used files until the total size is below the cap."""
+        files = glob.glob(os.path.join(self.folder, '*.hdf5'))
+        stats = sorted(((os.path.getmtime(file), os.path.getsize(file), file) for file in files))
+        total = sum(x[1] for x in stats)
+        for (_, size, file) in stats:
+            if total <= self.max_bytes:
+                break
+            os.remove(file)
+            total -= size
+
+#%% _EvalCache
+class _EvalCache(Frozen):
+    r"""
+    Least recently used cache of model evaluations, keyed on the exact parameter values.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Memory bound for all the stored entries, the least recently used ones are evicted to stay
+        below this limit
+    keep_results : bool, optional, default is False
+        Whether to store the model results in addition to the innovations
+    disk_cache : class _DiskCache, optional
+        Persistent cache to check after this one, and to store all new innovations in
+
+    Examples
+    --------
+
+    >>> from dstauffman.bpe import _EvalCache
+    >>> import numpy as np
+    >>> cache = _EvalCache(1000)
+    >>> cache.put(np.array([1., 2.]), None, np.array([0.5, 0.25]))
+    >>> print(cache.get(np.array([1., 2.]))[1])
+    [0.5  0.25]
+
+    """
+    def __init__(self, max_bytes, keep_results=False, disk_cache=None):
+        self.max_bytes    = max_bytes
+        self.keep_results = keep_results
+        self.disk_cache   = disk_cache
+        self.num_bytes    = 0
+        self.entries      = OrderedDict()
+
+    @staticmethod
+    def _key(params):
+        r"""Converts the parameter values to a hashable key."""
+        return _as_values(params).tobytes()
+
+    @staticmethod
+    def _nbytes(data):
+        r"""Estimates the memory used by the given data."""
+        if data is None:
+            return 0
+        if isinstance(data, np.ndarray):
+            return data.nbytes
+        return sys.getsizeof(data)
+
+    def get(self, params, need_results=False):
+        r"""
+        Gets the stored (results, innovs) for the given parameters, or None if not available.
+        """
+        key = self._key(params)
+        if key not in self.entries:
+            if self.disk_cache is None or need_results:
+                return None
+            innovs = self.disk_cache.get(params)
+            if innovs is None:
+                return None
+            self._store(key, None, innovs)
+            return (None, innovs.copy())
+        (results, innovs, _) = self.entries[key]
+        if need_results and results is None:
+            return None
+        self.entries.move_to_end(key)
+        return (results, innovs.copy())
+
+    def put(self, params, results, innovs):
+        r"""
+        Stores the evaluation for the given parameters, evicting older entries as necessary.
+        """
+        if self.disk_cache is not None:
+            self.disk_cache.put(params, innovs)
+        if not self.keep_results:
+            results = None
+        self._store(self._key(params), results, innovs)
+
+    def _store(self, key, results, innovs):
+        r"""Stores the entry in memory, evicting older entries as necessary."""
+        num_bytes = self._nbytes(results) + self._nbytes(innovs)
+        if num_bytes > self.max_bytes:
+            return
+        if key in self.entries:
+            self.num_bytes -= self.entries.pop(key)[2]
+        while self.entries and self.num_bytes + num_bytes > self.max_bytes:
+            (_, (_, _, old_bytes)) = self.entries.popitem(last=False)
+            self.num_bytes -= old_bytes
+        self.entries[key] = (results, innovs.copy(), num_bytes)
+        self.num_bytes += num_bytes
+
+#%% _ParamBinding
+class _ParamBinding(Frozen):
+    r"""
+    Binds the estimated parameters directly to their locations within the model arguments.
+
+    Parameters
+    ----------
+    names : list of str
+        Names of the parameters, as paths into the model arguments, such as 'sim_params.magnitude' or
+        'sim_params.gains[2]' or 'table[1, 3]', where the first part is the key of the model argument
+    model_args : dict
+        Model arguments to bind to
+
+    Notes
+    -----
+    #.  The names are only resolved once, so setting all the values is then just one assignment per
+        attribute and one vectorized assignment per array, instead of looking up each name every time.
+    #.  Any intermediate objects must not be replaced while bound, as the binding would still refer
+        to the old ones.
+    #.  The parsed paths are also kept, so that `copy_args` can copy just the objects along them.
+
+    Examples
+    --------
+
+    >>> from dstauffman.bpe import _ParamBinding
+    >>> import numpy as np
+    >>> model_args = {'gains': np.zeros(3), 'scale': 1.}
+    >>> binding = _ParamBinding(['gains[2]', 'scale', 'gains[0]'], model_args)
+    >>> binding.set(np.array([5., 2., 4.]))
+    >>> print(model_args['gains'])
+    [4. 0. 5.]
+
+    >>> print(binding.get())
+    [5. 2. 4.]
+
+    """
+    # pattern for each part of a name, either a .attribute or an [index]
+    _part = re.compile(r'\.?([A-Za-z_]\w*)|\[([^\]]+)\]')
+
+    def __init__(self, names, model_args):
+        self.names      = names
+        self.num_params = len(names)
+        self.paths      = [self._parse(name) for name in names]
+        self.slots      = [] # (container, key, is_item, position)
+        self.arrays     = [] # (array, index arrays, positions)
+        arrays = OrderedDict()
+        for (pos, (name, parts)) in enumerate(zip(names, self.paths)):
+            (container, key, is_index) = self._resolve(name, parts, model_args)
+            if is_index and isinstance(container, np.ndarray):
+                (_, indices, positions) = arrays.setdefault(id(container), (container, [], []))
+                indices.append(key)
+                positions.append(pos)
+            else:
+                self.slots.append((container, key, is_index or isinstance(container, dict), pos))
+        for (array, indices, positions) in arrays.values():
+            self.arrays.append((array, tuple(np.array(x) for x in zip(*indices)), np.array(positions)))
+
+    @classmethod
+    def _parse(cls, name):
+        r"""Splits the name into a list of (attribute or index, is_index) parts."""
+        parts = []
+        ix = 0
+        while ix < len(name):
+            match = cls._part.match(name, ix)
+            if match is None or (ix > 0 and match.group(1) is not None and name[ix] != '.'):
+                raise ValueError('Unable to parse parameter name "{}".'.format(name))
+            if match.group(1) is not None:
+                parts.append((match.group(1), False))
+            else:
+                try:
+                    index = tuple(int(x) for x in match.group(2).split(','))
+                except ValueError:
+                    raise ValueError('Only integer indices are supported, not "{}".'.format(name))
+                parts.append((index if len(index) > 1 else index[0], True))
+            ix = match.end()
+        if not parts or parts[0][1]:
+            raise ValueError('Unable to parse parameter name "{}".'.format(name))
+        return parts
+
+    @staticmethod
+    def _resolve(name, parts, model_args):
+        r"""Finds the object and attribute or index that the parsed name refers to."""
+        container = model_args
+        try:
+            for (key, is_index) in parts[:-1]:
+                container = container[key] if is_index or container is model_args else getattr(container, key)
+            (key, is_index) = parts[-1]
+            # check that the location already exists
+            if is_index or container is model_args:
+                container[key]
+                if isinstance(container, np.ndarray) and not isinstance(key, tuple):
+                    key = (key,)
+            else:
+                getattr(container, key)
+        except (AttributeError, IndexError, KeyError, TypeError):
+            raise ValueError('Unable to bind parameter "{}" to the model arguments.'.format(name))
+        return (container, key, is_index)
+
+    def set(self, values):
+        r"""Sets all the parameter values."""
+        for (container, key, is_item, pos) in self.slots:
+            if is_item:
+                container[key] = values[pos]
+            elif key in getattr(container, '__dict__', ()):
+                # skip the overhead of any custom __setattr__, such as on Frozen classes
+                container.__dict__[key] = values[pos]
+            else:
+                setattr(container, key, values[pos])
+        for (array, index, positions) in self.arrays:
+            array[index] = values[positions]
+
+    def get(self):
+        r"""Gets all the current parameter values."""
+        values = np.empty(self.num_params, dtype=float)
+        for (container, key, is_item, pos) in self.slots:
+            values[pos] = container[key] if is_item else getattr(container, key)
+        for (array, index, positions) in self.arrays:
+            values[positions] = array[index]
+        return values
+
+    def copy_args(self, model_args):
+        r"""
+        Copies just the objects along the bound paths, which are the only ones that setting the
+        parameters changes, and returns the new model arguments along with a binding to them.
+
+        Examples
+        --------
+
+        >>> from dstauffman.bpe import _ParamBinding
+        >>> import numpy as np
+        >>> model_args = {'gains': np.zeros(3), 'table': np.ones(1000)}
+        >>> binding = _ParamBinding(['gains[1]'], model_args)
+        >>> (new_args, new_binding) = binding.copy_args(model_args)
+        >>> new_binding.set(np.array([5.]))
+        >>> print(new_args['gains'], model_args['gains'])
+        [0. 5. 0.] [0. 0. 0.]
+
+        >>> print(new_args['table'] is model_args['table'])
+        True
+
+        """
+        new_args = _copy_paths(model_args, self.paths, is_root=True)
+        return (new_args, _ParamBinding(self.names, new_args))
+
+#%% _copy_paths
+def _copy_paths(obj, paths, *, is_root=False):
+    r"""
+    Shallow copies the object and everything along the given paths within it, which are lists of the
+    (attribute or index, is_index) parts from _ParamBinding, where the last part of each is set later.
+    """
+    if isinstance(obj, np.ndarray):
+        return obj.copy()
+    new = copy(obj)
+    children = OrderedDict()
+    for parts in paths:
+        if len(parts) > 1:
+            children.setdefault(parts[0], []).append(parts[1:])
+    for ((key, is_index), sub_paths) in children.items():
+        if is_index or is_root:
+            new[key] = _copy_paths(obj[key], sub_paths)
+        elif key in getattr(new, '__dict__', ()):
+            new.__dict__[key] = _copy_paths(getattr(obj, key), sub_paths)
+        else:
+            setattr(new, key, _copy_paths(getattr(obj, key), sub_paths))
+    return new
+
+#%% _record_event
+def _record_event(opti_opts, bpe_results, event, elapsed):
+    r"""
+    Records an event in the BPE results, and passes it on to any opti_opts.event_hook.
+
+    Parameters
+    ----------
+    opti_opts : class OptiOpts
+        Optimization options
+    bpe_results : class BpeResults
+        Results to record the event in
+    event : str
+        Either one of the keys of _TIMING_FIELDS, whose elapsed time is appended to the matching field,
+        or 'accepted' or 'rejected' for the outcome of a trial step, which are only counted
+    elapsed : float
+        Wall time of the event [sec]
+
+    Examples
+    --------
+
+    >>> from dstauffman.bpe import OptiOpts, BpeResults, _record_event
+    >>> opti_opts = OptiOpts()
+    >>> bpe_results = BpeResults()
+    >>> _record_event(opti_opts, bpe_results, 'model', 0.25)
+    >>> _record_event(opti_opts, bpe_results, 'rejected', 0.3)
+    >>> print(bpe_results.model_times, bpe_results.num_rejected)
+    [0.25] 1
+
+    """
+    if event in _TIMING_FIELDS:
+        getattr(bpe_results, _TIMING_FIELDS[event]).append(elapsed)
+    elif event == 'accepted':
+        bpe_results.num_accepted += 1
+    else:
+        bpe_results.num_rejected += 1
+    if opti_opts.event_hook is not None:
+        opti_opts.event_hook(event, elapsed)
+
+#%% _timed
+@contextmanager
+def _timed(opti_opts, bpe_results, event):
+    r"""Context manager that records the wall time of the code within it as the given event."""
+    start = time.perf_counter()
+    yield
+    _record_event(opti_opts, bpe_results, event, time.perf_counter() - start)
+
+#%% _set_params
+def _set_params(opti_opts, names, values, model_args, binding=None):
+    r"""
+    Sets the parameter values within the model arguments, using the binding if there is one.
+    """
+    if binding is not None:
+        binding.set(values)
+    else:
+        opti_opts.set_param_func(names=names, values=values, **model_args)
+
+#%% _InnovStream
+class _InnovStream(Frozen):
+    r"""
+    Innovations from a single model evaluation that are generated chunk by chunk by the cost function.
+
+    Parameters
+    ----------
+    opti_opts : class OptiOpts
+        Optimization options
+    results : object
+        Model results that the cost function is called on
+    model_args : dict
+        Model arguments passed to the cost function, with the parameters of this evaluation set
+    cost_args : dict
+        Additional cost arguments passed to the cost function
+    binding : class _ParamBinding, optional
+        Binding of the parameters within the model arguments
+
+    Notes
+    -----
+    #.  The model results are kept, and each iteration calls the cost function again, so the chunks
+        can be generated as many times as needed without ever holding all the innovations at once.
+        This only saves memory when the results are much smaller than the innovations.
+    #.  The model arguments are copied, so that setting the parameters for any later evaluations
+        doesn't change these chunks.  With a binding, only the objects along the parameter paths are
+        copied, otherwise they are all deep copied.
+    #.  The chunks must only depend on the results, and be the same sizes for every evaluation.
+    #.  Instances are immutable, so copy just returns the same instance.
+    """
+    def __init__(self, opti_opts, results, model_args, cost_args, binding=None):
+        self.cost_func  = opti_opts.cost_func
+        self.results    = results
+        if binding is not None:
+            (self.model_args, _) = binding.copy_args(model_args)
+        else:
+            self.model_args = deepcopy(model_args)
+        self.cost_args  = cost_args
+
+    def __iter__(self):
+        r"""Generates the innovations chunk by chunk, with any NaNs set to zero."""
+        for chunk in self.cost_func(self.results, **self.model_args, **self.cost_args):
+            chunk = np.array(chunk, dtype=complex if np.iscomplexobj(chunk) else float)
+            chunk[np.isnan(chunk)] = 0
+            yield chunk
+
+    def copy(self):
+        r"""Returns the same instance, as there is nothing to modify."""
+        return self
+
+#%% _sum_sq
+def _sum_sq(innovs):
+    r"""
+    Sum of the squared innovations, whether given as an array or as chunks.
+
+    Examples
+    --------
+
+    >>> from dstauffman.bpe import _sum_sq
+    >>> import numpy as np
+    >>> print(_sum_sq(np.array([1., 2., np.nan])))
+    5.0
+
+    """
+    if isinstance(innovs, _InnovStream):
+        return sum(rss(chunk) for chunk in innovs)
+    return rss(innovs, ignore_nans=True)
+
+#%% _calc_cost
+def _calc_cost(opti_opts, evaluator, params, innovs):
+    r"""
+    Cost for the given parameters and innovations, which for maximum likelihood is the negative log
+    likelihood 0.5*(innovs'*innovs + log(det(B))), with the innovations already normalized by B.
+
+    Examples
+    --------
+
+    >>> from dstauffman.bpe import OptiOpts, _calc_cost
+    >>> import numpy as np
+    >>> opti_opts = OptiOpts()
+    >>> print(_calc_cost(opti_opts, None, np.array([1.]), np.array([1., 2.])))
+    2.5
+
+    """
+    cost = 0.5 * _sum_sq(innovs)
+    if opti_opts.is_max_like:
+        cost += 0.5 * evaluator.log_det(params)
+    return cost
+
+#%% _setup_cost_args
+def _setup_cost_args(opti_opts, model_args):
+    r"""
+    Runs the optional cost setup function, and returns the cost arguments to use for every evaluation.
+
+    Parameters
+    ----------
+    opti_opts : class OptiOpts
+        Optimization options
+    model_args : dict
+        Model arguments, as given to the model function
+
+    Returns
+    -------
+    cost_args : dict
+        The opti_opts.cost_args, plus any outputs from opti_opts.cost_setup_func
+
+    Notes
+    -----
+    #.  The setup function is called as cost_setup_func(**model_args, **cost_args), and must return a
+        dictionary of additional cost arguments, such as the truth data already interpolated to the
+        results time, that are then passed to every call of the cost function.  Its outputs must not
+        depend on the parameters being estimated, as it is only run once before the initial simulation.
+
+    Examples
+    --------
+
+    >>> from dstauffman.bpe import OptiOpts, _setup_cost_args
+    >>> opti_opts = OptiOpts()
+    >>> opti_opts.cost_args = {'b': 2}
+    >>> opti_opts.cost_setup_func = lambda a, b: {'c': a + b}
+    >>> cost_args = _setup_cost_args(opti_opts, {'a': 1})
+    >>> print(sorted(cost_args.items()))
+    [('b', 2), ('c', 3)]
+
+    """
+    if opti_opts.cost_setup_func is None:
+        return opti_opts.cost_args
+    setup = opti_opts.cost_setup_func(**model_args, **opti_opts.cost_args)
+    cost_args = dict(opti_opts.cost_args)
+    cost_args.update(setup)
+    return cost_args
+
+#%% _incremental_wrapper
+def _incremental_wrapper(opti_opts, bpe_results, model_args, cost_args, max_cost=None):
+    r"""
+    Runs an incremental model, and finds the innovations of each chunk of its results as it goes.
+
+    An incremental model is a generator function that yields its results one chunk at a time, such
+    as once per simulated year, and the cost function is called on each chunk in turn.
+
+    Parameters
+    ----------
+    opti_opts : class OptiOpts
+        Optimization options
+    bpe_results : class BpeResults
+        Results, used to record the cost function times and any aborted evaluation
+    model_args : dict
+        Model arguments
+    cost_args : dict
+        Cost arguments
+    max_cost : float, optional
+        Cost to abort the evaluation at, as soon as the running 0.5*sum(innovs**2) exceeds it
+
+    Returns
+    -------
+    results : object
+        Return value of the generator, or the list of the yielded chunks if it doesn't return anything
+    innovs : ndarray
+        Innovations of all the chunks, concatenated in order, or None if the evaluation was aborted
+
+    Notes
+    -----
+    #.  The generator is always closed before returning, so the model can clean up in a finally clause.
+
+    Examples
+    --------
+
+    >>> from dstauffman.bpe import OptiOpts, BpeResults, _incremental_wrapper
+    >>> import numpy as np
+    >>> def model(offset):
+    ...     for year in range(3):
+    ...         yield np.array([1., 2.]) + offset * year
+    >>> opti_opts = OptiOpts()
+    >>> opti_opts.cost_func = lambda results, offset: results
+    >>> bpe_results = BpeResults()
+    >>> opti_opts.model_func = model
+    >>> (results, innovs) = _incremental_wrapper(opti_opts, bpe_results, {'offset': 1.}, {})
+    >>> print(innovs)
+    [1. 2. 2. 3. 3. 4.]
+
+    >>> (results, innovs) = _incremental_wrapper(opti_opts, bpe_results, {'offset': 1.}, {}, max_cost=5.)
+    >>> print(innovs, bpe_results.num_aborted)
+    None 1
+
+    """
+    generator  = opti_opts.model_func(**model_args)
+    chunks     = []
+    all_innovs = []
+    cost       = 0.
+    try:
+        while True:
+            try:
+                chunk = next(generator)
+            except StopIteration as stop:
+                results = stop.value if stop.value is not None else chunks
+                break
+            chunks.append(chunk)
+            with _timed(opti_opts, bpe_results, 'cost'):
+                innovs = opti_opts.cost_func(chunk, **model_args, **cost_args)
+            # Set any NaNs to zero so that they are ignored
+            innovs[np.isnan(innovs)] = 0
+            all_innovs.append(innovs)
+            cost += 0.5 * rss(innovs)
+            if max_cost is not None and cost > max_cost:
+                _log(8, '  Model run aborted after %d chunks, with a partial cost of %s.', len(chunks), cost)
+                bpe_results.num_aborted += 1
+                return (None, None)
+    finally:
+        generator.close()
+    innovs = np.concatenate(all_innovs) if all_innovs else np.zeros(0)
+    return (results, innovs)
 
 #%% _function_wrapper
-def _function_wrapper(opti_opts, bpe_results, model_args=None, cost_args=None):
+def _function_wrapper(opti_opts, bpe_results, model_args=None, cost_args=None, *, params=None, \
+        cache=None, need_results=False, max_cost=None, jacobians=None, binding=None):
     r"""
     Wraps the call to the model function, and returns the results from the model, plus the
     innovations as defined by the given cost function.
+
+    Notes
+    -----
+    #.  If a cache and the parameter values that were passed to set_param_func are given, then a
+        previous evaluation of the same parameters is returned without re-running the model.  The
+        results are None for a cache hit unless the cache keeps them or need_results is True.
+    #.  If the model function is a generator function, then it is run incrementally, and if max_cost
+        is also given, then the evaluation is aborted, with both outputs None, once it costs more.
+    #.  If opti_opts.model_jacobian is True, then the model returns (results, jacobian), and if a dict
+        of jacobians and the parameter values are given, then the jacobian is kept in it, keyed by
+        the bytes of the parameter values.
+    #.  If opti_opts.stream_innovs is True, then the binding, if given, is used to copy just the
+        parameters within the model arguments that the streamed innovations keep.
     """
     # pull inputs from opti_opts if necessary
     if model_args is None:
@@ -301,20 +1152,1003 @@ def _function_wrapper(opti_opts, bpe_results, model_args=None, cost_args=None):
     if cost_args is None:
         cost_args = opti_opts.cost_args
 
+    # check for a previous evaluation of these parameters
+    use_cache = cache is not None and params is not None
+    if use_cache:
+        cached = cache.get(params, need_results=need_results)
+        if cached is not None:
+            bpe_results.num_cache_hits += 1
+            return cached
+        bpe_results.num_cache_misses += 1
+
+    if inspect.isgeneratorfunction(opti_opts.model_func):
+        # Run the model and cost functions a chunk at a time, and stop early if it's already too costly
+        with _timed(opti_opts, bpe_results, 'model'):
+            (results, innovs) = _incremental_wrapper(opti_opts, bpe_results, model_args, cost_args, max_cost)
+        bpe_results.num_evals += 1
+        if innovs is None:
+            return (None, None)
+    else:
+        # Run the model to get the results
+        with _timed(opti_opts, bpe_results, 'model'):
+            results = opti_opts.model_func(**model_args)
+        bpe_results.num_evals += 1
+
+        # Keep any derivatives that came from the same model run
+        if opti_opts.model_jacobian:
+            (results, jacobian) = results
+            if jacobians is not None and params is not None:
+                jacobians[params.tobytes()] = np.array(jacobian, dtype=float)
+
+        # Run the cost function to get the innovations, or just keep the results to get them in chunks later
+        if opti_opts.stream_innovs:
+            innovs = _InnovStream(opti_opts, results, model_args, cost_args, binding)
+        else:
+            with _timed(opti_opts, bpe_results, 'cost'):
+                innovs = opti_opts.cost_func(results, **model_args, **cost_args)
+
+            # Set any NaNs to zero so that they are ignored
+            innovs[np.isnan(innovs)] = 0
+
+    # store this evaluation for later
+    if use_cache:
+        cache.put(params, results, innovs)
+
+    return (results, innovs)
+
+#%% _async_function_wrapper
+async def _async_function_wrapper(opti_opts, bpe_results, model_args, cost_args=None, binding=None):
+    r"""
+    Wraps the call to a coroutine model function, and returns the results from the model, plus the
+    innovations as defined by the given cost function, which may also be a coroutine function.
+    """
+    # pull inputs from opti_opts if necessary
+    if cost_args is None:
+        cost_args = opti_opts.cost_args
+
     # Run the model to get the results
-    results = opti_opts.model_func(**model_args)
     bpe_results.num_evals += 1
+    with _timed(opti_opts, bpe_results, 'model'):
+        results = await opti_opts.model_func(**model_args)
 
     # Run the cost function to get the innovations
-    innovs = opti_opts.cost_func(results, **model_args, **cost_args)
+    if opti_opts.stream_innovs:
+        return (results, _InnovStream(opti_opts, results, model_args, cost_args, binding))
+    with _timed(opti_opts, bpe_results, 'cost'):
+        innovs = opti_opts.cost_func(results, **model_args, **cost_args)
+        if asyncio.iscoroutine(innovs):
+            innovs = await innovs
 
     # Set any NaNs to zero so that they are ignored
     innovs[np.isnan(innovs)] = 0
-
     return (results, innovs)
 
+#%% _batch_function_wrapper
+def _batch_function_wrapper(opti_opts, bpe_results, names, param_sets, model_args=None, cost_args=None, *, \
+        binding=None):
+    r"""
+    Wraps a single call to the batch model function for many sets of parameters, and returns the
+    results from the model, plus the innovations for each set as defined by the given cost function.
+
+    Notes
+    -----
+    #.  The batch model function is called as batch_model_func(names=names, values=values, **model_args),
+        where values is a (num_sets, num_param) matrix, and must return an indexable sequence of
+        num_sets model results, such as a stacked ndarray.  The cost function is then called on each,
+        with the parameters of that set put into the model arguments first, using the binding if there
+        is one, so that the cost function can depend on them like it can for a single model run.
+    #.  The time of the batch model call is recorded as an equal share for each of the sets.
+    """
+    # pull inputs from opti_opts if necessary
+    if model_args is None:
+        model_args = opti_opts.model_args
+    if cost_args is None:
+        cost_args = opti_opts.cost_args
+
+    # Run the model for all the parameter sets at once
+    values  = np.vstack(param_sets)
+    start   = time.perf_counter()
+    results = opti_opts.batch_model_func(names=names, values=values, **model_args)
+    elapsed = (time.perf_counter() - start) / values.shape[0]
+    for _ in range(values.shape[0]):
+        _record_event(opti_opts, bpe_results, 'model', elapsed)
+    bpe_results.num_evals += values.shape[0]
+
+    # Run the cost function to get the innovations for each set
+    all_innovs = []
+    for i_set in range(values.shape[0]):
+        _set_params(opti_opts, names, values[i_set], model_args, binding)
+        if opti_opts.stream_innovs:
+            all_innovs.append(_InnovStream(opti_opts, results[i_set], model_args, cost_args, binding))
+            continue
+        with _timed(opti_opts, bpe_results, 'cost'):
+            innovs = opti_opts.cost_func(results[i_set], **model_args, **cost_args)
+        # Set any NaNs to zero so that they are ignored
+        innovs[np.isnan(innovs)] = 0
+        all_innovs.append(innovs)
+
+    return (results, all_innovs)
+
+#%% _SharedArrayRef
+class _SharedArrayRef(Frozen):
+    r"""
+    Reference to an array that was put into a shared memory block or memory mapped file, which pickles
+    to just a few bytes.
+    """
+    def __init__(self, name, shape, dtype, is_file=False):
+        self.name    = name
+        self.shape   = shape
+        self.dtype   = dtype
+        self.is_file = is_file
+
+#%% _replace_arrays
+def _replace_arrays(obj, func, types):
+    r"""
+    Returns a copy of the given object with everything of the given types replaced by func(item).
+
+    Dictionaries, lists, tuples and the attributes of class instances are searched recursively, and
+    anything that doesn't contain a replaced item is returned as is.
+
+    Examples
+    --------
+
+    >>> from dstauffman.bpe import _replace_arrays
+    >>> import numpy as np
+    >>> args = {'a': np.ones(2), 'b': [np.zeros(1), 5]}
+    >>> out = _replace_arrays(args, lambda x: x.size, np.ndarray)
+    >>> print(out)
+    {'a': 2, 'b': [1, 5]}
+
+    """
+    if isinstance(obj, types):
+        return func(obj)
+    if isinstance(obj, dict):
+        out = {key: _replace_arrays(value, func, types) for (key, value) in obj.items()}
+        changed = any(out[key] is not obj[key] for key in obj)
+    elif isinstance(obj, (list, tuple)):
+        out = [_replace_arrays(value, func, types) for value in obj]
+        changed = any(new is not old for (new, old) in zip(out, obj))
+        if changed and isinstance(obj, tuple):
+            out = type(obj)(out) if not hasattr(obj, '_fields') else type(obj)(*out)
+    elif hasattr(obj, '__dict__') and not isinstance(obj, (type, ModuleType)) and not callable(obj):
+        new = {key: _replace_arrays(value, func, types) for (key, value) in vars(obj).items()}
+        changed = any(new[key] is not value for (key, value) in vars(obj).items())
+        if changed:
+            out = copy(obj)
+            for (key, value) in new.items():
+                setattr(out, key, value)
+    else:
+        changed = False
+    return out if changed else obj
+
+#%% _SharedArrays
+class _SharedArrays(Frozen):
+    r"""
+    Puts the large arrays within the model and cost arguments into shared memory blocks, so that they
+    are only sent to the worker processes once as read-only views, instead of copied to each one.
+
+    Parameters
+    ----------
+    min_bytes : int
+        Minimum size of the arrays to share, smaller ones are just copied as normal
+    use_files : bool, optional
+        Whether to use memory mapped files instead of multiprocessing.shared_memory blocks, defaults to
+        using files unless the blocks are fully supported
+
+    Notes
+    -----
+    #.  The multiprocessing.shared_memory blocks are only used in Python v3.13+, where the workers can
+        attach to them without registering them with the resource tracker, which could otherwise
+        unlink them or warn about leaks when a worker exits.  Before that, each array is written once
+        to a memory mapped file, in /dev/shm if it exists, which the workers map read-only, so the
+        operating system still shares the same pages between all of them.
+    #.  The shared arrays are read-only within the workers, so must not be modified by set_param_func.
+    #.  The blocks or files are owned by this instance, and must be released with `close`.
+    """
+    def __init__(self, min_bytes, use_files=None):
+        self.min_bytes = min_bytes
+        self.use_files = not _SHM_BLOCKS if use_files is None else use_files
+        self.folder    = None
+        self.blocks    = []
+
+    def _share_array(self, array):
+        r"""Copies the array into a new shared memory block or file, and returns a reference to it."""
+        if array.nbytes < max(self.min_bytes, 1) or array.dtype.hasobject:
+            return array
+        if self.use_files:
+            if self.folder is None:
+                self.folder = tempfile.mkdtemp(prefix='dcs_bpe_', dir='/dev/shm' if os.path.isdir('/dev/shm') \
+                    else None)
+            filename = os.path.join(self.folder, 'array{}.bin'.format(len(self.blocks)))
+            self.blocks.append(filename)
+            view = np.memmap(filename, dtype=array.dtype, mode='w+', shape=array.shape)
+            view[...] = array
+            view.flush()
+            del view
+            return _SharedArrayRef(filename, array.shape, array.dtype.str, is_file=True)
+        block = shared_memory.SharedMemory(create=True, size=array.nbytes)
+        self.blocks.append(block)
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        view[...] = array
+        return _SharedArrayRef(block.name, array.shape, array.dtype.str)
+
+    def share(self, obj):
+        r"""Returns a copy of the object with the large arrays replaced by shared memory references."""
+        return _replace_arrays(obj, self._share_array, np.ndarray)
+
+    def close(self):
+        r"""Releases all the shared memory blocks, or deletes the files."""
+        for block in self.blocks:
+            if not isinstance(block, str):
+                block.close()
+                block.unlink()
+        self.blocks = []
+        if self.folder is not None:
+            shutil.rmtree(self.folder, ignore_errors=True)
+            self.folder = None
+
+#%% _attach_shared
+def _attach_shared(obj, attached):
+    r"""
+    Returns a copy of the object with the shared memory references replaced by read-only views of the
+    arrays, and appends the (block, view) pairs to the given list, as the blocks must be kept open.
+    """
+    def attach(ref):
+        if ref.is_file:
+            block = None
+            view  = np.memmap(ref.name, dtype=np.dtype(ref.dtype), mode='r', shape=ref.shape)
+        else:
+            block = shared_memory.SharedMemory(name=ref.name, track=False)
+            view  = np.ndarray(ref.shape, dtype=np.dtype(ref.dtype), buffer=block.buf)
+        view.flags.writeable = False
+        attached.append((block, view))
+        return view
+    return _replace_arrays(obj, attach, _SharedArrayRef)
+
+#%% _parallel_init
+# storage for the options and private model arguments used within each worker process
+_WORKER_STATE = {}
+
+def _parallel_init(opti_opts, names, model_args, cost_args):
+    r"""
+    Initializes a worker process with its own copy of the model and cost arguments.
+
+    Any arrays that were put into shared memory are attached as read-only views, which are shared
+    instead of copied along with the rest of the model arguments.
+    """
+    attached   = []
+    model_args = _attach_shared(model_args, attached)
+    cost_args  = _attach_shared(cost_args, attached)
+    _WORKER_STATE['opti_opts']  = opti_opts
+    _WORKER_STATE['names']      = names
+    _WORKER_STATE['shared']     = attached
+    _WORKER_STATE['model_args'] = deepcopy(model_args, {id(view): view for (_, view) in attached})
+    _WORKER_STATE['cost_args']  = cost_args
+    _WORKER_STATE['binding']    = _ParamBinding(names, _WORKER_STATE['model_args']) if opti_opts.bind_params \
+        else None
+
+#%% _parallel_function_wrapper
+def _parallel_function_wrapper(values, max_cost=None):
+    r"""
+    Sets the given parameter values and runs the model and cost functions within a worker process.
+
+    Returns the innovations, plus the model and cost times, which are recorded by the parent process.
+    The innovations are None if the evaluation of an incremental model was aborted at the max_cost.
+    """
+    opti_opts  = _WORKER_STATE['opti_opts']
+    model_args = _WORKER_STATE['model_args']
+    # the evaluation count is tracked by the parent process, so use a throw away instance here
+    counter    = BpeResults()
+    _set_params(opti_opts, _WORKER_STATE['names'], values, model_args, _WORKER_STATE['binding'])
+    (_, innovs) = _function_wrapper(opti_opts, counter, model_args, _WORKER_STATE['cost_args'], \
+        max_cost=max_cost)
+    return (innovs, counter.model_times, counter.cost_times)
+
+#%% _WorkerPool
+class _WorkerPool(Frozen):
+    r"""
+    Dispatches model evaluations to remote worker processes started with serve_bpe_worker.
+
+    Parameters
+    ----------
+    addresses : list of (str, int)
+        Host and port of each worker
+    authkey : bytes
+        Authentication key shared with the workers
+    timeout : float
+        Seconds without hearing from a busy worker before it is considered dead
+    init_args : tuple
+        (opti_opts, names, model_args, cost_args) sent to each worker when connecting
+
+    Notes
+    -----
+    #.  Each worker is given one evaluation at a time.  Workers only send heartbeats while evaluating,
+        so the idle ones have nothing to read, and any busy worker that disconnects or goes quiet for
+        longer than the timeout is dropped, with its evaluation sent to another worker instead.
+    #.  Every evaluation has a task id, and the outputs are returned in task order, so the results
+        don't depend on which worker ran what, or on how long each one took.
+    """
+    def __init__(self, addresses, authkey, timeout, init_args):
+        self.addresses = addresses
+        self.authkey   = authkey
+        self.timeout   = timeout
+        self.init_args = init_args
+        self.conns     = []
+
+    def start(self):
+        r"""Connects to all the workers that are reachable."""
+        for address in self.addresses:
+            try:
+                conn = Client(tuple(address), authkey=self.authkey)
+                conn.send(('init',) + self.init_args)
+            except (OSError, EOFError) as error:
+                _log(5, 'Unable to connect to BPE worker at %s: %s', address, error)
+                continue
+            self.conns.append(conn)
+        if not self.conns:
+            raise ConnectionError('Unable to connect to any of the BPE workers.')
+
+    def close(self):
+        r"""Tells the workers that this run is finished, and closes the connections."""
+        for conn in self.conns:
+            try:
+                conn.send(('close',))
+            except OSError: # pragma: no cover
+                pass
+            conn.close()
+        self.conns = []
+
+    def _drop(self, conn):
+        r"""Drops a dead worker."""
+        _log(5, 'Lost connection to a BPE worker, %d remaining.', len(self.conns) - 1)
+        self.conns.remove(conn)
+        conn.close()
+
+    def map(self, param_sets):
+        r"""Evaluates all the parameter sets on the workers, and returns the outputs of each in order."""
+        pending   = list(range(len(param_sets)))
+        outputs   = [None] * len(param_sets)
+        busy      = {} # conn: [task_id, time last heard from]
+        num_done  = 0
+        while num_done < len(param_sets):
+            if not self.conns:
+                raise ConnectionError('All the BPE workers have died.')
+            # give every idle worker an evaluation to do
+            for conn in list(self.conns):
+                if conn not in busy and pending:
+                    task_id = pending.pop(0)
+                    try:
+                        conn.send(('eval', task_id, param_sets[task_id]))
+                    except OSError:
+                        pending.insert(0, task_id)
+                        self._drop(conn)
+                        continue
+                    busy[conn] = [task_id, time.time()]
+            # wait for any of the workers to respond
+            for conn in mp_wait(list(busy), timeout=min(self.timeout, 1.)):
+                try:
+                    message = conn.recv()
+                except (OSError, EOFError):
+                    message = ('dead',)
+                if message[0] == 'heartbeat':
+                    busy[conn][1] = time.time()
+                elif message[0] == 'result':
+                    outputs[message[1]] = message[2]
+                    num_done += 1
+                    del busy[conn]
+                elif message[0] == 'error':
+                    raise RuntimeError('BPE worker failed to evaluate the model:\n' + message[2])
+                else:
+                    pending.insert(0, busy.pop(conn)[0])
+                    self._drop(conn)
+            # drop any workers that have stopped responding
+            now = time.time()
+            for conn in [conn for (conn, (_, last)) in busy.items() if now - last > self.timeout]:
+                pending.insert(0, busy.pop(conn)[0])
+                self._drop(conn)
+            pending.sort()
+        return outputs
+
+#%% _Evaluator
+class _Evaluator(Frozen):
+    r"""
+    Evaluates the model and cost functions for sets of parameter values, either serially within
+    this process or in parallel with a pool of worker processes.
+
+    Notes
+    -----
+    #.  The pool is only created by `start`, and must be cleaned up with `close`.
+    #.  Results are always returned in the same order as the given parameter sets, so the parallel
+        and serial modes give identical answers.
+    #.  If the model function is a coroutine function, then the sets are instead run concurrently on
+        an event loop, each with its own copy of the model arguments, up to opti_opts.max_concurrency
+        at a time, and any evaluation that takes longer than opti_opts.eval_timeout is cancelled.
+        With opti_opts.bind_params, only the objects along the parameter paths are copied.
+    #.  The coroutines run on the given event loop, which may already be running in another thread,
+        such as the one calling `run_bpe_async`, or else on a temporary loop for each call.
+    #.  If opti_opts.worker_addresses is given, then the sets are instead sent to the remote workers,
+        but single sets, such as the initial, trial and final evaluations, always run within this process.
+    #.  The cost arguments, including the outputs of any opti_opts.cost_setup_func, are determined once
+        on creation, and sent to any workers along with the model arguments.
+    #.  If opti_opts.model_jacobian is True, then the derivatives from the models run in this process are
+        kept until the next call to `jacobian`, so that the accepted trial step doesn't need running again.
+    """
+    def __init__(self, opti_opts, model_args, names, *, loop=None):
+        self.opti_opts  = opti_opts
+        self.model_args = model_args
+        self.cost_args  = _setup_cost_args(opti_opts, model_args)
+        self.names      = names
+        self.pool       = None
+        self.workers    = None
+        self.shared     = None
+        self.binding    = _ParamBinding(names, model_args) if opti_opts.bind_params else None
+        self.jacobians  = {}
+        self.loop       = loop
+        if opti_opts.disk_cache and opti_opts.output_folder:
+            disk_cache  = _DiskCache(os.path.join(opti_opts.output_folder, 'eval_cache'), names, \
+                opti_opts.model_version, opti_opts.disk_cache_max_bytes)
+        else:
+            disk_cache  = None
+        if opti_opts.cache_max_bytes or disk_cache is not None:
+            self.cache  = _EvalCache(opti_opts.cache_max_bytes, keep_results=opti_opts.cache_results, \
+                disk_cache=disk_cache)
+        else:
+            self.cache  = None
+
+    @property
+    def num_cores(self):
+        r"""Number of worker processes to use, with zero meaning serial."""
+        max_cores = self.opti_opts.max_cores
+        if max_cores is None or max_cores == 0:
+            return 0
+        if max_cores < 0:
+            return multiprocessing.cpu_count()
+        return max_cores
+
+    def get_params(self):
+        r"""Gets the current parameter values from the shared model arguments."""
+        if self.binding is not None:
+            return self.binding.get()
+        return self.opti_opts.get_param_func(names=self.names, **self.model_args)
+
+    def set_params(self, values):
+        r"""Sets the parameter values within the shared model arguments."""
+        _set_params(self.opti_opts, self.names, values, self.model_args, self.binding)
+
+    def log_det(self, values):
+        r"""Gets the log determinant of the innovation covariance for the given parameter values."""
+        if self.opti_opts.log_det_func is None:
+            return 0.
+        self.set_params(values)
+        return float(self.opti_opts.log_det_func(**self.model_args, **self.cost_args))
+
+    def jacobian(self, bpe_results, values):
+        r"""Runs the Jacobian function for a single set of parameter values, and returns the derivatives."""
+        if self.opti_opts.model_jacobian:
+            # use the derivatives from the model run at these parameters, or else run the model again for them
+            jacobian = self.jacobians.get(values.tobytes())
+            self.jacobians.clear()
+            if jacobian is not None:
+                return jacobian
+            self.set_params(values)
+            with _timed(self.opti_opts, bpe_results, 'model'):
+                (_, jacobian) = self.opti_opts.model_func(**self.model_args)
+            bpe_results.num_evals += 1
+            return np.array(jacobian, dtype=float)
+        self.set_params(values)
+        with _timed(self.opti_opts, bpe_results, 'model'):
+            jacobian = self.opti_opts.jacobian_func(names=self.names, **self.model_args, **self.cost_args)
+        bpe_results.num_evals += 1
+        return np.array(jacobian, dtype=float)
+
+    @property
+    def is_async(self):
+        r"""Whether the model function is a coroutine function that is run on an event loop."""
+        return asyncio.iscoroutinefunction(self.opti_opts.model_func)
+
+    def _run_async(self, bpe_results, param_sets, model_args=None):
+        r"""
+        Runs the coroutine model for all the parameter sets concurrently, and returns the lists of
+        results and innovations, which are both None for any evaluations that timed out.
+        """
+        async def run_set(semaphore, values):
+            async with semaphore:
+                if model_args is None and self.binding is not None:
+                    (this_args, binding) = self.binding.copy_args(self.model_args)
+                    binding.set(values)
+                elif model_args is None:
+                    # the set_param_func could change anything, so copy everything
+                    this_args = deepcopy(self.model_args)
+                    binding   = None
+                    _set_params(self.opti_opts, self.names, values, this_args)
+                else:
+                    (this_args, binding) = (model_args, self.binding)
+                try:
+                    return await asyncio.wait_for(_async_function_wrapper(self.opti_opts, bpe_results, \
+                        this_args, self.cost_args, binding), timeout=self.opti_opts.eval_timeout)
+                except asyncio.TimeoutError:
+                    return (None, None)
+
+        async def run_all():
+            semaphore = asyncio.Semaphore(self.opti_opts.max_concurrency)
+            return await asyncio.gather(*[run_set(semaphore, values) for values in param_sets])
+
+        loop = self.loop
+        if loop is None:
+            # not started, so use a temporary event loop just for these sets
+            loop = asyncio.new_event_loop()
+            try:
+                out = loop.run_until_complete(run_all())
+            finally:
+                loop.close()
+        elif loop.is_running():
+            # the loop is being driven by another thread, such as the caller of run_bpe_async
+            if asyncio._get_running_loop() is loop:
+                raise RuntimeError('The evaluations can not wait on the event loop from its own thread.')
+            out = asyncio.run_coroutine_threadsafe(run_all(), loop).result()
+        else:
+            out = loop.run_until_complete(run_all())
+        return ([x[0] for x in out], [x[1] for x in out])
+
+    def _worker_opti_opts(self):
+        r"""Copy of the options to send to the workers, without the arguments that are sent separately."""
+        opti_opts = copy(self.opti_opts)
+        opti_opts.model_args = None
+        opti_opts.cost_args  = None
+        opti_opts.event_hook = None
+        return opti_opts
+
+    def _worker_outputs(self, bpe_results, outputs):
+        r"""Records the times measured by the workers, and returns just the innovations."""
+        for (_, model_times, cost_times) in outputs:
+            for elapsed in model_times:
+                _record_event(self.opti_opts, bpe_results, 'model', elapsed)
+            for elapsed in cost_times:
+                _record_event(self.opti_opts, bpe_results, 'cost', elapsed)
+        return [output[0] for output in outputs]
+
+    def start(self):
+        r"""Creates the pool of worker processes, or connects to the remote workers, if running in parallel."""
+        if self.opti_opts.worker_addresses and self.workers is None:
+            self.workers = _WorkerPool(self.opti_opts.worker_addresses, self.opti_opts.worker_authkey, \
+                self.opti_opts.worker_timeout, (self._worker_opti_opts(), self.names, self.model_args, \
+                self.cost_args))
+            self.workers.start()
+        num_cores = self.num_cores
+        if num_cores > 0 and self.pool is None:
+            (model_args, cost_args) = (self.model_args, self.cost_args)
+            if self.opti_opts.share_arrays:
+                self.shared = _SharedArrays(self.opti_opts.share_min_bytes)
+                model_args  = self.shared.share(model_args)
+                cost_args   = self.shared.share(cost_args)
+            self.pool = multiprocessing.Pool(processes=num_cores, initializer=_parallel_init, \
+                initargs=(self._worker_opti_opts(), self.names, model_args, cost_args))
+
+    def close(self):
+        r"""Closes the pool of worker processes, and disconnects from any remote workers."""
+        if self.workers is not None:
+            self.workers.close()
+            self.workers = None
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.shared is not None:
+            self.shared.close()
+            self.shared = None
+
+    def run(self, bpe_results, param_sets, *, allow_timeouts=False, max_cost=None):
+        r"""
+        Runs the model for each set of parameter values and returns the innovations as a list.
+
+        If allow_timeouts is True, then the innovations are None for any timed out evaluations,
+        otherwise a TimeoutError is raised.  If max_cost is given, then the innovations are also None
+        for any evaluations of an incremental model that were aborted once they cost more than it,
+        which is done in this process or the local worker processes, but not on remote workers.
+        """
+        # check the cache first, and only run the remaining sets
+        innovs = [None] * len(param_sets)
+        if self.cache is not None:
+            for (ix, values) in enumerate(param_sets):
+                cached = self.cache.get(values)
+                if cached is not None:
+                    innovs[ix] = cached[1]
+                    bpe_results.num_cache_hits += 1
+                else:
+                    bpe_results.num_cache_misses += 1
+        ix_run = [ix for ix in range(len(param_sets)) if innovs[ix] is None]
+        if not ix_run:
+            return innovs
+        sets_to_run = [param_sets[ix] for ix in ix_run]
+        if self.is_async:
+            # run all the sets concurrently on an event loop
+            (new_results, new_innovs) = self._run_async(bpe_results, sets_to_run)
+            if not allow_timeouts and any(x is None for x in new_innovs):
+                raise TimeoutError('Model evaluation timed out after {} seconds.'.format(\
+                    self.opti_opts.eval_timeout))
+        elif self.opti_opts.batch_model_func is not None:
+            # run all the sets with a single call to the batch model
+            (new_results, new_innovs) = _batch_function_wrapper(self.opti_opts, bpe_results, self.names, \
+                sets_to_run, self.model_args, self.cost_args, binding=self.binding)
+        elif self.workers is not None and len(sets_to_run) > 1:
+            # send the sets to the remote workers
+            new_results = [None] * len(sets_to_run)
+            new_innovs  = self._worker_outputs(bpe_results, self.workers.map(sets_to_run))
+            bpe_results.num_evals += len(sets_to_run)
+        elif self.pool is not None and len(sets_to_run) > 1:
+            # run the sets in parallel on the worker processes
+            new_results = [None] * len(sets_to_run)
+            new_innovs  = self._worker_outputs(bpe_results, self.pool.map(partial(_parallel_function_wrapper, \
+                max_cost=max_cost), sets_to_run, chunksize=1))
+            bpe_results.num_evals += len(sets_to_run)
+            bpe_results.num_aborted += sum(1 for x in new_innovs if x is None)
+        else:
+            # run the sets one at a time
+            new_results = []
+            new_innovs  = []
+            for values in sets_to_run:
+                self.set_params(values)
+                (results, this_innovs) = _function_wrapper(self.opti_opts, bpe_results, self.model_args, \
+                    self.cost_args, params=values, max_cost=max_cost, jacobians=self.jacobians, \
+                    binding=self.binding)
+                new_results.append(results)
+                new_innovs.append(this_innovs)
+        for (i_run, ix) in enumerate(ix_run):
+            innovs[ix] = new_innovs[i_run]
+            if self.cache is not None and innovs[ix] is not None:
+                self.cache.put(param_sets[ix], new_results[i_run], new_innovs[i_run])
+        return innovs
+
+    def run_one(self, bpe_results, values, *, need_results=False, use_cache=True):
+        r"""
+        Runs the model for a single set of parameter values, and returns the (results, innovs).
+
+        The results may be None for a cache hit, unless need_results is True.
+        """
+        cache = self.cache if use_cache else None
+        if self.is_async:
+            # run with the shared model arguments, so that they are left with these parameter values
+            self.set_params(values)
+            if cache is not None:
+                cached = cache.get(values, need_results=need_results)
+                if cached is not None:
+                    bpe_results.num_cache_hits += 1
+                    return cached
+                bpe_results.num_cache_misses += 1
+            (results, innovs) = self._run_async(bpe_results, [values], self.model_args)
+            if innovs[0] is None:
+                raise TimeoutError('Model evaluation timed out after {} seconds.'.format(\
+                    self.opti_opts.eval_timeout))
+            if cache is not None:
+                cache.put(values, results[0], innovs[0])
+            return (results[0], innovs[0])
+        if self.opti_opts.batch_model_func is None:
+            self.set_params(values)
+            return _function_wrapper(self.opti_opts, bpe_results, self.model_args, self.cost_args, \
+                params=values, cache=cache, need_results=need_results, jacobians=self.jacobians, \
+                binding=self.binding)
+        if cache is not None:
+            cached = cache.get(values, need_results=need_results)
+            if cached is not None:
+                bpe_results.num_cache_hits += 1
+                return cached
+            bpe_results.num_cache_misses += 1
+        (results, innovs) = _batch_function_wrapper(self.opti_opts, bpe_results, self.names, [values], \
+            self.model_args, self.cost_args, binding=self.binding)
+        if cache is not None:
+            cache.put(values, results[0], innovs[0])
+        return (results[0], innovs[0])
+
+#%% _color_columns
+def _color_columns(sparsity):
+    r"""
+    Groups the columns of a sparse Jacobian so that no two columns in a group share a nonzero row.
+
+    Parameters
+    ----------
+    sparsity : ndarray (M, N) of bool
+        Pattern of the structurally nonzero entries of the Jacobian
+
+    Returns
+    -------
+    groups : list of list of int
+        Column indices for each group, where all the columns in a group can be perturbed together
+
+    Notes
+    -----
+    #.  Uses a greedy largest first coloring of the column intersection graph, which gives the
+        Curtis-Powell-Reid grouping for finite differences.
+
+    References
+    ----------
+    #.  Curtis, A. R., Powell, M. J. D., Reid, J. K., "On the Estimation of Sparse Jacobian
+        Matrices," IMA Journal of Applied Mathematics, Vol. 13, 1974.
+
+    Examples
+    --------
+
+    >>> from dstauffman.bpe import _color_columns
+    >>> import numpy as np
+    >>> sparsity = np.array([[1, 0, 1], [1, 0, 0], [0, 1, 0]], dtype=bool)
+    >>> print(_color_columns(sparsity))
+    [[0, 1], [2]]
+
+    """
+    # find which columns share any nonzero rows
+    sparsity = np.asarray(sparsity, dtype=int)
+    conflicts = (sparsity.T @ sparsity) > 0
+    # order the columns by decreasing number of nonzeros (stable, so ties stay in order)
+    order = np.argsort(-np.sum(sparsity, axis=0), kind='mergesort')
+    groups = []
+    for col in order:
+        for group in groups:
+            if not np.any(conflicts[col, group]):
+                group.append(col)
+                break
+        else:
+            groups.append([col])
+    # sort for a deterministic and readable order
+    groups = [sorted(int(col) for col in group) for group in groups]
+    groups.sort()
+    return groups
+
+#%% _BlockArrow
+class _BlockArrow(Frozen):
+    r"""
+    Block-arrow structure of a hierarchical estimation problem.
+
+    The global parameters affect every innovation, but the parameters of each group only affect the
+    innovations of that same group.  The Hessian approximation J'*J then has a dense block for the
+    globals, a block for each group, and the border blocks between the globals and each group, with
+    all the blocks between different groups being zero.
+
+    Parameters
+    ----------
+    param_groups : list
+        Group label of each parameter, with None for the global ones
+    innov_groups : array_like (num_innov,)
+        Group label of each innovation, where innovations without any parameters of their own group
+        only depend on the global parameters
+
+    Notes
+    -----
+    #.  The normal equations are solved with the Schur complement of the group blocks, so the cost
+        grows linearly with the number of groups, instead of cubically with the number of parameters.
+    #.  The Jacobian is only ever kept as its nonzero blocks, in a _BlockJacobian.
+
+    Examples
+    --------
+
+    >>> from dstauffman.bpe import _BlockArrow
+    >>> blocks = _BlockArrow([None, 'a', 'b', 'b'], ['a', 'a', 'b', 'b', 'b'])
+    >>> print(blocks.sparsity().astype(int))
+    [[1 1 0 0]
+     [1 1 0 0]
+     [1 0 1 1]
+     [1 0 1 1]
+     [1 0 1 1]]
+
+    >>> print(blocks.colors())
+    [[0], [1, 2], [3]]
+
+    """
+    def __init__(self, param_groups, innov_groups):
+        # find the parameters in each group, in the order the groups first appear
+        self.global_ix = np.array([ix for (ix, group) in enumerate(param_groups) if group is None], dtype=int)
+        params = {}
+        for (ix, group) in enumerate(param_groups):
+            if group is not None:
+                params.setdefault(group, []).append(ix)
+        # find the innovations in each of those groups
+        rows = {group: [] for group in params}
+        for (ix, group) in enumerate(np.asarray(innov_groups).tolist()):
+            if group in rows:
+                rows[group].append(ix)
+        self.group_ix  = [np.array(params[group], dtype=int) for group in params]
+        self.row_ix    = [np.array(rows[group], dtype=int) for group in params]
+        self.num_innov = len(innov_groups)
+        self.num_param = len(param_groups)
+        # block and column within it of each parameter, with a block of None for the globals
+        self.locations = [None] * self.num_param
+        for (ix, i_param) in enumerate(self.global_ix):
+            self.locations[i_param] = (None, ix)
+        for (i_group, cols) in enumerate(self.group_ix):
+            for (ix, i_param) in enumerate(cols):
+                self.locations[i_param] = (i_group, ix)
+
+    def sparsity(self):
+        r"""Pattern of the structurally nonzero entries of the Jacobian."""
+        sparsity = np.zeros((self.num_innov, self.num_param), dtype=bool)
+        sparsity[:, self.global_ix] = True
+        for (cols, rows) in zip(self.group_ix, self.row_ix):
+            sparsity[np.ix_(rows, cols)] = True
+        return sparsity
+
+    def colors(self):
+        r"""
+        Groups of the columns that can be perturbed together, which is each global parameter on its own,
+        and then the n-th parameter of every group together.
+        """
+        max_size = max([cols.size for cols in self.group_ix], default=0)
+        colors = [[int(ix)] for ix in self.global_ix]
+        colors.extend(sorted(int(cols[i]) for cols in self.group_ix if i < cols.size) for i in range(max_size))
+        return colors
+
+    def split(self, jacobian):
+        r"""Keeps only the nonzero blocks of the given whole Jacobian."""
+        return _BlockJacobian(self, jacobian[:, self.global_ix], [jacobian[np.ix_(rows, cols)] for (cols, rows) \
+            in zip(self.group_ix, self.row_ix)])
+
+    def gradient(self, jacobian, innovs):
+        r"""Calculates J'*innovs from only the nonzero blocks of the given _BlockJacobian."""
+        gradient = np.zeros(self.num_param, dtype=float)
+        gradient[self.global_ix] = jacobian.glob.T @ innovs
+        for (cols, rows, jac_group) in zip(self.group_ix, self.row_ix, jacobian.groups):
+            gradient[cols] = jac_group.T @ innovs[rows]
+        return gradient
+
+    def hessian(self, jacobian):
+        r"""Calculates J'*J from only the nonzero blocks of the given _BlockJacobian."""
+        glob     = self.global_ix
+        hessian  = np.zeros((self.num_param, self.num_param), dtype=float)
+        jac_glob = jacobian.glob
+        hessian[np.ix_(glob, glob)] = jac_glob.T @ jac_glob
+        for (cols, rows, jac_group) in zip(self.group_ix, self.row_ix, jacobian.groups):
+            border = jac_glob[rows, :].T @ jac_group
+            hessian[np.ix_(cols, cols)] = jac_group.T @ jac_group
+            hessian[np.ix_(glob, cols)] = border
+            hessian[np.ix_(cols, glob)] = border.T
+        return hessian
+
+    def solve(self, hessian, gradient, lambda_=0):
+        r"""
+        Solves (hessian + lambda_*I) @ x = gradient, using only the block-arrow parts of the hessian.
+
+        Each group block is eliminated with its pseudo-inverse, which allows for singular blocks, such as
+        from frozen parameters, and the remaining Schur complement for the globals is solved by least
+        squares.
+        """
+        glob   = self.global_ix
+        schur  = hessian[np.ix_(glob, glob)] + lambda_*np.eye(glob.size)
+        rhs    = gradient[glob].copy()
+        parts  = []
+        for cols in self.group_ix:
+            inv_block = np.linalg.pinv(hessian[np.ix_(cols, cols)] + lambda_*np.eye(cols.size))
+            border    = hessian[np.ix_(glob, cols)]
+            schur    -= border @ inv_block @ border.T
+            rhs      -= border @ (inv_block @ gradient[cols])
+            parts.append((cols, inv_block, border))
+        solution = np.zeros(self.num_param, dtype=float)
+        if glob.size > 0:
+            solution[glob] = np.linalg.lstsq(schur, rhs, rcond=None)[0]
+        for (cols, inv_block, border) in parts:
+            solution[cols] = inv_block @ (gradient[cols] - border.T @ solution[glob])
+        return solution
+
+    def covariance(self, hessian):
+        r"""
+        Inverts the hessian by its blocks, using the pseudo-inverses of each group block and of the Schur
+        complement for the globals.
+
+        The globals couple all the groups together, so the covariance is dense, but only the small
+        blocks are ever inverted, instead of decomposing the whole matrix.
+        """
+        glob  = self.global_ix
+        schur = hessian[np.ix_(glob, glob)].copy()
+        inv_blocks = []
+        gains      = []
+        for cols in self.group_ix:
+            inv_block = np.linalg.pinv(hessian[np.ix_(cols, cols)])
+            border    = hessian[np.ix_(glob, cols)]
+            schur    -= border @ inv_block @ border.T
+            inv_blocks.append(inv_block)
+            gains.append(inv_block @ border.T)
+        inv_schur = np.linalg.pinv(schur)
+        # stack the groups, so that all the cross terms between them are found at once
+        all_cols   = np.concatenate(self.group_ix)
+        gain       = np.vstack(gains) if gains else np.zeros((0, glob.size))
+        cross      = -gain @ inv_schur
+        covariance = np.zeros((self.num_param, self.num_param), dtype=float)
+        covariance[np.ix_(glob, glob)] = inv_schur
+        covariance[np.ix_(all_cols, glob)] = cross
+        covariance[np.ix_(glob, all_cols)] = cross.T
+        covariance[np.ix_(all_cols, all_cols)] = -cross @ gain.T
+        for (cols, inv_block) in zip(self.group_ix, inv_blocks):
+            covariance[np.ix_(cols, cols)] += inv_block
+        return covariance
+
+#%% _BlockJacobian
+class _BlockJacobian(Frozen):
+    r"""
+    Jacobian of a hierarchical estimation problem, kept as only the nonzero blocks of its _BlockArrow.
+
+    Parameters
+    ----------
+    blocks : class _BlockArrow
+        Block-arrow structure of the problem
+    glob : ndarray (num_innov, num_global)
+        Columns of the global parameters
+    groups : list of ndarray
+        Block of each group, with the rows of its innovations and the columns of its parameters
+
+    Examples
+    --------
+
+    >>> from dstauffman.bpe import _BlockArrow, _BlockJacobian
+    >>> import numpy as np
+    >>> blocks = _BlockArrow([None, 'a', 'b'], ['a', 'b', 'b'])
+    >>> jacobian = _BlockJacobian.zeros(blocks)
+    >>> jacobian.set_column(2, np.array([1., 2., 3.]))
+    >>> print(jacobian.toarray())
+    [[0. 0. 0.]
+     [0. 0. 2.]
+     [0. 0. 3.]]
+
+    """
+    def __init__(self, blocks, glob, groups):
+        self.blocks = blocks
+        self.glob   = glob
+        self.groups = groups
+
+    @classmethod
+    def zeros(cls, blocks):
+        r"""Creates an all zero Jacobian with the given structure."""
+        return cls(blocks, np.zeros((blocks.num_innov, blocks.global_ix.size), dtype=float), \
+            [np.zeros((rows.size, cols.size), dtype=float) for (cols, rows) in zip(blocks.group_ix, blocks.row_ix)])
+
+    def set_column(self, i_param, column):
+        r"""Sets the column of the given parameter, keeping only the entries within its block."""
+        (i_group, ix) = self.blocks.locations[i_param]
+        if i_group is None:
+            self.glob[:, ix] = column
+        else:
+            self.groups[i_group][:, ix] = column[self.blocks.row_ix[i_group]]
+
+    def toarray(self):
+        r"""Whole (num_innov, num_param) Jacobian, with the zeros filled in."""
+        jacobian = np.zeros((self.blocks.num_innov, self.blocks.num_param), dtype=float)
+        jacobian[:, self.blocks.global_ix] = self.glob
+        for (cols, rows, jac_group) in zip(self.blocks.group_ix, self.blocks.row_ix, self.groups):
+            jacobian[np.ix_(rows, cols)] = jac_group
+        return jacobian
+
+    def dot(self, vector):
+        r"""Calculates J*vector from only the nonzero blocks."""
+        out = self.glob @ vector[self.blocks.global_ix]
+        for (cols, rows, jac_group) in zip(self.blocks.group_ix, self.blocks.row_ix, self.groups):
+            out[rows] += jac_group @ vector[cols]
+        return out
+
+#%% _ComplexStepError
+class _ComplexStepError(ValueError):
+    r"""
+    Raised when the model or cost function doesn't keep the imaginary part of complex step perturbations.
+    """
+    pass
+
+#%% _complex_step_guard
+@contextmanager
+def _complex_step_guard(complex_step):
+    r"""
+    Treats any discarded imaginary parts as errors while evaluating complex step perturbations.
+
+    Casting a complex value to a real one only warns, which would silently lose the derivatives, so
+    those warnings and any errors from complex values that can't be converted are raised as a
+    _ComplexStepError instead.
+    """
+    if not complex_step:
+        yield
+        return
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', np.ComplexWarning)
+        try:
+            yield
+        except (np.ComplexWarning, TypeError) as error:
+            raise _ComplexStepError(str(error)) from error
+
 #%% _finite_differences
-def _finite_differences(opti_opts, model_args, bpe_results, cur_results, *, two_sided=False, normalized=False):
+def _finite_differences(opti_opts, model_args, bpe_results, cur_results, *, two_sided=False, \
+        normalized=False, evaluator=None, active=None, complex_step=False, rel_step=None, blocks=None):
     r"""
     Perturbs the state by a litte bit and calculates the numerical slope (i.e. Jacobian approximation)
 
@@ -323,22 +2157,45 @@ def _finite_differences(opti_opts, model_args, bpe_results, cur_results, *, two_
     Notes
     -----
     #.  No input variables are modified by this function.
+    #.  All the perturbed parameter sets are built first and then run as a single batch, so that the
+        model evaluations can be spread across the worker processes of the given evaluator.
+    #.  If opti_opts.stream_innovs is True, then the perturbed sets are instead run one group at a time,
+        and the base innovations and the Jacobian are written chunk by chunk to temporary memory mapped
+        files, so only the results of the current and base runs and one chunk are held in memory.  Then
+        only the gradient and Hessian are accumulated from the files, so the returned Jacobian is None.
+    #.  If a boolean active mask is given, then only those parameters are perturbed, and the Jacobian
+        columns of the others are left as zeros, so that they are frozen at their current values.
+    #.  If complex_step is True, then each parameter is perturbed by a tiny imaginary step instead, and
+        the Jacobian is the imaginary part of the innovations divided by that step.  There is no
+        subtractive cancellation, so the derivatives are accurate to near machine precision with one
+        evaluation per parameter, but the model and cost function must carry the complex values
+        through.  If they don't, then a _ComplexStepError is raised.
+    #.  If rel_step is given, then each parameter is perturbed by that fraction of the larger of its
+        magnitude and its typical value, instead of by a step based on the trust radius.
+    #.  If a _BlockArrow structure is given, then its Jacobian pattern is used instead of
+        opti_opts.jacobian_sparsity, so all the groups are perturbed together in the same model runs,
+        and the Jacobian is returned as a _BlockJacobian of only its nonzero blocks, which the gradient
+        and Hessian are calculated from.
 
     References
     ----------
     #.  Conn, Andrew R., Gould, Nicholas, Toint, Philippe, "Trust-Region Methods," MPS-SIAM Series
         on Optimization, 2000.
+    #.  Martins, Joaquim R. R. A., Sturdza, Peter, Alonso, Juan J., "The Complex-Step Derivative
+        Approximation," ACM Transactions on Mathematical Software, Vol. 29, No. 3, 2003.
 
     """
     # hard-coded values
-    sqrt_eps = np.sqrt(np.finfo(float).eps)
-    step_sf  = 0.1
+    sqrt_eps   = np.sqrt(np.finfo(float).eps)
+    step_sf    = 0.1
+    complex_sf = 1e-20
 
     # alias useful values
-    log_level     = Logger().get_level()
-    names         = [name.decode('utf-8') for name in bpe_results.param_names]
+    verbose       = _is_logging(8)
+    names         = evaluator.names if evaluator is not None else \
+        [name.decode('utf-8') for name in bpe_results.param_names]
     num_param     = cur_results.params.size
-    num_innov     = cur_results.innovs.size
+    num_innov     = None if opti_opts.stream_innovs else cur_results.innovs.size
     param_signs   = np.sign(cur_results.params)
     param_signs[param_signs == 0] = 1
     param_minstep = OptiParam.get_array(opti_opts.params, type_='minstep')
@@ -346,12 +2203,9 @@ def _finite_differences(opti_opts, model_args, bpe_results, cur_results, *, two_
     params_max    = OptiParam.get_array(opti_opts.params, type_='max')
     if normalized:
         param_typical = OptiParam.get_array(opti_opts.params, type_='typical')
+    if evaluator is None:
+        evaluator = _Evaluator(opti_opts, model_args, names)
 
-    # initialize output
-    jacobian = np.zeros((num_innov, num_param), dtype=float)
-
-    # initialize loop variables
-    grad_log_det_B = 0 # TODO: calculate somewhere later
     # set parameter pertubation (Reference 1, section 8.4.3)
     if normalized:
         perturb_fact  = 1 # TODO: how to get perturb_fact?
@@ -359,60 +2213,326 @@ def _finite_differences(opti_opts, model_args, bpe_results, cur_results, *, two_
     else:
         temp_step     = np.abs(cur_results.params)*step_sf * 1/cur_results.trust_rad
         param_perturb = param_signs * np.maximum(temp_step, param_minstep)
+    if rel_step is not None:
+        param_scale   = np.abs(np.array([param.typical for param in opti_opts.params], dtype=float))
+        param_perturb = param_signs * rel_step * np.maximum(np.abs(cur_results.params), param_scale)
+    if complex_step:
+        # the imaginary step doesn't change the real part, so it can be tiny and ignore the bounds
+        param_perturb = complex_sf * np.maximum(np.abs(cur_results.params), 1.)
+
+    # group the parameters that can be perturbed together based on the Jacobian sparsity pattern
+    if blocks is not None:
+        # the hierarchical pattern is known, so it doesn't need the general coloring
+        if blocks.num_innov != num_innov:
+            raise ValueError('The innovation groups must have length {}, not {}.'.format(num_innov, \
+                blocks.num_innov))
+        sparsity = None
+        groups   = blocks.colors()
+        _log(8, '  Perturbing %d parameters in %d groups.', num_param, len(groups))
+    elif opti_opts.jacobian_sparsity is None:
+        groups   = [[i_param] for i_param in range(num_param)]
+        sparsity = None
+    else:
+        sparsity = opti_opts.jacobian_sparsity
+        if hasattr(sparsity, 'toarray'):
+            sparsity = sparsity.toarray()
+        sparsity = np.asarray(sparsity, dtype=bool)
+        if sparsity.shape != (num_innov, num_param):
+            raise ValueError('The Jacobian sparsity pattern must have shape ({}, {}), not {}.'.format(\
+                num_innov, num_param, sparsity.shape))
+        groups = _color_columns(sparsity)
+        _log(8, '  Perturbing %d parameters in %d groups.', num_param, len(groups))
+    if active is not None:
+        groups = [[i_param for i_param in group if active[i_param]] for group in groups]
+        groups = [group for group in groups if group]
 
     temp_params_plus  = cur_results.params.copy()
     temp_params_minus = cur_results.params.copy()
 
-    for i_param in range(num_param):
+    # build the list of all the perturbed parameter sets to run
+    param_sets = []
+    for group in groups:
+        if complex_step:
+            temp_params = cur_results.params.astype(complex)
+            temp_params[group] += 1j * param_perturb[group]
+            if normalized:
+                temp_params *= param_typical
+            param_sets.append(temp_params)
+            if verbose:
+                for i_param in group:
+                    _log(8, '  Running model with %s = %s', names[i_param], temp_params[i_param])
+            continue
+
         # update the parameters for this run
-        temp_params_plus[i_param]  = np.minimum(cur_results.params[i_param] + param_perturb[i_param], params_max[i_param])
-        temp_params_minus[i_param] = np.maximum(cur_results.params[i_param] - param_perturb[i_param], params_min[i_param])
+        temp_params_plus[group]  = np.minimum(cur_results.params[group] + param_perturb[group], params_max[group])
+        temp_params_minus[group] = np.maximum(cur_results.params[group] - param_perturb[group], params_min[group])
 
         # get the new parameters for this run
         if normalized:
             temp_params = temp_params_plus * param_typical
         else:
             temp_params = temp_params_plus.copy()
-
-        # call model with new parameters
-        opti_opts.set_param_func(names=names, values=temp_params, **model_args)
-        if log_level >= 8:
-            print('  Running model with {} = {}'.format(names[i_param], temp_params[i_param]))
-        (_, new_innovs) = _function_wrapper(opti_opts, bpe_results, model_args)
+        param_sets.append(temp_params)
+        if verbose:
+            for i_param in group:
+                _log(8, '  Running model with %s = %s', names[i_param], temp_params[i_param])
 
         if two_sided:
             if normalized:
                 temp_params = temp_params_minus * param_typical
             else:
                 temp_params = temp_params_minus.copy()
-            opti_opts.set_param_func(names=names, values=temp_params, **model_args)
-            if log_level >= 8:
-                print('  Running model with {} = {}'.format(names[i_param], temp_params[i_param]))
-            (_, new_innovs_minus) = _function_wrapper(opti_opts, bpe_results, model_args)
-
-        # compute the jacobian
+            param_sets.append(temp_params)
+            if verbose:
+                for i_param in group:
+                    _log(8, '  Running model with %s = %s', names[i_param], temp_params[i_param])
+
+        # reset the parameters to the original values for next loop
+        temp_params_plus[group]  = cur_results.params[group]
+        temp_params_minus[group] = cur_results.params[group]
+
+    # number of perturbed runs for each group
+    num_runs = 2 if two_sided and not complex_step else 1
+
+    def group_delta(base_innovs, group_innovs):
+        r"""Differences in the innovations from the perturbed runs of a single group."""
+        if complex_step:
+            new_innovs = group_innovs[0]
+            if not np.iscomplexobj(new_innovs):
+                raise _ComplexStepError('The innovations are real, so the imaginary part was lost.')
+            return new_innovs.imag
         if two_sided:
-            jacobian[:, i_param] = 0.5 * (new_innovs - new_innovs_minus) / param_perturb[i_param]
-            #grad_log_det_b[i_param] = 0.25 *
+            return 0.5 * (group_innovs[0] - group_innovs[1])
+        return group_innovs[0] - base_innovs
+
+    def compute_jacobian(base_innovs, all_innovs):
+        r"""Computes the Jacobian from the given base and perturbed innovations."""
+        if blocks is None:
+            jacobian = np.zeros((base_innovs.size, num_param), dtype=float)
+        else:
+            jacobian = _BlockJacobian.zeros(blocks)
+        for (i_group, group) in enumerate(groups):
+            delta_innovs = group_delta(base_innovs, all_innovs[num_runs*i_group:num_runs*(i_group+1)])
+            for i_param in group:
+                if blocks is not None:
+                    # only keep the differences within each parameter's own block
+                    jacobian.set_column(i_param, delta_innovs / param_perturb[i_param])
+                elif sparsity is None:
+                    jacobian[:, i_param] = delta_innovs / param_perturb[i_param]
+                else:
+                    # scatter the differences back to only the innovations that this parameter affects
+                    rows = sparsity[:, i_param]
+                    jacobian[rows, i_param] = delta_innovs[rows] / param_perturb[i_param]
+        return jacobian
+
+    with _complex_step_guard(complex_step):
+        if opti_opts.stream_innovs:
+            (gradient, hessian) = _streamed_differences(evaluator, bpe_results, cur_results.innovs, \
+                param_sets, groups, num_runs, param_perturb, group_delta)
+            jacobian = None
         else:
-            jacobian[:, i_param] = (new_innovs - cur_results.innovs) / param_perturb[i_param]
+            # call model with all the new parameters
+            all_innovs = evaluator.run(bpe_results, param_sets)
 
-        # reset the parameter to the original value for next loop
-        temp_params_plus[i_param]  = cur_results.params[i_param]
-        temp_params_minus[i_param] = cur_results.params[i_param]
+            # compute the jacobian
+            jacobian = compute_jacobian(cur_results.innovs, all_innovs)
 
-    # calculate the numerical gradient with respect to the estimated parameters
-    gradient = jacobian.T @ cur_results.innovs
-    if opti_opts.is_max_like:
-        gradient += grad_log_det_B
+            if blocks is None:
+                # calculate the numerical gradient with respect to the estimated parameters
+                gradient = jacobian.T @ cur_results.innovs
 
-    # calculate the hessian matrix
-    hessian = jacobian.T @ jacobian
+                # calculate the hessian matrix
+                hessian = jacobian.T @ jacobian
+            else:
+                gradient = blocks.gradient(jacobian, cur_results.innovs)
+                hessian  = blocks.hessian(jacobian)
 
     return (jacobian, gradient, hessian)
 
+#%% _streamed_differences
+def _streamed_differences(evaluator, bpe_results, base_innovs, param_sets, groups, num_runs, param_perturb, \
+        group_delta):
+    r"""
+    Runs the perturbed parameter sets of _finite_differences one group at a time for streamed innovations,
+    and returns the gradient and Hessian.
+
+    Notes
+    -----
+    #.  The base innovations and the Jacobian are written chunk by chunk to temporary memory mapped files,
+        so that only the results of the base run and the current group's runs, plus one chunk of the
+        innovations, are ever held in memory at once, instead of the results of every perturbed run.
+    #.  The gradient and Hessian are then accumulated from the files in the same chunks, without ever
+        reading in the whole Jacobian.
+    """
+    num_param = param_perturb.size
+    gradient  = np.zeros(num_param, dtype=float)
+    hessian   = np.zeros((num_param, num_param), dtype=float)
+    with tempfile.TemporaryFile() as base_file, tempfile.TemporaryFile() as jacobian_file:
+        # spill the base innovations, and find where each chunk goes
+        shapes = []
+        for chunk in base_innovs:
+            base_file.write(np.asarray(chunk, dtype=float).tobytes())
+            shapes.append(chunk.shape)
+        bounds = np.cumsum([0] + [int(np.prod(shape)) for shape in shapes])
+        base_file.flush()
+        base_map     = np.memmap(base_file, dtype=float, mode='r', shape=(bounds[-1], ))
+        jacobian_map = np.memmap(jacobian_file, dtype=float, mode='w+', shape=(bounds[-1], num_param))
+
+        # run each group, and spill its columns of the Jacobian
+        for (i_group, group) in enumerate(groups):
+            group_innovs = evaluator.run(bpe_results, param_sets[num_runs*i_group:num_runs*(i_group+1)])
+            for (i_chunk, (shape, *chunks)) in enumerate(zip_longest(shapes, *group_innovs)):
+                if shape is None or any(chunk is None or chunk.shape != shape for chunk in chunks):
+                    raise ValueError('The innovation chunks must be the same sizes for every model run.')
+                rows = slice(bounds[i_chunk], bounds[i_chunk+1])
+                delta_innovs = group_delta(base_map[rows], chunks)
+                for i_param in group:
+                    jacobian_map[rows, i_param] = delta_innovs / param_perturb[i_param]
+            del group_innovs
+
+        # accumulate the gradient and Hessian chunk by chunk
+        for i_chunk in range(len(shapes)):
+            rows = slice(bounds[i_chunk], bounds[i_chunk+1])
+            jacobian_rows = np.array(jacobian_map[rows])
+            gradient += jacobian_rows.T @ base_map[rows]
+            hessian  += jacobian_rows.T @ jacobian_rows
+        del base_map, jacobian_map
+    return (gradient, hessian)
+
+#%% _analytic_jacobian
+def _analytic_jacobian(opti_opts, bpe_results, cur_results, evaluator, *, active=None, blocks=None):
+    r"""
+    Gets the Jacobian from the user supplied function, and calculates the gradient and Hessian from it.
+
+    Notes
+    -----
+    #.  This replaces all the perturbed model runs of _finite_differences with a single call to
+        opti_opts.jacobian_func, and returns the same outputs.  If opti_opts.model_jacobian is True,
+        then the derivatives from the model run at the current parameters are used instead, without
+        any extra calls unless that run was done elsewhere, such as by a worker or from the cache.
+    #.  If a boolean active mask is given, then the Jacobian columns of the inactive parameters are set
+        to zero, so that they are frozen at their current values.
+    #.  If a _BlockArrow structure is given, then only the nonzero blocks of the Jacobian are kept, as
+        a _BlockJacobian, and the gradient and Hessian are calculated from them.
+
+    Examples
+    --------
+
+    >>> from dstauffman.bpe import OptiOpts, BpeResults, CurrentResults, _Evaluator, _analytic_jacobian
+    >>> import numpy as np
+    >>> opti_opts = OptiOpts()
+    >>> opti_opts.cost_args = {}
+    >>> opti_opts.set_param_func = lambda names, values, x: x.__setitem__(slice(None), values)
+    >>> opti_opts.jacobian_func = lambda names, x: np.array([[2*x[0], 0.], [1., 1.]])
+    >>> evaluator = _Evaluator(opti_opts, {'x': np.zeros(2)}, ['a', 'b'])
+    >>> cur_results = CurrentResults()
+    >>> cur_results.params = np.array([3., 4.])
+    >>> cur_results.innovs = np.array([1., 0.5])
+    >>> (jacobian, gradient, hessian) = _analytic_jacobian(opti_opts, BpeResults(), cur_results, evaluator)
+    >>> print(gradient)
+    [6.5 0.5]
+
+    """
+    jacobian = evaluator.jacobian(bpe_results, cur_results.params)
+    expected = (cur_results.innovs.size, cur_results.params.size)
+    if jacobian.shape != expected:
+        raise ValueError('The Jacobian function must return shape ({}, {}), not {}.'.format(*expected, \
+            jacobian.shape))
+    if active is not None:
+        jacobian[:, ~active] = 0
+    if blocks is not None:
+        jacobian = blocks.split(jacobian)
+        return (jacobian, blocks.gradient(jacobian, cur_results.innovs), blocks.hessian(jacobian))
+    gradient = jacobian.T @ cur_results.innovs
+    hessian  = jacobian.T @ jacobian
+    return (jacobian, gradient, hessian)
+
+#%% _check_jacobian
+def _check_jacobian(opti_opts, jacobian, fd_jacobian, names):
+    r"""
+    Checks the Jacobian from the user supplied function against the finite differences one.
+
+    Notes
+    -----
+    #.  Each column is compared by the norm of its differences relative to the norm of the finite
+        differences column, and a ValueError naming the parameters is raised if any are more than
+        opti_opts.check_jacobian.
+
+    Examples
+    --------
+
+    >>> from dstauffman import Logger
+    >>> from dstauffman.bpe import OptiOpts, _check_jacobian
+    >>> import numpy as np
+    >>> logger = Logger(5)
+    >>> opti_opts = OptiOpts()
+    >>> opti_opts.check_jacobian = 0.01
+    >>> fd_jacobian = np.array([[3., 0.], [4., 1.]])
+    >>> jacobian = fd_jacobian + np.array([[0., 0.], [0.5, 0.]])
+    >>> _check_jacobian(opti_opts, jacobian, fd_jacobian, ['a', 'b']) # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ValueError: The Jacobian function disagrees with finite differences for: a.
+
+    """
+    col_norms = np.sqrt(np.sum(fd_jacobian**2, axis=0))
+    rel_diff  = np.sqrt(np.sum((jacobian - fd_jacobian)**2, axis=0)) / np.maximum(col_norms, np.finfo(float).tiny)
+    for (name, value) in zip(names, rel_diff):
+        _log(5, '  Jacobian check for %s: relative difference of %s', name, value)
+    bad = [name for (name, value) in zip(names, rel_diff) if value > opti_opts.check_jacobian]
+    if bad:
+        raise ValueError('The Jacobian function disagrees with finite differences for: {}.'.format(', '.join(bad)))
+    return rel_diff
+
+#%% _screen_params
+def _screen_params(opti_opts, jacobian, hessian):
+    r"""
+    Finds the parameters whose sensitivity is low enough to freeze them.
+
+    Parameters
+    ----------
+    opti_opts : class OptiOpts
+        Optimization options, using the typical parameter values and freeze_tol
+    jacobian : ndarray (M, N) or None
+        Jacobian of the innovations, or None to use the Hessian approximation instead
+    hessian : ndarray (N, N)
+        Hessian approximation J'*J
+
+    Returns
+    -------
+    frozen : ndarray (N, ) of bool
+        Whether each parameter is insensitive enough to be frozen
+
+    Notes
+    -----
+    #.  The sensitivity of each parameter is the norm of its Jacobian column scaled by its typical
+        value, which is the same as the norm of its row of the information SVD vectors weighted by the
+        singular values, and a parameter is frozen if that is less than opti_opts.freeze_tol times the
+        largest one.
+
+    Examples
+    --------
+
+    >>> from dstauffman.bpe import OptiOpts, OptiParam, _screen_params
+    >>> import numpy as np
+    >>> opti_opts = OptiOpts()
+    >>> opti_opts.params = [OptiParam('a'), OptiParam('b'), OptiParam('c', typical=1e-3)]
+    >>> opti_opts.freeze_tol = 0.01
+    >>> jacobian = np.array([[1., 0.001, 1.], [2., 0., 1.]])
+    >>> print(_screen_params(opti_opts, jacobian, jacobian.T @ jacobian))
+    [False  True  True]
+
+    """
+    # Note: OptiParam.get_array doesn't give out the typical values yet, so pull them out directly
+    param_typical = np.abs(np.array([param.typical for param in opti_opts.params], dtype=float))
+    if jacobian is None:
+        col_norms = np.sqrt(np.maximum(np.diag(hessian), 0))
+    else:
+        col_norms = np.sqrt(np.sum(jacobian**2, axis=0))
+    sensitivity = col_norms * param_typical
+    return sensitivity < opti_opts.freeze_tol * np.max(sensitivity)
+
 #%% _levenberg_marquardt
-def _levenberg_marquardt(jacobian, innovs, lambda_=0):
+def _levenberg_marquardt(jacobian, innovs, lambda_=0, *, svd=None):
     r"""
     Classical Levenberg-Marquardt parameter search step
 
@@ -421,6 +2541,8 @@ def _levenberg_marquardt(jacobian, innovs, lambda_=0):
     jacobian :
     lambda_  :
     innovs   :
+    svd      : tuple of (U, S, Vh), optional
+        Thin singular value decomposition of the jacobian, to reuse for every value of lambda_
 
     Returns
     -------
@@ -430,6 +2552,8 @@ def _levenberg_marquardt(jacobian, innovs, lambda_=0):
     Notes
     -----
     #.  Written by David C. Stauffer in September 2015 based on Matlab levenberg_marquardt.m function.
+    #.  With the SVD of J = U*S*V', the step is -V*diag(S/(S^2 + lambda_))*U'*innovs, so each new
+        lambda_ only costs a projection of the innovations instead of another least squares solve.
 
     Examples
     --------
@@ -443,8 +2567,21 @@ def _levenberg_marquardt(jacobian, innovs, lambda_=0):
     >>> print(delta_param)
     [-0.46825397 -1.3015873 ]
 
+    >>> svd = np.linalg.svd(jacobian, full_matrices=False)
+    >>> delta_param = _levenberg_marquardt(jacobian, innovs, lambda_, svd=svd)
+    >>> print(delta_param)
+    [-0.46825397 -1.3015873 ]
+
     """
-    if lambda_ <= 0:
+    if svd is not None:
+        (U, S, Vh) = svd
+        if lambda_ <= 0:
+            # minimum norm solution, dropping the singular values that lstsq would treat as zero
+            scale = np.divide(1., S, out=np.zeros(S.shape), where=S > np.finfo(float).eps * np.max(S, initial=0))
+        else:
+            scale = S / (S**2 + lambda_)
+        delta_param = -Vh.T @ (scale * (U.T @ innovs))
+    elif lambda_ <= 0:
         # calculate this simplified version directly
         delta_param = -np.linalg.lstsq(jacobian, innovs)[0] # in Matlab: -jacobian\innovs
     else:
@@ -458,6 +2595,32 @@ def _levenberg_marquardt(jacobian, innovs, lambda_=0):
         delta_param = -np.linalg.lstsq(jacobian_aug, innovs_aug)[0]
     return delta_param
 
+#%% _levenberg_marquardt_normal
+def _levenberg_marquardt_normal(hessian, gradient, lambda_=0):
+    r"""
+    Levenberg-Marquardt parameter search step from the normal equations, for when only the Hessian
+    approximation J'*J and the gradient J'*innovs are available instead of the whole Jacobian.
+
+    Examples
+    --------
+
+    >>> from dstauffman.bpe import _levenberg_marquardt_normal
+    >>> import numpy as np
+    >>> jacobian    = np.array([[1, 2], [3, 4], [5, 6]])
+    >>> innovs      = np.array([7, 8, 9])
+    >>> delta_param = _levenberg_marquardt_normal(jacobian.T @ jacobian, jacobian.T @ innovs, lambda_=5)
+    >>> print(delta_param)
+    [-0.46825397 -1.3015873 ]
+
+    """
+    num_params = hessian.shape[0]
+    if lambda_ <= 0:
+        # use least squares for the minimum norm solution if the Hessian is singular
+        delta_param = -np.linalg.lstsq(hessian, gradient, rcond=None)[0]
+    else:
+        delta_param = -np.linalg.solve(hessian + lambda_*np.eye(num_params), gradient)
+    return delta_param
+
 #%% _predict_func_change
 def _predict_func_change(delta_param, gradient, hessian):
     r"""
@@ -511,31 +2674,172 @@ def _predict_func_change(delta_param, gradient, hessian):
         delta_func = delta_func[0]
     return delta_func
 
+#%% _broyden_update
+def _broyden_update(jacobian, delta_param, delta_innovs):
+    r"""
+    Updates the Jacobian with a Broyden rank-one secant update.
+
+    Parameters
+    ----------
+    jacobian : ndarray (M, N)
+        Current Jacobian approximation
+    delta_param : ndarray (N,)
+        Change in parameters
+    delta_innovs : ndarray (M,)
+        Resulting change in innovations
+
+    Returns
+    -------
+    jacobian : ndarray (M, N)
+        Updated Jacobian, which exactly maps delta_param to delta_innovs
+
+    References
+    ----------
+    #.  Broyden, C. G., "A Class of Methods for Solving Nonlinear Simultaneous Equations,"
+        Mathematics of Computation, Vol. 19, 1965.
+
+    Examples
+    --------
+
+    >>> from dstauffman.bpe import _broyden_update
+    >>> import numpy as np
+    >>> jacobian     = np.array([[1., 0.], [0., 1.]])
+    >>> delta_param  = np.array([1., 0.])
+    >>> delta_innovs = np.array([2., 1.])
+    >>> print(_broyden_update(jacobian, delta_param, delta_innovs))
+    [[2. 0.]
+     [1. 1.]]
+
+    """
+    # get the squared step length, and don't update for a zero length step
+    step_len_sq = delta_param @ delta_param
+    if step_len_sq == 0:
+        return jacobian
+    return jacobian + np.outer(delta_innovs - jacobian @ delta_param, delta_param) / step_len_sq
+
+#%% _quasi_newton_update
+def _quasi_newton_update(hessian, delta_param, delta_gradient, method='bfgs'):
+    r"""
+    Updates the Hessian approximation from the change in the gradient over a step.
+
+    Parameters
+    ----------
+    hessian : ndarray (N, N)
+        Current Hessian approximation
+    delta_param : ndarray (N,)
+        Change in parameters
+    delta_gradient : ndarray (N,)
+        Resulting change in gradient
+    method : str, optional, from {'bfgs', 'sr1'}
+        Type of update
+
+    Returns
+    -------
+    hessian : ndarray (N, N)
+        Updated Hessian, which maps delta_param to delta_gradient
+
+    Notes
+    -----
+    #.  The BFGS update stays positive definite, and is skipped if the step doesn't satisfy the
+        curvature condition delta_gradient'*delta_param > 0.  The SR1 update can capture negative
+        curvature, and is skipped if its denominator is too small to be reliable.
+
+    References
+    ----------
+    #.  Nocedal, Jorge, Wright, Stephen J., "Numerical Optimization," 2nd Edition, Springer, 2006,
+        sections 6.1 and 6.2.
+
+    Examples
+    --------
+
+    >>> from dstauffman.bpe import _quasi_newton_update
+    >>> import numpy as np
+    >>> hessian        = np.eye(2)
+    >>> delta_param    = np.array([1., 0.])
+    >>> delta_gradient = np.array([3., 1.])
+    >>> print(_quasi_newton_update(hessian, delta_param, delta_gradient, method='sr1'))
+    [[3.  1. ]
+     [1.  1.5]]
+
+    """
+    # hard-coded values
+    tolerance = 1e-8
+    if method == 'bfgs':
+        curvature = delta_gradient @ delta_param
+        hess_step = hessian @ delta_param
+        step_hess_step = delta_param @ hess_step
+        if curvature <= tolerance * norm(delta_param) * norm(delta_gradient) or step_hess_step <= 0:
+            return hessian
+        return hessian - np.outer(hess_step, hess_step) / step_hess_step + \
+            np.outer(delta_gradient, delta_gradient) / curvature
+    if method == 'sr1':
+        residual = delta_gradient - hessian @ delta_param
+        denom = residual @ delta_param
+        if abs(denom) <= tolerance * norm(delta_param) * norm(residual):
+            return hessian
+        return hessian + np.outer(residual, residual) / denom
+    raise ValueError('Unexpected value for method of "{}".'.format(method))
+
+#%% _log_det_gradient
+def _log_det_gradient(opti_opts, evaluator, params):
+    r"""
+    Calculates the gradient of the 0.5*log(det(B)) term of the maximum likelihood cost.
+
+    Notes
+    -----
+    #.  This only calls opti_opts.log_det_func, which is expected to be much cheaper than the model,
+        so it uses central differences with small steps, relative to the larger of each parameter's
+        magnitude and typical value.
+    #.  The gradient is zero if there is no log_det_func.
+    #.  The evaluator is left with the given parameter values.
+
+    Examples
+    --------
+
+    >>> from dstauffman.bpe import OptiOpts, OptiParam, _Evaluator, _log_det_gradient
+    >>> import numpy as np
+    >>> opti_opts = OptiOpts()
+    >>> opti_opts.params = [OptiParam('sigma')]
+    >>> opti_opts.cost_args = {}
+    >>> opti_opts.set_param_func = lambda names, values, x: x.__setitem__(slice(None), values)
+    >>> opti_opts.log_det_func = lambda x: 2 * 10 * np.log(x[0]) # 10 innovations with a variance of sigma**2
+    >>> evaluator = _Evaluator(opti_opts, {'x': np.zeros(1)}, ['sigma'])
+    >>> print(np.round(_log_det_gradient(opti_opts, evaluator, np.array([2.])), 6))
+    [5.]
+
+    """
+    num_param = params.size
+    gradient  = np.zeros(num_param)
+    if opti_opts.log_det_func is None:
+        return gradient
+    param_scale = np.abs(np.array([param.typical for param in opti_opts.params], dtype=float))
+    step = np.cbrt(np.finfo(float).eps) * np.maximum(np.abs(params), param_scale)
+    for i in range(num_param):
+        delta = np.zeros(num_param)
+        delta[i] = step[i]
+        gradient[i] = 0.25 * (evaluator.log_det(params + delta) - evaluator.log_det(params - delta)) / step[i]
+    evaluator.set_params(params)
+    return gradient
+
 #%% _check_for_convergence
 def _check_for_convergence(opti_opts, cosmax, delta_step_len, pred_func_change):
     r"""Check for convergence."""
-    # alias the log level
-    log_level = Logger().get_level()
-
     # initialize the output and assume not converged
     convergence = False
 
     # check for and optionally display the reasons for convergence
     if cosmax <= opti_opts.tol_cosmax_grad:
         convergence = True
-        if log_level >= 5:
-            print('Declare convergence because cosmax of {} <= options.tol_cosmax_grad of {}'.format(\
-                cosmax, opti_opts.tol_cosmax_grad))
+        _log(5, 'Declare convergence because cosmax of %s <= options.tol_cosmax_grad of %s', cosmax, \
+            opti_opts.tol_cosmax_grad)
     if delta_step_len <= opti_opts.tol_delta_step:
         convergence = True
-        if log_level >= 5:
-            print('Declare convergence because delta_step_len of {} <= options.tol_delta_step of {}'.format(\
-                delta_step_len, opti_opts.tol_delta_step))
+        _log(5, 'Declare convergence because delta_step_len of %s <= options.tol_delta_step of %s', \
+            delta_step_len, opti_opts.tol_delta_step)
     if abs(pred_func_change) <= opti_opts.tol_delta_cost:
         convergence = True
-        if log_level >= 5:
-            print('Declare convergence because abs(pred_func_change) of {} <= options.tol_delta_cost of {}'.format(\
-                abs(pred_func_change), opti_opts.tol_delta_cost))
+        _log(5, 'Declare convergence because abs(pred_func_change) of %s <= options.tol_delta_cost of %s', \
+            abs(pred_func_change), opti_opts.tol_delta_cost)
     return convergence
 
 #%% _double_dogleg
@@ -643,31 +2947,269 @@ def _double_dogleg(delta_param, gradient, grad_hessian_grad, x_bias, trust_radiu
 
     return (new_delta_param, step_len, step_scale, step_type)
 
+#%% _trial_step
+def _trial_step(opti_opts, search_method, delta_param, jacobian, gradient, grad_hessian_grad, innovs, \
+        trust_radius, *, hessian=None, svd=None, blocks=None):
+    r"""
+    Computes the restrained trial parameter step for the given trust radius.
+
+    If the jacobian is None, or for maximum likelihood, then the Levenberg-Marquardt step is found from
+    the given Hessian and gradient instead, as they include the log determinant term and any quasi-Newton
+    updates, otherwise from the given SVD of the jacobian if there is one.  For maximum likelihood, the
+    step is also restrained to the trust radius, as the Gauss-Newton Hessian leaves out the curvature of
+    the log determinant term, and the damping alone can be too small compared to the Hessian to ever
+    shorten an overshooting step.  If a _BlockArrow structure is given, then the step is found from the
+    Hessian by its Schur complement.
+
+    Returns
+    -------
+    new_delta_param : ndarray
+        Trial change in parameter values
+    step_len : float
+        Length of the trial step
+    step_scale : float
+        Scale factor on the step
+    step_type : str
+        Type of step that was taken
+    """
+    if search_method == 'trust_region':
+        (new_delta_param, step_len, step_scale, step_type) = _double_dogleg(delta_param, \
+            gradient, grad_hessian_grad, opti_opts.x_bias, trust_radius)
+
+    elif search_method in {'levenberg_marquardt', 'geodesic_lm'}:
+        # Note: for geodesic_lm, this is the velocity that the acceleration is added to later
+        if blocks is not None:
+            new_delta_param = -blocks.solve(hessian, gradient, lambda_=1/trust_radius)
+        elif opti_opts.is_max_like:
+            new_delta_param = _levenberg_marquardt_normal(hessian, gradient, lambda_=1/trust_radius)
+            step_len        = norm(new_delta_param)
+            if step_len > trust_radius:
+                new_delta_param *= trust_radius / step_len
+        elif jacobian is None:
+            new_delta_param = _levenberg_marquardt_normal(hessian, gradient, lambda_=1/trust_radius)
+        else:
+            new_delta_param = _levenberg_marquardt(jacobian, innovs, lambda_=1/trust_radius, svd=svd)
+        step_type       = 'Levenberg-Marquardt'
+        step_len        = norm(new_delta_param)
+        step_scale      = step_len/norm(new_delta_param)
+
+    else:
+        raise ValueError('Unexpected value for search_method of "{}".'.format(search_method))
+    return (new_delta_param, step_len, step_scale, step_type)
+
+#%% _geodesic_acceleration
+def _geodesic_acceleration(jacobian, innovs, velocity, step_innovs, lambda_, *, step_size=0.1, svd=None, \
+        hessian=None, blocks=None):
+    r"""
+    Computes the geodesic acceleration correction to a Levenberg-Marquardt step.
+
+    Parameters
+    ----------
+    jacobian : ndarray (M, N)
+        Jacobian at the current parameters
+    innovs : ndarray (M,)
+        Innovations at the current parameters
+    velocity : ndarray (N,)
+        Levenberg-Marquardt step, which is the velocity along the geodesic
+    step_innovs : ndarray (M,)
+        Innovations at the current parameters plus step_size times the velocity
+    lambda_ : float
+        Damping of the Levenberg-Marquardt step
+    step_size : float, optional
+        Fraction of the velocity used for the extra model run
+    svd : tuple of (U, S, Vh), optional
+        Thin singular value decomposition of the jacobian, to reuse for the solve
+    hessian : ndarray (N, N), optional
+        Hessian approximation J'*J, only used with blocks
+    blocks : class _BlockArrow, optional
+        Block-arrow structure, in which case the jacobian is a _BlockJacobian, and the acceleration is
+        solved from the hessian by its Schur complement
+
+    Returns
+    -------
+    accel : ndarray (N,)
+        Geodesic acceleration, so that the corrected step is velocity + accel/2
+
+    Notes
+    -----
+    #.  The second directional derivative of the innovations along the velocity is approximated by
+        2/h*((r(x+h*v) - r(x))/h - J*v), which only needs the one extra model run, and the acceleration
+        solves the same damped system as the velocity, but with that in place of the innovations.
+    #.  Any error in the jacobian is amplified by 2/h, so it must come from two sided, complex step or
+        analytic derivatives, and not one sided finite differences.
+
+    References
+    ----------
+    #.  Transtrum, Mark K., Sethna, James P., "Improvements to the Levenberg-Marquardt algorithm for
+        nonlinear least-squares minimization," arXiv:1201.5885, 2012.
+
+    Examples
+    --------
+
+    >>> from dstauffman.bpe import _geodesic_acceleration
+    >>> import numpy as np
+    >>> jacobian    = np.eye(2)
+    >>> innovs      = np.array([1., 1.])
+    >>> velocity    = np.array([-1., 0.])
+    >>> curve = np.array([0.01, 0.]) # quadratic in the first one
+    >>> step_innovs = innovs + jacobian @ (0.1 * velocity) + curve
+    >>> accel = _geodesic_acceleration(jacobian, innovs, velocity, step_innovs, 0.)
+    >>> print(np.round(accel, 8) + 0.)
+    [-2.  0.]
+
+    """
+    jac_velocity = jacobian.dot(velocity) if blocks is not None else jacobian @ velocity
+    second_deriv = 2/step_size * ((step_innovs - innovs)/step_size - jac_velocity)
+    if blocks is not None:
+        return -blocks.solve(hessian, blocks.gradient(jacobian, second_deriv), lambda_=lambda_)
+    return _levenberg_marquardt(jacobian, second_deriv, lambda_, svd=svd)
+
+#%% _bound_params
+def _bound_params(params, params_min, params_max):
+    r"""
+    Enforces the min/max bounds on the parameters, and returns whether they were limited.
+
+    Examples
+    --------
+
+    >>> from dstauffman.bpe import _bound_params
+    >>> import numpy as np
+    >>> (params, was_limited) = _bound_params(np.array([1., 5.]), np.array([0., 0.]), np.array([2., 2.]))
+    >>> print(params)
+    [1. 2.]
+
+    >>> print(was_limited)
+    True
+
+    """
+    was_limited = False
+    if np.any(params > params_max):
+        was_limited = True
+        params = np.minimum(params, params_max)
+    if np.any(params < params_min):
+        was_limited = True
+        params = np.maximum(params, params_min)
+    return (params, was_limited)
+
+#%% _speculative_trials
+def _speculative_trials(opti_opts, search_method, orig_params, delta_param, jacobian, gradient, \
+        grad_hessian_grad, innovs, trust_radius, *, params_min, params_max, param_typical=None, hessian=None, \
+        svd=None, blocks=None):
+    r"""
+    Builds the likely sequence of trial parameter sets that the dogleg search will try.
+
+    The candidates are the first step at the current trust radius, the expanded step that would be
+    tried if that step was an improvement, and the successively shrunken steps that would be tried
+    if it was not, up to the step limit.
+
+    Returns
+    -------
+    param_sets : list of ndarray
+        Trial parameter sets, with any duplicates removed
+    """
+    # first step at the current trust radius
+    (_, step_len, _, step_type) = _trial_step(opti_opts, search_method, delta_param, jacobian, \
+        gradient, grad_hessian_grad, innovs, trust_radius, hessian=hessian, svd=svd, \
+        blocks=blocks)
+    radii = [trust_radius]
+    # expanded step, only possible if the first step was not a Newton step
+    if step_type != 'Newton':
+        radii.append(opti_opts.grow_radius * step_len)
+    # shrunken steps
+    shrunk = opti_opts.shrink_radius*step_len if step_type == 'Newton' else opti_opts.shrink_radius*trust_radius
+    for _ in range(1, opti_opts.step_limit):
+        radii.append(shrunk)
+        shrunk *= opti_opts.shrink_radius
+    # build the parameter sets
+    param_sets = []
+    keys       = set()
+    for radius in radii:
+        (new_delta_param, _, _, _) = _trial_step(opti_opts, search_method, delta_param, jacobian, \
+            gradient, grad_hessian_grad, innovs, radius, hessian=hessian, svd=svd, blocks=blocks)
+        params = orig_params + new_delta_param
+        if param_typical is not None:
+            params *= param_typical
+        (params, _) = _bound_params(params, params_min, params_max)
+        if params.tobytes() not in keys:
+            keys.add(params.tobytes())
+            param_sets.append(params)
+    return param_sets
+
 #%% _dogleg_search
 def _dogleg_search(opti_opts, model_args, bpe_results, cur_results, delta_param, jacobian, gradient, \
-        hessian, *, normalized=False):
+        hessian, *, normalized=False, evaluator=None, trials=None, svd=None, blocks=None, accurate_jacobian=True):
     r"""
     Searchs for improved parameters for nonlinear least square or maximum likelihood function, using
     a trust radius search path.
+
+    Notes
+    -----
+    #.  If opti_opts.speculative_steps is True, then the likely trial steps are all computed up
+        front and evaluated as one batch (in parallel when the evaluator has a pool).  The search
+        then proceeds exactly as it would otherwise, but uses the stored innovations instead of
+        re-running the model, so the accepted step is the same as in the sequential mode.
+    #.  If a trials list is given, then a (params, innovs, pred_func_change, is_improvement) tuple
+        is appended to it for every trial step, which allows the caller to reuse those evaluations.
+    #.  Trial steps whose model run timed out are rejected, and are not added to the trials list.
+    #.  If the model function is a generator function and opti_opts.abort_trials is True, then each
+        trial step is aborted, and likewise rejected, as soon as its partial cost is more than the
+        current cost, so the search can move on to the next trust radius right away.
+    #.  The outcome of every trial step is recorded as an 'accepted' or 'rejected' event, along with
+        the time spent on it.
+    #.  If the thin SVD of the jacobian is given, then it is reused for the Levenberg-Marquardt step at
+        every trust radius.  Likewise, if a _BlockArrow structure is given, then the step is solved
+        for with its Schur complement instead.
+    #.  For the geodesic_lm search method, each trial step runs the model once more, a small step along
+        the Levenberg-Marquardt step, to estimate the geodesic acceleration.  The correction is only
+        added if twice the acceleration is at most opti_opts.geodesic_alpha times the step, otherwise
+        the plain Levenberg-Marquardt step is tried, and either way the step is then accepted or
+        rejected by its actual cost like any other.  If accurate_jacobian is False, such as for
+        Broyden updated Jacobians, then the plain Levenberg-Marquardt steps are used instead, as the
+        velocity itself is too inaccurate for the correction to help.
     """
+    # hard-coded values
+    geodesic_h = 0.1
+
     # process inputs
     search_method = opti_opts.search_method.lower().replace(' ', '_')
     if normalized:
         param_typical = OptiParam.get_array(opti_opts.params, type_='typical')
+    else:
+        param_typical = None
 
-    # alias the log level, trust radius, parameters names and bounds
-    log_level = Logger().get_level()
+    # alias whether displaying the details, the trust radius, parameters names and bounds
+    verbose = _is_logging(8)
     trust_radius = cur_results.trust_rad
-    names = [name.decode('utf-8') for name in bpe_results.param_names]
+    names = evaluator.names if evaluator is not None else [name.decode('utf-8') for name in bpe_results.param_names]
     params_min = OptiParam.get_array(opti_opts.params, type_='min')
     params_max = OptiParam.get_array(opti_opts.params, type_='max')
+    if evaluator is None:
+        evaluator = _Evaluator(opti_opts, model_args, names)
 
-    # save a copy of the original param values
+    # save a copy of the original param values and innovations
     orig_params = cur_results.params.copy()
+    orig_innovs = cur_results.innovs
 
     # do some calculations for things constant within the loop
     grad_hessian_grad = gradient.T @ hessian @ gradient
-    log_det_B = 0 # TODO: get this elsewhere for max_likelihood mode
+
+    # any trial that costs more than the original parameters is rejected, so it can be stopped early
+    # Note: the speculative trials are all run before any are accepted, so they use the original cost
+    if opti_opts.abort_trials and not opti_opts.is_max_like:
+        max_cost = cur_results.cost
+    else:
+        max_cost = None
+
+    # optionally evaluate all the likely trial steps at once
+    trial_innovs = {}
+    if opti_opts.speculative_steps:
+        param_sets = _speculative_trials(opti_opts, search_method, orig_params, delta_param, jacobian, \
+            gradient, grad_hessian_grad, cur_results.innovs, trust_radius, params_min=params_min, \
+            params_max=params_max, param_typical=param_typical, hessian=hessian, svd=svd, blocks=blocks)
+        _log(8, '  Running model with %d speculative trial parameter sets.', len(param_sets))
+        for (params, innovs) in zip(param_sets, evaluator.run(bpe_results, param_sets, allow_timeouts=True, \
+                max_cost=max_cost)):
+            trial_innovs[params.tobytes()] = innovs
 
     # initialize status flags and counters
     try_again       = True
@@ -682,20 +3224,34 @@ def _dogleg_search(opti_opts, model_args, bpe_results, cur_results, delta_param,
     while (num_shrinks < opti_opts.step_limit) and try_again and not was_limited:
         # increment step number
         step_number += 1
+        trial_start = time.perf_counter()
 
         # compute restrained trial parameter step
-        if search_method == 'trust_region':
-            (new_delta_param, step_len, step_scale, step_type) = _double_dogleg(delta_param, \
-                gradient, grad_hessian_grad, opti_opts.x_bias, trust_radius)
+        (new_delta_param, step_len, step_scale, step_type) = _trial_step(opti_opts, search_method, \
+            delta_param, jacobian, gradient, grad_hessian_grad, cur_results.innovs, trust_radius, \
+            hessian=hessian, svd=svd, blocks=blocks)
 
-        elif search_method == 'levenberg_marquardt':
-            new_delta_param = _levenberg_marquardt(jacobian, cur_results.innovs, lambda_=1/trust_radius)
-            step_type       = 'Levenberg-Marquardt'
-            step_len        = norm(new_delta_param)
-            step_scale      = step_len/norm(new_delta_param)
-
-        else:
-            raise ValueError('Unexpected value for search_method of "{}".'.format(search_method))
+        # correct the step with the geodesic acceleration, from one more model run along its velocity
+        if search_method == 'geodesic_lm' and accurate_jacobian:
+            step_params = orig_params + geodesic_h*new_delta_param
+            if normalized:
+                step_params *= param_typical
+            (step_params, step_limited) = _bound_params(step_params, params_min, params_max)
+            if step_limited:
+                step_innovs = None
+            else:
+                step_innovs = evaluator.run(bpe_results, [step_params], allow_timeouts=True)[0]
+            if step_innovs is not None:
+                accel = _geodesic_acceleration(jacobian, orig_innovs, new_delta_param, step_innovs, \
+                    1/trust_radius, step_size=geodesic_h, svd=svd, hessian=hessian, blocks=blocks)
+                accel_ratio = 2*norm(accel) / max(norm(new_delta_param), np.finfo(float).tiny)
+                if accel_ratio <= opti_opts.geodesic_alpha:
+                    new_delta_param = new_delta_param + 0.5*accel
+                    step_len  = norm(new_delta_param)
+                    step_type = 'Geodesic LM'
+                else:
+                    _log(8, '  Geodesic acceleration ratio of %s is too large, so not using it.', \
+                        accel_ratio)
 
         # predict function change based on linearized model
         pred_func_change = _predict_func_change(new_delta_param, gradient, hessian)
@@ -706,28 +3262,30 @@ def _dogleg_search(opti_opts, model_args, bpe_results, cur_results, delta_param,
             params *= param_typical
 
         # enforce min/max bounds
-        if np.any(params > params_max):
-            was_limited = True
-            params = np.minimum(params, params_max)
-        if np.any(params < params_min):
-            was_limited = True
-            params = np.maximum(params, params_min)
-
-        # Run model
-        if log_level >= 8:
-            print('  Running model with new trial parameters.')
-        opti_opts.set_param_func(names=names, values=params, **model_args)
-        (_, innovs) = _function_wrapper(opti_opts, bpe_results, model_args)
+        (params, was_limited) = _bound_params(params, params_min, params_max)
+
+        # Run model (or use the speculative results if they were already calculated)
+        if params.tobytes() in trial_innovs:
+            innovs = trial_innovs[params.tobytes()]
+        else:
+            _log(8, '  Running model with new trial parameters.')
+            innovs = evaluator.run(bpe_results, [params], allow_timeouts=True, max_cost=cur_results.cost \
+                if max_cost is not None else None)[0]
 
         # evaluate the cost function at the new parameter values
-        sum_sq_innov = rss(innovs, ignore_nans=True)
-        if opti_opts.is_max_like:
-            trial_cost = 0.5*(sum_sq_innov + log_det_B)
+        if innovs is None:
+            # the model run timed out or was aborted, so reject it like any other bad step
+            _log(8, '  Model run timed out or was aborted.')
+            trial_cost = np.inf
         else:
-            trial_cost = 0.5 * sum_sq_innov
+            trial_cost = _calc_cost(opti_opts, evaluator, params, innovs)
 
         # check if this step actually an improvement
         is_improvement = trial_cost < cur_results.cost
+        if trials is not None and innovs is not None:
+            trials.append((params, innovs, pred_func_change, is_improvement))
+        _record_event(opti_opts, bpe_results, 'accepted' if is_improvement else 'rejected', \
+            time.perf_counter() - trial_start)
 
         # decide what to do with this step
         if is_improvement:
@@ -766,6 +3324,10 @@ def _dogleg_search(opti_opts, model_args, bpe_results, cur_results, delta_param,
                 if step_type == 'Newton':
                     # A Newton step failed.
                     trust_radius = opti_opts.shrink_radius*step_len
+                elif step_type == 'Levenberg-Marquardt' and opti_opts.is_max_like:
+                    # A maximum likelihood step failed, which is restrained to the trust radius, so
+                    # make sure that the next one is actually shorter.
+                    trust_radius = opti_opts.shrink_radius*min(trust_radius, step_len)
                 else:
                     # Some other type of step failed.
                     trust_radius *= opti_opts.shrink_radius
@@ -773,40 +3335,43 @@ def _dogleg_search(opti_opts, model_args, bpe_results, cur_results, delta_param,
                 num_shrinks += 1
                 try_again = True
 
-        if log_level >= 8:
-            print(' Tried a {} step of length: {}, (with scale: {}).'.format(step_type, step_len, step_scale))
-            print(' New trial cost: {}'.format(trial_cost))
-            print(' With result: {}'.format(step_resolution))
+        if verbose:
+            _log(8, ' Tried a %s step of length: %s, (with scale: %s).', step_type, step_len, step_scale)
+            _log(8, ' New trial cost: %s', trial_cost)
+            _log(8, ' With result: %s', step_resolution)
             if was_limited:
-                print(' Caution, the step length was limited by the given bounds.')
+                _log(8, ' Caution, the step length was limited by the given bounds.')
 
     # Display status message
-    if log_level >= 8 and num_shrinks >= opti_opts.step_limit:
-        print('Died on step cuts.')
-        print(' Failed to find any step on the dogleg path that was actually an improvement')
-        print(' before exceeding the step cut limit, which was {}  steps.'.format(opti_opts.step_limit))
+    if verbose and num_shrinks >= opti_opts.step_limit:
+        _log(8, 'Died on step cuts.')
+        _log(8, ' Failed to find any step on the dogleg path that was actually an improvement')
+        _log(8, ' before exceeding the step cut limit, which was %d  steps.', opti_opts.step_limit)
         failed = True
-    if log_level >= 5:
-        print(' New parameters are: {}'.format(cur_results.params))
+    _log(5, ' New parameters are: %s', cur_results.params)
     return failed
 
 #%% _analyze_results
-def _analyze_results(opti_opts, bpe_results, jacobian, normalized=False):
-    r"""Analyze the results."""
+def _analyze_results(opti_opts, bpe_results, jacobian, normalized=False, *, hessian=None, svd=None, \
+        blocks=None):
+    r"""
+    Analyze the results.
+
+    If the jacobian is None, then the singular values and vectors are found from the eigen
+    decomposition of the given Hessian approximation J'*J instead.  If the thin SVD of the jacobian
+    is given, then it is reused instead of decomposing the jacobian again.  If a _BlockArrow structure
+    is given, then the covariance is instead found by inverting the Hessian by its blocks, without any
+    decomposition of the whole problem, so there are no information SVD vectors.
+    """
     # hard-coded values
     min_eig = 1e-14 # minimum allowed eigenvalue
 
-    # alias the log level
-    log_level = Logger().get_level()
-
     # get the names and number of parameters
     num_params    = len(bpe_results.param_names)
 
     # update the status
-    if log_level >= 5:
-        print('Analyzing final results.')
-    if log_level >= 8:
-        print('There were a total of {} function model evaluations.'.format(bpe_results.num_evals))
+    _log(5, 'Analyzing final results.')
+    _log(8, 'There were a total of %d function model evaluations.', bpe_results.num_evals)
 
     # exit if nothing else to analyze
     if opti_opts.max_iters == 0:
@@ -819,18 +3384,32 @@ def _analyze_results(opti_opts, bpe_results, jacobian, normalized=False):
     else:
         normalize_matrix  = np.eye(num_params)
 
-    # Make information, covariance matrix, compute Singular Value Decomposition (SVD).
-    try:
+    def decompose(normalize_matrix, normalized):
+        r"""Singular values and right singular vectors of the (normalized) Jacobian."""
+        if svd is not None and not normalized:
+            return (svd[1], svd[2])
+        if jacobian is None:
+            (eigs, V) = np.linalg.eigh(normalize_matrix.T @ hessian @ normalize_matrix)
+            order = np.argsort(eigs)[::-1]
+            return (np.sqrt(np.maximum(eigs[order], 0)), V[:, order].T)
         # note, python has x = U*S*Vh instead of U*S*V', when V = Vh'
-        (_, S_jacobian, Vh_jacobian) = np.linalg.svd(jacobian @ normalize_matrix, full_matrices=False)
-        V_jacobian = Vh_jacobian.T
-        temp = np.power(S_jacobian, -2, out=np.zeros(S_jacobian.shape), where=S_jacobian > min_eig)
-        covariance = V_jacobian @ np.diag(temp) @ Vh_jacobian
-    except MemoryError:
-        if log_level >= 6:
-            print('Singular value decomposition of Jacobian failed.')
-        V_jacobian = np.nan * np.ones((num_params, num_params))
-        covariance = np.inv(jacobian.T @ jacobian)
+        (_, S, Vh) = np.linalg.svd(jacobian @ normalize_matrix, full_matrices=False)
+        return (S, Vh)
+
+    # Make information, covariance matrix, compute Singular Value Decomposition (SVD).
+    if blocks is not None:
+        V_jacobian = None
+        covariance = blocks.covariance(hessian)
+    else:
+        try:
+            (S_jacobian, Vh_jacobian) = decompose(normalize_matrix, normalized)
+            V_jacobian = Vh_jacobian.T
+            temp = np.power(S_jacobian, -2, out=np.zeros(S_jacobian.shape), where=S_jacobian > min_eig)
+            covariance = V_jacobian @ np.diag(temp) @ Vh_jacobian
+        except MemoryError:
+            _log(6, 'Singular value decomposition of Jacobian failed.')
+            V_jacobian = np.nan * np.ones((num_params, num_params))
+            covariance = np.inv(jacobian.T @ jacobian)
 
     param_one_sigmas = np.sqrt(np.diag(covariance))
     param_one_sigmas[param_one_sigmas < min_eig] = np.nan
@@ -838,9 +3417,9 @@ def _analyze_results(opti_opts, bpe_results, jacobian, normalized=False):
     covariance[np.isnan(correlation)] = np.nan
 
     # Update SVD and covariance for the normalized parameters (but correlation remains as calculated above)
-    if normalized:
+    if normalized and blocks is None:
         try:
-            (_, S_jacobian, Vh_jacobian) = np.linalg.svd(jacobian, full_matrices=False)
+            (S_jacobian, Vh_jacobian) = decompose(np.eye(num_params), False)
             V_jacobian = Vh_jacobian.T
             covariance = V_jacobian @ np.diag(S_jacobian**-2) @ Vh_jacobian
         except MemoryError:
@@ -848,9 +3427,216 @@ def _analyze_results(opti_opts, bpe_results, jacobian, normalized=False):
 
     # update the results
     bpe_results.correlation  = correlation
-    bpe_results.info_svd     = V_jacobian.T
+    bpe_results.info_svd     = None if V_jacobian is None else V_jacobian.T
     bpe_results.covariance   = covariance
 
+#%% _BpeHistory
+class _BpeHistory(Frozen):
+    r"""
+    Append-only history of the estimator iterations, stored in a single chunked HDF5 file.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the history file
+    save_innovs : bool, optional
+        Whether to record the innovations for every iteration
+    save_jacobian : bool, optional
+        Whether to record the Jacobian for every iteration
+    keep_jacobian : bool, optional
+        Whether to keep the latest Jacobian for resuming, even when not recording all of them
+
+    Notes
+    -----
+    #.  Each per-iteration field is a resizable dataset with the iteration along the first axis and one
+        iteration per chunk, so appending only writes the new row, and any single iteration can be read
+        back without reading the rest.
+    #.  The innovations (and Jacobian) of the latest iteration are overwritten in place in the 'latest'
+        group, so that the estimator can be resumed without recording all of them.
+    #.  The event times are also overwritten in the 'latest' group, with the number of times of each
+        event recorded every iteration, so that they can be truncated to any earlier iteration.
+    #.  Rows are written by iteration number, so resuming from an earlier iteration truncates the rest.
+    """
+    def __init__(self, filename, *, save_innovs=False, save_jacobian=False, keep_jacobian=False):
+        self.filename      = filename
+        self.save_innovs   = save_innovs
+        self.save_jacobian = save_jacobian
+        self.keep_jacobian = keep_jacobian
+
+    @staticmethod
+    def _overwrite(grp, key, value):
+        r"""Writes the dataset in place if it already exists with the same shape, else recreates it."""
+        value = np.asarray(value)
+        if key in grp:
+            if grp[key].shape == value.shape and grp[key].dtype == value.dtype:
+                grp[key][...] = value
+                return
+            del grp[key]
+        grp.create_dataset(key, data=value)
+
+    @staticmethod
+    def _write_row(file, key, iteration, value):
+        r"""Writes the value as the row for the given iteration, creating or resizing the dataset."""
+        value = np.asarray(value, dtype=float)
+        if key not in file:
+            file.create_dataset(key, shape=(0,) + value.shape, maxshape=(None,) + value.shape, \
+                chunks=(1,) + (value.shape if value.size > 0 else tuple(1 for _ in value.shape)), \
+                dtype=float)
+        dset = file[key]
+        dset.resize(iteration, axis=0)
+        dset[iteration-1] = value
+
+    def create(self, bpe_results):
+        r"""Creates a new history file, with the parameter names and the initial results."""
+        with h5py.File(self.filename, 'w') as file:
+            file.attrs['param_names'] = np.array(bpe_results.param_names)
+            grp = file.create_group('begin')
+            grp.create_dataset('params', data=bpe_results.begin_params)
+            if bpe_results.begin_innovs is not None:
+                grp.create_dataset('innovs', data=bpe_results.begin_innovs)
+            grp.create_dataset('cost', data=bpe_results.begin_cost)
+
+    def append(self, iteration, bpe_results, cur_results):
+        r"""Appends the results from the given iteration."""
+        with h5py.File(self.filename, 'a') as file:
+            for key in _HISTORY_ROWS:
+                self._write_row(file, key, iteration, getattr(cur_results, key))
+            for key in _HISTORY_COUNTS:
+                self._write_row(file, key, iteration, getattr(bpe_results, key))
+            if self.save_innovs:
+                self._write_row(file, 'innovs', iteration, cur_results.innovs)
+            if self.save_jacobian and isinstance(cur_results.jacobian, np.ndarray):
+                self._write_row(file, 'jacobian', iteration, cur_results.jacobian)
+            if bpe_results.frozen_params:
+                self._write_row(file, 'frozen', iteration, bpe_results.frozen_params[-1])
+            self._write_row(file, 'num_times', iteration, [len(getattr(bpe_results, key)) for key in \
+                _TIMING_FIELDS.values()])
+            grp = file.require_group('latest')
+            grp.attrs['iteration'] = iteration
+            for key in _TIMING_FIELDS.values():
+                self._overwrite(grp, key, np.array(getattr(bpe_results, key), dtype=float))
+            if isinstance(cur_results.innovs, np.ndarray):
+                self._overwrite(grp, 'innovs', cur_results.innovs)
+            elif 'innovs' in grp:
+                del grp['innovs']
+            if self.keep_jacobian and isinstance(cur_results.jacobian, np.ndarray):
+                self._overwrite(grp, 'jacobian', cur_results.jacobian)
+            elif 'jacobian' in grp:
+                del grp['jacobian']
+
+#%% _find_history
+def _find_history(opti_opts, resume_from):
+    r"""
+    Finds the history file to resume from.
+
+    Parameters
+    ----------
+    opti_opts : class OptiOpts
+        Optimization options
+    resume_from : bool or str
+        True to use the history in the output folder, if there is one, or the path to a folder or to a
+        specific history file
+
+    Returns
+    -------
+    filename : str or None
+        Name of the history file, or None to start from scratch
+    """
+    if resume_from is None or resume_from is False:
+        return None
+    if resume_from is True:
+        if not opti_opts.output_folder or not opti_opts.output_history:
+            return None
+        filename = os.path.join(opti_opts.output_folder, opti_opts.output_history)
+        return filename if os.path.isfile(filename) else None
+    if os.path.isdir(resume_from):
+        filename = os.path.join(resume_from, opti_opts.output_history)
+    else:
+        filename = resume_from
+    if not os.path.isfile(filename):
+        raise FileNotFoundError('No saved iteration history found at: "{}".'.format(filename))
+    return filename
+
+#%% _load_checkpoint
+def _load_checkpoint(filename, names, iteration=None):
+    r"""
+    Loads the BpeResults and CurrentResults as of the given iteration from the history file.
+    """
+    cur_results = load_bpe_iteration(filename, iteration)
+    bpe_results = BpeResults()
+    with h5py.File(filename, 'r') as file:
+        bpe_results.param_names  = [bytes(name) for name in file.attrs['param_names']]
+        saved_names = [name.decode('utf-8') for name in bpe_results.param_names]
+        if saved_names != names:
+            raise ValueError('The saved parameter names {} do not match the current ones {}.'.format(\
+                saved_names, names))
+        num_iters = iteration if iteration is not None else file['cost'].shape[0]
+        bpe_results.begin_params = file['begin/params'][()]
+        if 'innovs' in file['begin']:
+            bpe_results.begin_innovs = file['begin/innovs'][()]
+        bpe_results.begin_cost   = float(file['begin/cost'][()])
+        bpe_results.costs        = [bpe_results.begin_cost] + file['cost'][:num_iters].tolist()
+        bpe_results.num_iters    = num_iters
+        for key in _HISTORY_COUNTS:
+            # older histories may not have all the counters
+            if key in file:
+                setattr(bpe_results, key, int(file[key][num_iters-1]))
+        if 'num_times' in file:
+            for (key, num) in zip(_TIMING_FIELDS.values(), file['num_times'][num_iters-1].astype(int)):
+                setattr(bpe_results, key, file['latest'][key][:num].tolist())
+        if 'frozen' in file:
+            bpe_results.frozen_params = [row for row in file['frozen'][:num_iters].astype(bool)]
+    return (bpe_results, cur_results)
+
+#%% load_bpe_iteration
+def load_bpe_iteration(filename, iteration=None):
+    r"""
+    Loads the results of a single iteration from a saved estimator history file.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the history file
+    iteration : int, optional
+        Iteration number to load, starting from one, defaults to the latest one
+
+    Returns
+    -------
+    cur_results : class CurrentResults
+        Results as of the end of the given iteration, where the innovations and Jacobian are None if
+        they were not recorded for that iteration
+
+    Notes
+    -----
+    #.  Only the rows of the requested iteration are read from the file.
+
+    Examples
+    --------
+    >>> from dstauffman import load_bpe_iteration
+    >>> import os
+    >>> filename = os.path.join('results', 'bpe_history.hdf5')
+    >>> cur_results = load_bpe_iteration(filename) # doctest: +SKIP
+
+    """
+    cur_results = CurrentResults()
+    with h5py.File(filename, 'r') as file:
+        num_iters = file['cost'].shape[0] if 'cost' in file else 0
+        if iteration is None:
+            iteration = num_iters
+        if iteration < 1 or iteration > num_iters:
+            raise ValueError('Iteration {} is not in the saved history of {} iterations.'.format(\
+                iteration, num_iters))
+        for key in _HISTORY_ROWS:
+            setattr(cur_results, key, file[key][iteration-1])
+        cur_results.cost      = float(cur_results.cost)
+        cur_results.trust_rad = float(cur_results.trust_rad)
+        for key in ['innovs', 'jacobian']:
+            if key in file:
+                setattr(cur_results, key, file[key][iteration-1])
+            elif key in file['latest'] and file['latest'].attrs['iteration'] == iteration:
+                setattr(cur_results, key, file['latest'][key][()])
+    return cur_results
+
 #%% validate_opti_opts
 def validate_opti_opts(opti_opts):
     r"""
@@ -885,30 +3671,96 @@ def validate_opti_opts(opti_opts):
     True
 
     """
-    # get the logging level
-    log_level = Logger().get_level()
     # display some information
-    if log_level >= 5:
-        _print_divider(new_line=False)
-        print('Validating optimization options.')
+    _print_divider(new_line=False, level=5)
+    _log(5, 'Validating optimization options.')
     # Must have specified all parameters
     assert callable(opti_opts.model_func)
     assert isinstance(opti_opts.model_args, dict)
     assert callable(opti_opts.cost_func)
     assert isinstance(opti_opts.cost_args, dict)
-    assert callable(opti_opts.get_param_func)
-    assert callable(opti_opts.set_param_func)
+    assert opti_opts.bind_params or callable(opti_opts.get_param_func)
+    assert opti_opts.bind_params or callable(opti_opts.set_param_func)
+    assert opti_opts.batch_model_func is None or callable(opti_opts.batch_model_func)
+    assert opti_opts.cost_setup_func is None or callable(opti_opts.cost_setup_func)
+    assert opti_opts.event_hook is None or callable(opti_opts.event_hook)
+    assert opti_opts.freeze_tol >= 0 and opti_opts.freeze_recheck >= 1
+    assert opti_opts.jacobian_func is None or callable(opti_opts.jacobian_func)
+    assert opti_opts.check_jacobian >= 0
+    assert opti_opts.log_det_func is None or callable(opti_opts.log_det_func)
+    assert opti_opts.hessian_update in {'gauss_newton', 'bfgs', 'sr1'}
+    assert opti_opts.hessian_refresh >= 0
+    # Incremental models run one at a time, and stream their own innovations already
+    if inspect.isgeneratorfunction(opti_opts.model_func):
+        assert opti_opts.batch_model_func is None
+        assert not opti_opts.stream_innovs
     # Must estimate at least one parameter (TODO: make work with zero?)
     assert isinstance(opti_opts.params, list) and len(opti_opts.params) > 0
-    # Must be one of these two slope methods
-    assert opti_opts.slope_method in {'one_sided', 'two_sided'}
-    # Must be one of these two seach methods
-    assert opti_opts.search_method in {'trust_region', 'levenberg_marquardt'}
+    # Must be one of these slope methods
+    assert opti_opts.slope_method in {'one_sided', 'two_sided', 'complex_step'}
+    # Must be one of these seach methods
+    assert opti_opts.search_method in {'trust_region', 'levenberg_marquardt', 'geodesic_lm'}
+    # The geodesic acceleration needs the whole Jacobian, accurate enough for its error not to swamp the
+    # curvature, a model run from each trial step, and the curvature of only the least squares innovations
+    if opti_opts.search_method == 'geodesic_lm':
+        assert opti_opts.geodesic_alpha > 0
+        assert opti_opts.slope_method != 'one_sided' or opti_opts.jacobian_func is not None or \
+            opti_opts.model_jacobian
+        assert not opti_opts.is_max_like
+        assert not opti_opts.stream_innovs
+        assert not opti_opts.speculative_steps
+    # Must be one of these two Jacobian update methods
+    assert opti_opts.jacobian_update in {'finite_diff', 'broyden'}
+    # Speculative trial steps run candidates that may never be used, so are only worth it when they can
+    # all be evaluated at once
+    if opti_opts.speculative_steps:
+        assert opti_opts.max_cores or opti_opts.batch_model_func is not None or opti_opts.worker_addresses or \
+            asyncio.iscoroutinefunction(opti_opts.model_func)
+    # Remote workers are used instead of the local parallel methods
+    if opti_opts.worker_addresses:
+        # the workers unpickle whatever they are sent, so they must only accept authenticated connections
+        assert opti_opts.worker_authkey
+        assert not opti_opts.max_cores
+        assert opti_opts.batch_model_func is None
+        assert not asyncio.iscoroutinefunction(opti_opts.model_func)
+        assert not opti_opts.stream_innovs
+    # Coroutine models are run concurrently on an event loop instead of with the other parallel methods
+    if asyncio.iscoroutinefunction(opti_opts.model_func):
+        assert opti_opts.batch_model_func is None
+        assert not opti_opts.max_cores
+        assert opti_opts.max_concurrency >= 1
+    # Coroutine cost functions are only awaited along with coroutine models, and can't be streamed
+    if asyncio.iscoroutinefunction(opti_opts.cost_func):
+        assert asyncio.iscoroutinefunction(opti_opts.model_func)
+        assert not opti_opts.stream_innovs
+    # Derivatives from the model replace the Jacobian function, and the model must return them directly
+    if opti_opts.model_jacobian:
+        assert opti_opts.jacobian_func is None
+        assert opti_opts.batch_model_func is None
+        assert not inspect.isgeneratorfunction(opti_opts.model_func)
+        assert not asyncio.iscoroutinefunction(opti_opts.model_func)
+        assert not opti_opts.stream_innovs
+    # Streamed innovations are never all held at once, so can't be cached, sent between processes, used
+    # for Broyden updates or sparse Jacobians, or saved in the history
+    if opti_opts.stream_innovs:
+        assert opti_opts.jacobian_update == 'finite_diff'
+        assert opti_opts.jacobian_sparsity is None
+        assert opti_opts.jacobian_func is None
+        assert not opti_opts.max_cores
+        assert not opti_opts.cache_max_bytes and not opti_opts.disk_cache
+        assert not opti_opts.history_innovs and not opti_opts.history_jacobian
+    # Hierarchical problems need the block-arrow pattern kept intact, so nothing can fill it in
+    if opti_opts.innov_groups is not None:
+        assert any(param.group is not None for param in opti_opts.params)
+        assert opti_opts.jacobian_sparsity is None
+        assert opti_opts.jacobian_update == 'finite_diff'
+        assert opti_opts.hessian_update == 'gauss_newton'
+        assert not opti_opts.stream_innovs
     # Return True to signify that everything validated correctly
     return True
 
 #%% run_bpe
-def run_bpe(opti_opts):
+def run_bpe(opti_opts, *, resume_from=None, resume_iter=None, loop=None):
     r"""
     Runs the batch parameter estimator with the given model optimization options.
 
@@ -916,6 +3768,14 @@ def run_bpe(opti_opts):
     ----------
     opti_opts : class OptiOpts
         estimation options
+    resume_from : bool or str, optional
+        Resume from a previously saved iteration history instead of starting over, either True for the
+        history in opti_opts.output_folder (if any), or the path to a folder or to a specific history file
+    resume_iter : int, optional
+        Iteration to resume from, defaults to the latest saved one
+    loop : asyncio event loop, optional
+        Event loop to run any coroutine model function on, which may be running in another thread,
+        defaults to a new loop just for this run
 
     Returns
     -------
@@ -942,15 +3802,18 @@ def run_bpe(opti_opts):
     start_model = time.time()
 
     # alias some stuff
-    log_level = Logger().get_level()
     names     = OptiParam.get_names(opti_opts.params)
     two_sided = True if opti_opts.slope_method == 'two_sided' else False
+    complex_step = opti_opts.slope_method == 'complex_step'
+    analytic  = opti_opts.jacobian_func is not None or opti_opts.model_jacobian
+    check_jacobian = analytic and opti_opts.check_jacobian > 0
 
     # determine if saving data
     filename  = os.path.join(opti_opts.output_folder, opti_opts.output_results)
     is_saving = bool(opti_opts.output_folder) and bool(opti_opts.output_results)
+    is_history = bool(opti_opts.output_folder) and bool(opti_opts.output_history)
+    is_logging = bool(opti_opts.output_folder) and bool(opti_opts.output_log)
 
-    # TODO: write ability to resume from previously saved iteration results
     # initialize the output and current results instances
     bpe_results = BpeResults()
     cur_results = CurrentResults()
@@ -968,138 +3831,514 @@ def run_bpe(opti_opts):
         init_saves = {}
 
     # future calculations
-    hessian_log_det_b = 0 # TODO: calculate somewhere later
     cosmax = 1 # TODO: calculate somewhere later
 
-    # run the initial model
-    if log_level >= 2:
-        new_line = log_level > 5
-        _print_divider(new_line)
-        print('Running initial simulation.')
-    (_, cur_results.innovs) = _function_wrapper(opti_opts, bpe_results, model_args)
+    # run any coroutine model on a single event loop, either the given one or a new one for this run
+    own_loop = loop is None and asyncio.iscoroutinefunction(opti_opts.model_func)
+    if own_loop:
+        loop = asyncio.new_event_loop()
+
+    # create the evaluator, which handles the optional evaluation cache and worker processes, and runs
+    # the optional cost setup function
+    evaluator = _Evaluator(opti_opts, model_args, names, loop=loop)
+
+    # block-arrow structure of a hierarchical problem, with global and per group parameters
+    if opti_opts.innov_groups is None:
+        blocks = None
+    else:
+        blocks = _BlockArrow([param.group for param in opti_opts.params], opti_opts.innov_groups)
+        _log(5, ' Using %d global parameters and %d parameter groups.', blocks.global_ix.size, \
+            len(blocks.group_ix))
 
     # initialize loop variables
     iter_count   = 1
     delta_param  = np.zeros(len(names))
-
-    # initialize current results
-    cur_results.trust_rad = opti_opts.trust_radius
-    cur_results.cost      = 0.5 * rss(cur_results.innovs, ignore_nans=True)
-    cur_results.params    = opti_opts.get_param_func(names=names, **model_args)
-
-    # set relevant results variables
-    bpe_results.begin_params = cur_results.params.copy()
-    bpe_results.begin_innovs = cur_results.innovs.copy()
-    bpe_results.begin_cost   = cur_results.cost
-    bpe_results.costs.append(cur_results.cost)
+    jacobian     = 0
+    jacobian_svd = None
+    hessian      = None
+    quasi_newton = opti_opts.is_max_like and opti_opts.hessian_update != 'gauss_newton'
+    qn_state     = None # (params, gradient, hessian) of the last iteration for the quasi-Newton updates
+    refresh_hessian     = True
+    iters_since_hessian = 0
+
+    history_file = _find_history(opti_opts, resume_from)
+    if history_file is not None:
+        # resume from the saved results instead of running the initial model
+        (bpe_results, cur_results) = _load_checkpoint(history_file, names, resume_iter)
+        _print_divider(_is_logging(6), level=2)
+        _log(2, 'Resuming from iteration %d results in "%s".', bpe_results.num_iters, history_file)
+        iter_count  = bpe_results.num_iters + 1
+        delta_param = cur_results.delta_param
+        if cur_results.jacobian is not None:
+            jacobian = cur_results.jacobian
+        if cur_results.innovs is None:
+            # the innovations were not recorded for this iteration, so rerun the model to get them
+            cur_results.innovs = evaluator.run_one(bpe_results, cur_results.params)[1]
+        else:
+            evaluator.set_params(cur_results.params)
+    else:
+        # run the initial model
+        _print_divider(_is_logging(6), level=2)
+        _log(2, 'Running initial simulation.')
+        cur_results.params = evaluator.get_params()
+        cur_results.innovs = evaluator.run_one(bpe_results, cur_results.params)[1]
+
+        # initialize current results
+        cur_results.trust_rad = opti_opts.trust_radius
+        cur_results.cost      = _calc_cost(opti_opts, evaluator, cur_results.params, cur_results.innovs)
+
+        # set relevant results variables
+        bpe_results.begin_params = cur_results.params.copy()
+        bpe_results.begin_innovs = None if opti_opts.stream_innovs else cur_results.innovs.copy()
+        bpe_results.begin_cost   = cur_results.cost
+        bpe_results.costs.append(cur_results.cost)
 
     # display initial status
-    if log_level >= 6:
-        print(' Initial parameters: {}'.format(cur_results.params))
-        print(' Initial cost: {}'.format(cur_results.cost))
+    _log(6, ' Initial parameters: %s', cur_results.params)
+    _log(6, ' Initial cost: %s', cur_results.cost)
 
     # Set-up saving: check that the folder exists
-    if is_saving:
+    if is_saving or is_history or is_logging:
         if opti_opts.output_folder and not os.path.isdir(opti_opts.output_folder):
             # if the folder doesn't exist, then create it
             setup_dir(opti_opts.output_folder) # pragma: no cover
 
+    # Set-up the iteration history, appending to the existing one when resuming from it
+    if is_history:
+        history = _BpeHistory(os.path.join(opti_opts.output_folder, opti_opts.output_history), \
+            save_innovs=opti_opts.history_innovs, save_jacobian=opti_opts.history_jacobian, \
+            keep_jacobian=opti_opts.jacobian_update == 'broyden')
+        if history_file is None:
+            with _timed(opti_opts, bpe_results, 'save'):
+                history.create(bpe_results)
+        elif not os.path.isfile(history.filename) or not os.path.samefile(history_file, history.filename):
+            # resuming from a history stored elsewhere, so continue on from a copy of it
+            shutil.copyfile(history_file, history.filename)
+
     # Do some stuff
     convergence = False
-    jacobian = 0
-    while iter_count <= opti_opts.max_iters:
-        # update status
-        if log_level >= 2:
-            _print_divider()
-            print('Running iteration {}.'.format(iter_count))
-
-        # run finite differences code to numerically approximate the Jacobian, gradient and Hessian
-        (jacobian, gradient, hessian) = _finite_differences(opti_opts, model_args, bpe_results, \
-            cur_results, two_sided=two_sided)
-
-        # Check direction of the last step and the gradient. If the old step and the negative new
-        # gradient are in the same general direction, then increase the trust radius.
-        grad_dot_step = gradient.T @ delta_param
-        if grad_dot_step > 0 and iter_count > 1:
-            cur_results.trust_rad += opti_opts.grow_radius
-            if log_level >= 8:
-                print('Old step still in descent direction, so expand current trust_radius to {}.'.format(\
-                    cur_results.trust_rad))
-
-        # calculate the delta parameter step to try on the next iteration
-        if opti_opts.is_max_like:
-            delta_param = -np.linalg.lstsq(hessian + hessian_log_det_b, gradient)[0]
-        else:
-            delta_param = _levenberg_marquardt(jacobian, cur_results.innovs, lambda_=0)
-
-        # find the step length
-        delta_step_len = norm(delta_param)
-        pred_func_change = _predict_func_change(delta_param, gradient, hessian)
-
-        # check for convergence conditions
-        convergence = _check_for_convergence(opti_opts, cosmax, delta_step_len, pred_func_change)
-        if convergence:
-            break
-
-        # search for parameter set that is better than the current set
-        failed = _dogleg_search(opti_opts, model_args, bpe_results, cur_results, delta_param, jacobian, \
-            gradient, hessian)
-        bpe_results.costs.append(cur_results.cost)
-
-        # save results from this iteration
-        if is_saving:
-            bpe_results.save(os.path.join(opti_opts.output_folder, 'bpe_results_iter_{}.hdf5'.format(iter_count)))
-            cur_results.save(os.path.join(opti_opts.output_folder, 'cur_results_iter_{}.hdf5'.format(iter_count)))
-
-        # increment counter
-        iter_count += 1
-
-        if failed:
-            break
+    failed = False
+    use_broyden = opti_opts.jacobian_update == 'broyden'
+    # a Jacobian restored from a checkpoint is treated as an already updated one
+    refresh_jacobian = cur_results.jacobian is None
+    iters_since_refresh = 0 if refresh_jacobian else 1
+    # parameters frozen by the sensitivity screening, which always starts over with all of them
+    use_screening = opti_opts.freeze_tol > 0
+    frozen = np.zeros(len(names), dtype=bool)
+    iters_since_screen = 0
+    record_handler = None
+    try:
+        # start any worker processes used to run the model in parallel
+        evaluator.start()
+
+        # Set-up the JSON lines record of each iteration, appending to the existing one when resuming
+        if is_logging:
+            record_handler = logging.FileHandler(os.path.join(opti_opts.output_folder, opti_opts.output_log), \
+                mode='w' if history_file is None else 'a')
+            record_handler.setFormatter(_JsonLinesFormatter())
+            _RECORDS.addHandler(record_handler)
+            if history_file is None:
+                _record('initial', params=cur_results.params, cost=cur_results.cost, \
+                    num_evals=bpe_results.num_evals)
+
+        while iter_count <= opti_opts.max_iters:
+            # update status
+            _print_divider(level=2)
+            _log(2, 'Running iteration %d.', iter_count)
+
+            # a Gauss-Newton reset of a quasi-Newton Hessian also needs the actual Jacobian, so with Broyden
+            # updates, the finite differences are only run for those resets and the Jacobian refreshes
+            if quasi_newton and opti_opts.hessian_refresh and iters_since_hessian >= opti_opts.hessian_refresh:
+                refresh_hessian = True
+            if quasi_newton and refresh_hessian:
+                refresh_jacobian = True
+
+            if refresh_jacobian or not use_broyden:
+                # periodically recheck the frozen parameters
+                if np.any(frozen) and iters_since_screen >= opti_opts.freeze_recheck:
+                    _log(5, ' Rechecking the sensitivity of the frozen parameters.')
+                    frozen[:] = False
+                # run finite differences code to numerically approximate the Jacobian, gradient and Hessian
+                active = ~frozen if np.any(frozen) else None
+                with _timed(opti_opts, bpe_results, 'finite_diff'):
+                    if analytic:
+                        # use the supplied derivatives instead of perturbing the model
+                        (jacobian, gradient, hessian) = _analytic_jacobian(opti_opts, bpe_results, cur_results, \
+                            evaluator, active=active, blocks=blocks)
+                    else:
+                        try:
+                            (jacobian, gradient, hessian) = _finite_differences(opti_opts, model_args, \
+                                bpe_results, cur_results, two_sided=two_sided, evaluator=evaluator, \
+                                active=active, complex_step=complex_step, blocks=blocks)
+                        except _ComplexStepError as error:
+                            # the model doesn't support complex values, so use real differences from now on
+                            _log(2, 'Complex step derivatives failed (%s), so using one sided differences ' + \
+                                'instead.', error)
+                            complex_step = False
+                            (jacobian, gradient, hessian) = _finite_differences(opti_opts, model_args, \
+                                bpe_results, cur_results, two_sided=two_sided, evaluator=evaluator, \
+                                active=active, blocks=blocks)
+                if check_jacobian:
+                    # debug check of the supplied derivatives on the first iteration, using small central
+                    # differences, as the usual trust radius based steps are too coarse to compare against
+                    _log(2, 'Checking the Jacobian function against finite differences.')
+                    (fd_jacobian, _, _) = _finite_differences(opti_opts, model_args, bpe_results, cur_results, \
+                        two_sided=True, evaluator=evaluator, active=active, rel_step=np.cbrt(np.finfo(float).eps), \
+                        blocks=blocks)
+                    if blocks is not None:
+                        # the check is only done once, so can compare the whole Jacobians
+                        _check_jacobian(opti_opts, jacobian.toarray(), fd_jacobian.toarray(), names)
+                    else:
+                        _check_jacobian(opti_opts, jacobian, fd_jacobian, names)
+                    check_jacobian = False
+                refresh_jacobian    = False
+                iters_since_refresh = 0
+                was_frozen = frozen.copy()
+                # with the full Jacobian, decide which parameters to freeze from the next iteration on
+                if use_screening and not np.any(frozen):
+                    # Note: the diagonal of a block-arrow Hessian already has the squared column norms
+                    frozen = _screen_params(opti_opts, jacobian if blocks is None else None, hessian)
+                    iters_since_screen = 0
+                    if np.any(frozen):
+                        _log(5, ' Freezing the insensitive parameters: %s', ', '.join(name for (name, is_frozen) \
+                            in zip(names, frozen) if is_frozen))
+            else:
+                was_frozen = frozen.copy()
+                # use the Broyden updated Jacobian from the last iteration, without any frozen parameters
+                _log(8, '  Using Broyden updated Jacobian, %d iterations since last refresh.', iters_since_refresh)
+                jacobian[:, frozen] = 0
+                gradient = jacobian.T @ cur_results.innovs
+                hessian  = jacobian.T @ jacobian
+
+            # for maximum likelihood, add the gradient of the log determinant term, and optionally replace
+            # the Gauss-Newton Hessian with a quasi-Newton one updated from the gradient changes between
+            # iterations
+            if opti_opts.is_max_like:
+                use_update = quasi_newton and qn_state is not None and not refresh_hessian
+                gradient = gradient + _log_det_gradient(opti_opts, evaluator, cur_results.params)
+                if use_update:
+                    qn_hessian = _quasi_newton_update(qn_state[2], cur_results.params - qn_state[0], \
+                        gradient - qn_state[1], method=opti_opts.hessian_update)
+                    # a step that isn't downhill, or negative curvature along the gradient, means that the
+                    # approximation has gone bad, so reset it instead, along with any Broyden updated Jacobian
+                    if gradient @ np.linalg.lstsq(qn_hessian, gradient, rcond=None)[0] > 0 and \
+                            gradient @ qn_hessian @ gradient > 0:
+                        hessian = qn_hessian
+                        iters_since_hessian += 1
+                    elif iters_since_refresh > 0:
+                        _log(8, '  Resetting the quasi-Newton Hessian and Jacobian, as they no longer give a ' + \
+                            'descent step.')
+                        refresh_hessian = True
+                        continue
+                    else:
+                        _log(8, '  Resetting the quasi-Newton Hessian, as it no longer gives a descent step.')
+                        use_update = False
+                if not use_update:
+                    # Note: this Gauss-Newton Hessian leaves out the curvature of the log determinant term,
+                    # which can be negative, so only the quasi-Newton updates pick that up
+                    refresh_hessian     = False
+                    iters_since_hessian = 0
+                qn_state = (cur_results.params.copy(), gradient.copy(), hessian)
+
+            # Check direction of the last step and the gradient. If the old step and the negative new
+            # gradient are in the same general direction, then increase the trust radius.
+            grad_dot_step = gradient.T @ delta_param
+            if grad_dot_step > 0 and iter_count > 1:
+                cur_results.trust_rad += opti_opts.grow_radius
+                _log(8, 'Old step still in descent direction, so expand current trust_radius to %s.', \
+                    cur_results.trust_rad)
+
+            # calculate the delta parameter step to try on the next iteration
+            with _timed(opti_opts, bpe_results, 'linalg'):
+                # decompose the Jacobian once, and reuse it for every step and the final covariance, except
+                # for hierarchical problems, which solve the Schur complement of their blocks instead, and
+                # for maximum likelihood, which solves with the Hessian and gradient of the whole cost
+                if jacobian is None or blocks is not None or opti_opts.is_max_like:
+                    jacobian_svd = None
+                else:
+                    jacobian_svd = np.linalg.svd(jacobian, full_matrices=False)
+                if blocks is not None:
+                    delta_param = -blocks.solve(hessian, gradient)
+                elif opti_opts.is_max_like:
+                    delta_param = -np.linalg.lstsq(hessian, gradient, rcond=None)[0]
+                elif jacobian is None:
+                    delta_param = _levenberg_marquardt_normal(hessian, gradient, lambda_=0)
+                else:
+                    delta_param = _levenberg_marquardt(jacobian, cur_results.innovs, lambda_=0, svd=jacobian_svd)
+
+            # find the step length
+            delta_step_len = norm(delta_param)
+            pred_func_change = _predict_func_change(delta_param, gradient, hessian)
+
+            # check for convergence conditions
+            convergence = _check_for_convergence(opti_opts, cosmax, delta_step_len, pred_func_change)
+            if convergence:
+                if np.any(was_frozen):
+                    # confirm the convergence with all the parameters free to move
+                    _log(8, '  Unfreezing all the parameters to confirm convergence.')
+                    frozen[:] = False
+                    refresh_jacobian = True
+                    continue
+                if use_broyden and iters_since_refresh > 0:
+                    # confirm the convergence with an actual finite difference Jacobian
+                    _log(8, '  Refreshing the Broyden Jacobian to confirm convergence.')
+                    refresh_jacobian = True
+                    continue
+                break
+
+            # search for parameter set that is better than the current set
+            orig_params = cur_results.params.copy()
+            orig_innovs = cur_results.innovs.copy()
+            orig_cost   = cur_results.cost
+            # the trial steps are only needed to update the Jacobian or Hessian
+            trials      = [] if use_broyden or quasi_newton else None
+            # the geodesic acceleration is only worth it with accurate derivatives, as both the velocity and
+            # the acceleration come from the Jacobian, so it isn't used with Broyden updates, or with one
+            # sided differences after falling back from a failed complex step
+            accurate_jacobian = (analytic or two_sided or complex_step) and iters_since_refresh == 0
+            with _timed(opti_opts, bpe_results, 'search'):
+                failed = _dogleg_search(opti_opts, model_args, bpe_results, cur_results, delta_param, \
+                    jacobian, gradient, hessian, evaluator=evaluator, trials=trials, svd=jacobian_svd, \
+                    blocks=blocks, accurate_jacobian=accurate_jacobian)
+            bpe_results.costs.append(cur_results.cost)
+
+            # update the Jacobian using all the trial steps, doing the accepted one last
+            if use_broyden:
+                accepted = [trial for trial in trials if trial[3]]
+                for (params, innovs, _, _) in [trial for trial in trials if not trial[3]] + accepted[-1:]:
+                    jacobian = _broyden_update(jacobian, params - orig_params, innovs - orig_innovs)
+                jacobian_svd = None
+                iters_since_refresh += 1
+                # determine whether the linearized model is still predicting the cost change well
+                if accepted and accepted[-1][2] < 0:
+                    cost_ratio = (orig_cost - cur_results.cost) / -accepted[-1][2]
+                else:
+                    cost_ratio = 0.
+                if iters_since_refresh >= opti_opts.jacobian_refresh or cost_ratio < opti_opts.broyden_min_ratio:
+                    _log(8, '  Scheduling a finite difference Jacobian refresh, with a cost ratio of %s.', cost_ratio)
+                    refresh_jacobian = True
+                # a failed search with an updated Jacobian is worth retrying with a fresh one
+                if not accepted and iters_since_refresh > 1:
+                    failed = False
+
+            # likewise for a failed search with an updated Hessian
+            if quasi_newton and iters_since_hessian > 0 and not any(trial[3] for trial in trials):
+                _log(8, '  Scheduling a Gauss-Newton Hessian reset after the failed search.')
+                refresh_hessian = True
+                failed = False
+
+            # save results from this iteration
+            bpe_results.num_iters   = iter_count
+            cur_results.delta_param = delta_param
+            cur_results.jacobian    = jacobian
+            if use_screening:
+                bpe_results.frozen_params.append(was_frozen)
+                iters_since_screen += 1
+            if is_history:
+                with _timed(opti_opts, bpe_results, 'save'):
+                    history.append(iter_count, bpe_results, cur_results)
+            _record('iteration', iteration=iter_count, params=cur_results.params, cost=cur_results.cost, \
+                trust_rad=cur_results.trust_rad, step_len=delta_step_len, num_evals=bpe_results.num_evals, \
+                num_accepted=bpe_results.num_accepted, num_rejected=bpe_results.num_rejected, failed=failed, \
+                num_frozen=int(np.count_nonzero(was_frozen)), elapsed=time.time() - start_model)
+
+            # release the trial steps, as any streamed innovations keep their whole model results
+            (trials, orig_innovs) = (None, None)
+
+            # increment counter
+            iter_count += 1
+
+            if failed:
+                break
+    finally:
+        # clean up any worker processes, and close the record of the iterations
+        evaluator.close()
+        if record_handler is not None:
+            _RECORDS.removeHandler(record_handler)
+            record_handler.close()
 
     # display if this converged out timed out on iteration steps
-    if log_level >= 6 and not convergence and not failed:
-        print('Stopped iterating due to hitting the max number of iterations: {}.'.format(opti_opts.max_iters))
+    if not convergence and not failed:
+        _log(6, 'Stopped iterating due to hitting the max number of iterations: %d.', opti_opts.max_iters)
 
     # run an optional final function before doing the final simulation
     if opti_opts.final_func is not None:
         opti_opts.final_func(**model_args, settings=init_saves)
 
     # Run for final time
-    if log_level >= 2:
-        _print_divider()
-        print('Running final simulation.')
-    opti_opts.set_param_func(names=names, values=cur_results.params, **model_args)
-    (results, cur_results.innovs) = _function_wrapper(opti_opts, bpe_results, model_args)
-    cur_results.cost = 0.5 * rss(cur_results.innovs, ignore_nans=True)
-    bpe_results.final_innovs = cur_results.innovs.copy()
+    _print_divider(level=2)
+    _log(2, 'Running final simulation.')
+    # Note: the final function may have changed the model arguments, so don't use the cache if it exists
+    try:
+        (results, cur_results.innovs) = evaluator.run_one(bpe_results, cur_results.params, \
+            need_results=True, use_cache=opti_opts.final_func is None)
+    finally:
+        if own_loop:
+            loop.close()
+    cur_results.cost = _calc_cost(opti_opts, evaluator, cur_results.params, cur_results.innovs)
+    bpe_results.final_innovs = None if opti_opts.stream_innovs else cur_results.innovs.copy()
     bpe_results.final_params = cur_results.params.copy()
     bpe_results.final_cost   = cur_results.cost
     bpe_results.costs.append(cur_results.cost)
 
     # display final status
-    if log_level >= 6:
-        print(' Final parameters: {}'.format(bpe_results.final_params))
-        print(' Final cost: {}'.format(bpe_results.final_cost))
-    if log_level >= 8:
-        print(' Final individual parameters:')
-        _pprint_args(names, bpe_results.final_params)
+    _log(6, ' Final parameters: %s', bpe_results.final_params)
+    _log(6, ' Final cost: %s', bpe_results.final_cost)
+    if _is_logging(8):
+        _log(8, ' Final individual parameters:')
+        _pprint_args(names, bpe_results.final_params, level=8)
 
     # analyze BPE results
-    _analyze_results(opti_opts, bpe_results, jacobian)
+    with _timed(opti_opts, bpe_results, 'linalg'):
+        _analyze_results(opti_opts, bpe_results, jacobian, hessian=hessian, svd=jacobian_svd, blocks=blocks)
 
     # show status and save results
-    if log_level > 2 and is_saving:
-        print('Saving results to: "{}".'.format(filename))
     if is_saving:
-        bpe_results.save(filename)
+        _log(3, 'Saving results to: "%s".', filename)
+        # Note: this save time is only recorded after the save, so it is not in the saved file
+        with _timed(opti_opts, bpe_results, 'save'):
+            bpe_results.save(filename)
 
-    # display total elapsed time
-    if log_level >= 3:
-        print('BPE Model completed: ' + time.strftime('%H:%M:%S', time.gmtime(time.time()-start_model)))
+    # display where the time went, and the total elapsed time
+    if _is_logging(6):
+        _log(6, '%s', _timing_summary(bpe_results))
+    _log(3, 'BPE Model completed: %s', time.strftime('%H:%M:%S', time.gmtime(time.time()-start_model)))
 
     return (bpe_results, results)
 
+#%% run_bpe_async
+async def run_bpe_async(opti_opts, **kwargs):
+    r"""
+    Runs the batch parameter estimator from within asyncio code.
+
+    Parameters
+    ----------
+    opti_opts : class OptiOpts
+        estimation options
+    **kwargs : dict
+        Additional keyword arguments passed on to run_bpe
+
+    Returns
+    -------
+    bpe_results : class BpeResults
+        Results of the estimation
+    results : class Results
+        Results of the model using the final set of parameters as determined by BPE
+
+    Notes
+    -----
+    #.  The estimator runs in a separate thread, so the calling event loop is free to do other work
+        in the meantime, but any coroutine model functions are awaited on the calling event loop.
+
+    Examples
+    --------
+
+    >>> from dstauffman import run_bpe_async
+    >>> import asyncio
+    >>> loop = asyncio.get_event_loop()
+    >>> (bpe_results, results) = loop.run_until_complete(run_bpe_async(opti_opts)) # doctest: +SKIP
+
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, partial(run_bpe, opti_opts, loop=loop, **kwargs))
+
+#%% _serve_worker_session
+def _serve_worker_session(conn, heartbeat):
+    r"""
+    Serves the evaluation requests from a single BPE run over the given connection.
+    """
+    lock = threading.Lock()
+    evaluating = [False]
+    def send(message, *, done=False):
+        with lock:
+            if done:
+                evaluating[0] = False
+            conn.send(message)
+    # load the model once for the whole session
+    (_, opti_opts, names, model_args, cost_args) = conn.recv()
+    _parallel_init(opti_opts, names, model_args, cost_args)
+    # send heartbeats in the background, so that long evaluations are not mistaken for a dead worker,
+    # but only while evaluating, as the run only reads from the workers that it is waiting on
+    stop = threading.Event()
+    def beat():
+        while not stop.wait(heartbeat):
+            with lock:
+                if not evaluating[0]:
+                    continue
+                try:
+                    conn.send(('heartbeat',))
+                except OSError: # pragma: no cover
+                    return
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        while True:
+            try:
+                message = conn.recv()
+            except (OSError, EOFError):
+                return
+            if message[0] == 'close':
+                return
+            (_, task_id, values) = message
+            with lock:
+                evaluating[0] = True
+            try:
+                output = _parallel_function_wrapper(values)
+            except Exception:
+                send(('error', task_id, traceback.format_exc()), done=True)
+            else:
+                send(('result', task_id, output), done=True)
+    finally:
+        stop.set()
+        thread.join()
+
+#%% serve_bpe_worker
+def serve_bpe_worker(address, authkey, *, heartbeat=1., max_sessions=None):
+    r"""
+    Runs a worker that serves model evaluations to run_bpe over the network.
+
+    Parameters
+    ----------
+    address : (str, int)
+        Host and port to listen on
+    authkey : bytes
+        Authentication key that must match OptiOpts.worker_authkey
+    heartbeat : float, optional
+        Seconds between the heartbeats sent while evaluating
+    max_sessions : int, optional
+        Number of BPE runs to serve before returning, defaults to running forever
+
+    Notes
+    -----
+    #.  Each BPE run connects once, sends the options and model arguments, which are loaded once, and
+        then sends one evaluation at a time until it is finished.
+    #.  Only the batches of evaluations, such as the finite difference Jacobians and speculative trial
+        steps, are sent to the workers.  The initial and final evaluations and the single trial steps
+        always run within the BPE process itself.
+    #.  The model and cost functions are sent by reference, so must be importable by the worker.
+    #.  The worker unpickles everything it is sent, so it only accepts connections that know the
+        authentication key, and refuses to run without one.
+
+    Examples
+    --------
+
+    >>> from dstauffman import serve_bpe_worker
+    >>> serve_bpe_worker(('localhost', 6000), authkey=b'secret') # doctest: +SKIP
+
+    """
+    if not authkey:
+        raise ValueError('An authentication key is required to serve BPE workers.')
+    num_sessions = 0
+    with Listener(tuple(address), authkey=authkey) as listener:
+        while max_sessions is None or num_sessions < max_sessions:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError):
+                continue
+            num_sessions += 1
+            with conn:
+                _serve_worker_session(conn, heartbeat)
+
 #%% plot_bpe_results
 def plot_bpe_results(bpe_results, opts=None, *, plots=None):
     r"""
@@ -1108,9 +4347,6 @@ def plot_bpe_results(bpe_results, opts=None, *, plots=None):
     # hard-coded options
     label_values = False
 
-    # get the logging level
-    log_level = Logger.get_level()
-
     # alias the names
     if bpe_results.param_names is not None:
         names = [name.decode('utf-8') for name in bpe_results.param_names]
@@ -1147,14 +4383,14 @@ def plot_bpe_results(bpe_results, opts=None, *, plots=None):
             fig = plot_multiline_history(time, data, label='Innovs Before and After', opts=opts, colormap='bwr_r', \
                 legend=['Before', 'After'])
             figs.append(fig)
-        elif log_level >= 2:
-            print("Data isn't available for Innovations plot.")
+        else:
+            _log(2, "Data isn't available for Innovations plot.")
     if plots['convergence']:
         if len(bpe_results.costs) != 0:
             fig = plot_bpe_convergence(bpe_results.costs, opts=opts)
             figs.append(fig)
-        elif log_level >= 2:
-            print("Data isn't available for convergence plot.")
+        else:
+            _log(2, "Data isn't available for convergence plot.")
 
     if plots['correlation']:
         if bpe_results.correlation is not None:
@@ -1162,8 +4398,8 @@ def plot_bpe_results(bpe_results, opts=None, *, plots=None):
                 matrix_name='Correlation Matrix', cmin=-1, colormap='bwr', plot_lower_only=True, \
                 label_values=label_values)
             figs.append(fig)
-        elif log_level >= 2:
-            print("Data isn't available for correlation plot.")
+        else:
+            _log(2, "Data isn't available for correlation plot.")
 
     if plots['info_svd']:
         if bpe_results.info_svd is not None:
@@ -1171,8 +4407,8 @@ def plot_bpe_results(bpe_results, opts=None, *, plots=None):
                 matrix_name='Information SVD Matrix', colormap='cool', label_values=label_values, \
                 labels=[['{}'.format(i+1) for i in range(len(names))], names])
             figs.append(fig)
-        elif log_level >= 2:
-            print("Data isn't available for information SVD plot.")
+        else:
+            _log(2, "Data isn't available for information SVD plot.")
 
     if plots['covariance']:
         if bpe_results.covariance is not None:
@@ -1181,8 +4417,8 @@ def plot_bpe_results(bpe_results, opts=None, *, plots=None):
                 matrix_name='Covariance Matrix', cmin=-max_mag, cmax=max_mag, colormap='bwr', \
                 plot_lower_only=True, label_values=label_values)
             figs.append(fig)
-        elif log_level >= 2:
-            print("Data isn't available for covariance plot.")
+        else:
+            _log(2, "Data isn't available for covariance plot.")
     return figs
 
 #%% Unit test
@@ -55,17 +55,36 @@ def sim_model(sim_params):
     return sim_params.magnitude * np.sin(2*np.pi*sim_params.frequency*sim_params.time/1000 + \
         sim_params.phase*np.pi/180)
 
+#%% Functions - batch_sim_model
+def batch_sim_model(sim_params, *, names, values):
+    r"""Vectorized version of the example simulation model, which runs every row of values at once."""
+    # start from the current parameters for every set, and then overlay the estimated ones
+    num_sets = values.shape[0]
+    params   = {key: np.full(num_sets, getattr(sim_params, key), dtype=float) for key in \
+        ['magnitude', 'frequency', 'phase']}
+    for (ix, name) in enumerate(names):
+        params[name] = values[:, ix]
+    # expand to (num_sets, num_time) with broadcasting
+    magnitude = params['magnitude'][:, np.newaxis]
+    frequency = params['frequency'][:, np.newaxis]
+    phase     = params['phase'][:, np.newaxis]
+    return magnitude * np.sin(2*np.pi*frequency*sim_params.time[np.newaxis, :]/1000 + phase*np.pi/180)
+
 #%% Functions - truth
 def truth(time, magnitude=5, frequency=10, phase=90):
     r"""Simple example truth data."""
     return magnitude * np.sin(2*np.pi*frequency*time/1000 + phase*np.pi/180)
 
-#%% Functions - cost_wrapper
-def cost_wrapper(results_data, *, results_time, truth_time, truth_data, sim_params):
-    r"""Example Cost wrapper for the model."""
-    # Pull out overlapping time points and indices
+#%% Functions - cost_setup
+def cost_setup(sim_params, *, results_time, truth_time, truth_data):
+    r"""Example cost setup, which pulls out the overlapping truth data once before running BPE."""
     (ix_truth, ix_results) = _get_truth_index(results_time, truth_time)
-    sub_truth  = truth_data[ix_truth]
+    return {'sub_truth': truth_data[ix_truth], 'ix_results': ix_results}
+
+#%% Functions - cost_wrapper
+def cost_wrapper(results_data, *, sub_truth, ix_results, **kwargs):
+    r"""Example Cost wrapper for the model, using the overlapping indices from cost_setup."""
+    # Pull out overlapping time points
     sub_result = results_data[ix_results]
 
     # calculate the innovations
@@ -119,14 +138,16 @@ if __name__=='__main__':
     opti_opts.model_args     = {'sim_params': sim_params}
     opti_opts.cost_func      = cost_wrapper
     opti_opts.cost_args      = {'results_time': time, 'truth_time': truth_time, 'truth_data': truth_data}
+    opti_opts.cost_setup_func = cost_setup # optional, precomputes the static parts of the cost function
     opti_opts.get_param_func = get_parameter
     opti_opts.set_param_func = set_parameter
+    opti_opts.batch_model_func = batch_sim_model # optional, runs many parameter sets in one call
     opti_opts.output_folder  = os.path.join(dcs.get_output_dir(), datetime.now().strftime('%Y-%m-%d'))
     opti_opts.output_results = 'bpe_results.hdf5'
     opti_opts.params         = []
 
     # less common optimization settings
-    opti_opts.slope_method    = 'one_sided' # or 'two_sided'
+    opti_opts.slope_method    = 'one_sided' # or 'two_sided', or 'complex_step' for models that support complex values
     opti_opts.is_max_like     = False
     opti_opts.max_iters       = 10
     opti_opts.tol_cosmax_grad = 1e-4
@@ -137,6 +158,8 @@ if __name__=='__main__':
     opti_opts.grow_radius     = 2
     opti_opts.shrink_radius   = 0.5
     opti_opts.trust_radius    = 1.0
+    opti_opts.max_cores       = 0 # or number of worker processes to run the model in parallel
+    opti_opts.share_arrays    = True # send large arrays like the truth data to those workers only once
 
     # Parameters to estimate
     opti_opts.params.append(dcs.OptiParam('magnitude', best=2.5, min_=-10, max_=10, typical=5, minstep=0.01))
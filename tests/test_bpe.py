@@ -9,9 +9,20 @@ Notes
 """
 
 #%% Imports
+import asyncio
+from functools import partial
+import json
+import logging
+import multiprocessing
 import numpy as np
 import os
+import shutil
+import signal
+import socket
+import threading
+import time
 import unittest
+import weakref
 import dstauffman as dcs
 
 #%% Hard-coded values
@@ -56,6 +67,95 @@ def sim_model(sim_params):
     return sim_params.magnitude * np.sin(2*np.pi*sim_params.frequency*sim_params.time/1000 + \
         sim_params.phase*np.pi/180)
 
+# Functions - real_sim_model
+def real_sim_model(sim_params):
+    r"""Example simulation model that only works with real values, so it drops any imaginary parts."""
+    return np.real(sim_model(sim_params))
+
+# Functions - incremental_sim_model
+def incremental_sim_model(sim_params, chunk_size=50):
+    r"""Example simulation model that yields its results one chunk of time at a time."""
+    results = sim_model(sim_params)
+    for ix in range(0, results.size, chunk_size):
+        yield (sim_params.time[ix:ix+chunk_size], results[ix:ix+chunk_size])
+    return results
+
+# Functions - async_sim_model
+async def async_sim_model(sim_params):
+    r"""Example simulation model that runs as a coroutine, like an external job would."""
+    await asyncio.sleep(0.001)
+    return sim_model(sim_params)
+
+# Functions - slow_sim_model
+async def slow_sim_model(sim_params):
+    r"""Example coroutine simulation model that gets stuck for small magnitudes with the initial phase."""
+    await asyncio.sleep(10 if sim_params.magnitude < 2 and sim_params.phase > 179 else 0.001)
+    return sim_model(sim_params)
+
+# Functions - valley_model
+def valley_model(sim_params):
+    r"""Example model with a narrow curved valley, like the Rosenbrock function, using the magnitude and frequency."""
+    return np.array([10*(sim_params.frequency - sim_params.magnitude**2), 1 - sim_params.magnitude])
+
+# Functions - sleepy_sim_model
+def sleepy_sim_model(sim_params):
+    r"""Example simulation model that takes a while to run."""
+    time.sleep(0.5)
+    return sim_model(sim_params)
+
+# Functions - flaky_sim_model
+def flaky_sim_model(sim_params):
+    r"""Example simulation model that kills or stops the worker process running it, when told to."""
+    mode = os.environ.get('DCS_TEST_WORKER', '')
+    if mode == 'die':
+        os._exit(1)
+    if mode == 'stop':
+        os.kill(os.getpid(), signal.SIGSTOP)
+    return sim_model(sim_params)
+
+# Functions - run_worker
+def run_worker(address, authkey, mode=''):
+    r"""Runs a BPE worker for a single session, with the given failure mode for flaky_sim_model."""
+    os.environ['DCS_TEST_WORKER'] = mode
+    dcs.serve_bpe_worker(address, authkey, heartbeat=0.1, max_sessions=1)
+
+# Functions - start_workers
+def start_workers(modes, authkey):
+    r"""Starts local BPE workers with the given failure modes, and waits for them to be listening."""
+    addresses = []
+    processes = []
+    for mode in modes:
+        with socket.socket() as sock:
+            sock.bind(('localhost', 0))
+            address = ('localhost', sock.getsockname()[1])
+        process = multiprocessing.Process(target=run_worker, args=(address, authkey, mode), daemon=True)
+        process.start()
+        addresses.append(address)
+        processes.append(process)
+    for address in addresses:
+        for _ in range(100):
+            try:
+                socket.create_connection(address).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+    return (addresses, processes)
+
+# Functions - batch_sim_model
+def batch_sim_model(sim_params, *, names, values):
+    r"""Vectorized version of the example simulation model, which runs every row of values at once."""
+    # start from the current parameters for every set, and then overlay the estimated ones
+    num_sets = values.shape[0]
+    params   = {key: np.full(num_sets, getattr(sim_params, key), dtype=float) for key in \
+        ['magnitude', 'frequency', 'phase']}
+    for (ix, name) in enumerate(names):
+        params[name] = values[:, ix]
+    # expand to (num_sets, num_time) with broadcasting
+    magnitude = params['magnitude'][:, np.newaxis]
+    frequency = params['frequency'][:, np.newaxis]
+    phase     = params['phase'][:, np.newaxis]
+    return magnitude * np.sin(2*np.pi*frequency*sim_params.time[np.newaxis, :]/1000 + phase*np.pi/180)
+
 # Functions - truth
 def truth(time, magnitude=5, frequency=10, phase=90):
     r"""Simple example truth data."""
@@ -73,6 +173,51 @@ def cost_wrapper(results_data, *, results_time, truth_time, truth_data, sim_para
     innovs = sub_result - sub_truth
     return innovs
 
+# Functions - sim_jacobian
+def sim_jacobian(sim_params, *, names, results_time, truth_time, truth_data, phase_scale=np.pi/180):
+    r"""Analytic derivatives of the innovations from cost_wrapper, in the order of the given names."""
+    (_, ix_results) = _get_truth_index(results_time, truth_time)
+    time  = sim_params.time[ix_results]
+    angle = 2*np.pi*sim_params.frequency*time/1000 + sim_params.phase*np.pi/180
+    derivs = {'magnitude': np.sin(angle), 'frequency': sim_params.magnitude * np.cos(angle) * 2*np.pi*time/1000, \
+        'phase': sim_params.magnitude * np.cos(angle) * phase_scale}
+    return np.column_stack([derivs[name] for name in names])
+
+# Functions - jacobian_sim_model
+def jacobian_sim_model(sim_params, *, truth_time):
+    r"""Example simulation model that also returns the derivatives of the innovations from cost_wrapper."""
+    jacobian = sim_jacobian(sim_params, names=['magnitude', 'frequency', 'phase'], results_time=sim_params.time, \
+        truth_time=truth_time, truth_data=None)
+    return (sim_model(sim_params), jacobian)
+
+# Functions - incremental_cost_wrapper
+def incremental_cost_wrapper(chunk, *, results_time, truth_time, truth_data, sim_params):
+    r"""Example cost wrapper for a single chunk of the incremental model results."""
+    (chunk_time, chunk_data) = chunk
+    return cost_wrapper(chunk_data, results_time=chunk_time, truth_time=truth_time, truth_data=truth_data, \
+        sim_params=sim_params)
+
+# Functions - cost_setup
+cost_setup_calls = []
+def cost_setup(sim_params, *, results_time, truth_time, truth_data):
+    r"""Example cost setup function that finds the overlapping truth data only once."""
+    cost_setup_calls.append(os.getpid())
+    (ix_truth, ix_results) = _get_truth_index(results_time, truth_time)
+    return {'sub_truth': truth_data[ix_truth], 'ix_results': ix_results}
+
+# Functions - setup_cost_wrapper
+def setup_cost_wrapper(results_data, *, sub_truth, ix_results, **kwargs):
+    r"""Example cost wrapper that uses the precomputed outputs of cost_setup."""
+    return results_data[ix_results] - sub_truth
+
+# Functions - chunked_cost_wrapper
+def chunked_cost_wrapper(results_data, *, results_time, truth_time, truth_data, sim_params, chunk_size=50):
+    r"""Example cost wrapper that generates the innovations in chunks."""
+    innovs = cost_wrapper(results_data, results_time=results_time, truth_time=truth_time, \
+        truth_data=truth_data, sim_params=sim_params)
+    for ix in range(0, innovs.size, chunk_size):
+        yield innovs[ix:ix+chunk_size]
+
 # Functions - get_parameter
 def get_parameter(sim_params, *, names):
     r"""Simple example parameter getter."""
@@ -96,6 +241,112 @@ def set_parameter(sim_params, *, names, values):
         else:
             raise ValueError('Bad parameter name: "{}".'.format(name))
 
+# Classes - LinearParams
+class LinearParams(dcs.Frozen):
+    r"""Linear model parameters, where some parameters only affect some of the outputs."""
+    def __init__(self):
+        self.a = 1.
+        self.b = 2.
+        self.c = 3.
+        self.d = 4.
+
+# Functions - linear_model
+def linear_model(sim_params):
+    r"""Simple linear model with a block sparse Jacobian."""
+    return np.array([sim_params.a + 2*sim_params.b, 3*sim_params.a, 4*sim_params.c, sim_params.c - sim_params.d])
+
+# Functions - linear_cost
+def linear_cost(results_data, *, sim_params):
+    r"""Cost function for the linear model."""
+    return results_data - np.array([1., 2., 3., 4.])
+
+# Classes - NoiseParams
+class NoiseParams(dcs.Frozen):
+    r"""Line fit parameters, including the standard deviation of the measurement noise."""
+    def __init__(self, time):
+        self.time  = time
+        self.a     = 1.
+        self.b     = 0.
+        self.sigma = 0.1
+
+# Functions - noise_model
+def noise_model(sim_params):
+    r"""Simple line model."""
+    return sim_params.a * sim_params.time + sim_params.b
+
+# Functions - noise_batch_model
+def noise_batch_model(sim_params, *, names, values):
+    r"""Vectorized version of the line model, which leaves the noise to the cost function."""
+    params = {key: np.full(values.shape[0], getattr(sim_params, key), dtype=values.dtype) for key in ['a', 'b']}
+    for (ix, name) in enumerate(names):
+        if name in params:
+            params[name] = values[:, ix]
+    return params['a'][:, np.newaxis] * sim_params.time[np.newaxis, :] + params['b'][:, np.newaxis]
+
+# Functions - noise_cost
+def noise_cost(results_data, *, sim_params, truth_data):
+    r"""Cost function for the line model, with the innovations normalized by the noise."""
+    return (results_data - truth_data) / sim_params.sigma
+
+# Functions - noise_log_det
+def noise_log_det(sim_params, *, truth_data):
+    r"""Log determinant of the innovation covariance for the line model, which is sigma**2 times identity."""
+    return 2 * truth_data.size * np.log(np.abs(sim_params.sigma))
+
+# Classes - PolyNoiseParams
+class PolyNoiseParams(dcs.Frozen):
+    r"""Polynomial fit parameters, including the standard deviation of the measurement noise."""
+    def __init__(self, time, degree):
+        self.time   = time
+        self.coeffs = np.zeros(degree + 1)
+        self.sigma  = 1.
+
+# Functions - poly_model
+def poly_model(sim_params):
+    r"""Simple polynomial model."""
+    return np.polyval(sim_params.coeffs, sim_params.time)
+
+# Functions - get_poly_parameter
+def get_poly_parameter(sim_params, *, names):
+    r"""Parameter getter for the polynomial model, with the coefficients first and then the noise."""
+    return np.hstack((sim_params.coeffs, sim_params.sigma))
+
+# Functions - set_poly_parameter
+def set_poly_parameter(sim_params, *, names, values):
+    r"""Parameter setter for the polynomial model."""
+    sim_params.coeffs = values[:-1].copy()
+    sim_params.sigma  = values[-1]
+
+# Functions - weak_linear_model
+def weak_linear_model(sim_params):
+    r"""Linear model where the last parameter barely affects the outputs."""
+    return np.array([sim_params.a + 2*sim_params.b, 3*sim_params.a, 4*sim_params.c, sim_params.c - 1e-4*sim_params.d])
+
+# Functions - weak_linear_cost
+def weak_linear_cost(results_data, *, sim_params):
+    r"""Cost function for the weak linear model, which is consistent with the initial d."""
+    return results_data - np.array([1., 2., 3., 0.75 - 4e-4])
+
+# Classes - CohortParams
+class CohortParams(dcs.Frozen):
+    r"""Decay model parameters, with a global rate, and then a scale and offset for each cohort."""
+    def __init__(self, time, num_cohorts):
+        self.time   = time
+        self.rate   = 0.1
+        self.scale  = np.ones(num_cohorts)
+        self.offset = np.zeros(num_cohorts)
+
+# Functions - cohort_model
+def cohort_model(sim_params):
+    r"""Decay model for every cohort, one after the other."""
+    return (sim_params.scale[:, np.newaxis] * np.exp(-sim_params.rate * sim_params.time) + \
+        sim_params.offset[:, np.newaxis]).ravel()
+
+# Functions - cohort_cost
+def cohort_cost(results_data, *, sim_params, truth_data):
+    r"""Cost function for the cohort model."""
+    return results_data - truth_data
+
 #%% Logger
 class Test_Logger(unittest.TestCase):
     r"""
@@ -104,6 +355,7 @@ class Test_Logger(unittest.TestCase):
         Set level
         Bad level (raises ValueError)
         printing
+        Standard logger level
     """
     def setUp(self):
         self.level  = 8
@@ -136,6 +388,14 @@ class Test_Logger(unittest.TestCase):
         out.close()
         self.assertEqual(output, self.print)
 
+    def test_logging_level(self):
+        logger = logging.getLogger('dstauffman.bpe')
+        self.assertEqual(logger.getEffectiveLevel(), 12)
+        self.assertTrue(logger.isEnabledFor(logging.DEBUG + 2))
+        self.assertFalse(logger.isEnabledFor(logging.DEBUG + 1))
+        self.logger.set_level(0)
+        self.assertEqual(logger.getEffectiveLevel(), logging.INFO)
+
 #%% OptiOpts
 class Test_OptiOpts(unittest.TestCase):
     r"""
@@ -170,6 +430,7 @@ class Test_OptiParam(unittest.TestCase):
         Initialization
         Equality
         Inequality
+        Group inequality
         Get array (x5)
         Get names
     """
@@ -192,6 +453,13 @@ class Test_OptiParam(unittest.TestCase):
         opti_param = dcs.OptiParam('test')
         self.assertNotEqual(opti_param, 2)
 
+    def test_group_inequality(self):
+        opti_param1 = dcs.OptiParam('test')
+        opti_param2 = dcs.OptiParam('test', group='cohort1')
+        self.assertNotEqual(opti_param1, opti_param2)
+        opti_param1.group = 'cohort1'
+        self.assertEqual(opti_param1, opti_param2)
+
     def test_get_array(self):
         opti_param = dcs.OptiParam('test')
         params = [opti_param, opti_param]
@@ -237,6 +505,7 @@ class Test_BpeResults(unittest.TestCase):
         Load (HDF5)
         str method
         pprint method
+        timing report
     """
     def setUp(self):
         self.bpe_results = dcs.BpeResults()
@@ -258,6 +527,14 @@ class Test_BpeResults(unittest.TestCase):
         bpe_results = dcs.BpeResults.load(self.filename)
         self.assertTrue(dcs.compare_two_classes(bpe_results, self.bpe_results, suppress_output=True))
 
+    def test_load_timing(self):
+        self.bpe_results.model_times  = [0.1, 0.2]
+        self.bpe_results.num_accepted = 3
+        self.bpe_results.save(self.filename)
+        bpe_results = dcs.BpeResults.load(self.filename)
+        np.testing.assert_array_equal(bpe_results.model_times, [0.1, 0.2])
+        self.assertEqual(bpe_results.num_accepted, 3)
+
     def test_load2(self):
         self.bpe_results.save(self.filename, use_hdf5=False)
         bpe_results = dcs.BpeResults.load(self.filename, use_hdf5=False)
@@ -284,6 +561,21 @@ class Test_BpeResults(unittest.TestCase):
         self.assertEqual(lines[2], 'Final parameters:')
         self.assertEqual(lines[3].strip(), 'a = 2')
 
+    def test_timing_report(self):
+        self.bpe_results.search_times = [1., 3.]
+        self.bpe_results.num_rejected = 2
+        with dcs.capture_output() as out:
+            text = self.bpe_results.timing_report()
+        output = out.getvalue().strip()
+        out.close()
+        self.assertEqual(output, text)
+        lines = text.split('\n')
+        self.assertEqual(lines[0], 'Timing summary:')
+        self.assertEqual(len(lines), 8)
+        self.assertEqual(lines[4].split(), ['search:', '2', 'calls,', '4.000', 's', 'total,', '2.0000', 's', \
+            'mean,', '3.0000', 's', 'max'])
+        self.assertEqual(lines[7].split(), ['trial', 'steps:', '0', 'accepted,', '2', 'rejected'])
+
     def tearDown(self):
         if os.path.isfile(self.filename):
             os.remove(self.filename)
@@ -350,6 +642,64 @@ class Test__print_divider(unittest.TestCase):
         lines = out.getvalue().split('\n')
         self.assertEqual(lines[0], self.output)
 
+#%% _ParamBinding
+class Test__ParamBinding(unittest.TestCase):
+    r"""
+    Tests the _ParamBinding class with the following cases:
+        Attributes
+        Array slots
+        Model arguments
+        Bad names
+        Copy arguments
+    """
+    def setUp(self):
+        self.sim_params = SimParams(np.arange(5.), magnitude=3.5, frequency=12, phase=180)
+        self.table = np.zeros((2, 3))
+        self.model_args = {'sim_params': self.sim_params, 'table': self.table, 'scale': 1., \
+            'items': [SimParams(None, magnitude=1, frequency=2, phase=3)]}
+
+    def test_attributes(self):
+        binding = dcs.bpe._ParamBinding(['sim_params.phase', 'sim_params.magnitude', 'items[0].frequency'], \
+            self.model_args)
+        np.testing.assert_array_equal(binding.get(), np.array([180., 3.5, 2.]))
+        binding.set(np.array([90., 5., 10.]))
+        self.assertEqual(self.sim_params.phase, 90.)
+        self.assertEqual(self.sim_params.magnitude, 5.)
+        self.assertEqual(self.model_args['items'][0].frequency, 10.)
+
+    def test_array_slots(self):
+        binding = dcs.bpe._ParamBinding(['table[1, 2]', 'sim_params.time[3]', 'table[0, 1]', 'table[-1, 0]'], \
+            self.model_args)
+        self.assertEqual(len(binding.arrays), 2)
+        binding.set(np.array([1., 2., 3., 4.]))
+        np.testing.assert_array_equal(self.table, np.array([[0., 3., 0.], [4., 0., 1.]]))
+        np.testing.assert_array_equal(self.sim_params.time, np.array([0., 1., 2., 2., 4.]))
+        np.testing.assert_array_equal(binding.get(), np.array([1., 2., 3., 4.]))
+
+    def test_model_args(self):
+        binding = dcs.bpe._ParamBinding(['scale'], self.model_args)
+        binding.set(np.array([2.5]))
+        self.assertEqual(self.model_args['scale'], 2.5)
+        np.testing.assert_array_equal(binding.get(), np.array([2.5]))
+
+    def test_bad_names(self):
+        for name in ['magnitude', 'sim_params.bad', 'sim_params..phase', 'table[a]', 'table[5, 0]', '[0]', \
+                'sim_params.time[0]x']:
+            with self.assertRaises(ValueError):
+                dcs.bpe._ParamBinding([name], self.model_args)
+
+    def test_copy_args(self):
+        binding = dcs.bpe._ParamBinding(['sim_params.time[3]', 'items[0].frequency', 'scale'], self.model_args)
+        (new_args, new_binding) = binding.copy_args(self.model_args)
+        new_binding.set(np.array([7., 8., 9.]))
+        np.testing.assert_array_equal(new_binding.get(), np.array([7., 8., 9.]))
+        np.testing.assert_array_equal(binding.get(), np.array([3., 2., 1.]))
+        self.assertEqual(self.sim_params.time[3], 3.)
+        # only the objects along the parameter paths are copied
+        self.assertIsNot(new_args['sim_params'], self.sim_params)
+        self.assertIsNot(new_args['items'][0], self.model_args['items'][0])
+        self.assertIs(new_args['table'], self.table)
+
 #%% _function_wrapper
 class Test__function_wrapper(unittest.TestCase):
     r"""
@@ -357,13 +707,16 @@ class Test__function_wrapper(unittest.TestCase):
         Nominal
         Model args
         Cost args
+        Cache
+        Model Jacobian
     """
     def setUp(self):
         self.results = np.array([1, 2, np.nan])
         self.innovs  = np.array([1, 2, 0])
         func = lambda *args, **kwargs: np.array([1, 2, np.nan])
-        self.opti_opts = type('Class1', (object, ), {'model_args': {}, 'cost_args': {}, 'model_func': func, 'cost_func': func})
-        self.bpe_results = type('Class2', (object, ), {'num_evals': 0})
+        self.opti_opts = type('Class1', (object, ), {'model_args': {}, 'cost_args': {}, 'model_func': func, \
+            'cost_func': func, 'stream_innovs': False, 'event_hook': None, 'model_jacobian': False})
+        self.bpe_results = type('Class2', (object, ), {'num_evals': 0, 'model_times': [], 'cost_times': []})
 
     def test_nominal(self):
         (results, innovs) = dcs.bpe._function_wrapper(self.opti_opts, self.bpe_results)
@@ -380,8 +733,551 @@ class Test__function_wrapper(unittest.TestCase):
         np.testing.assert_array_equal(results, self.results)
         np.testing.assert_array_equal(innovs, self.innovs)
 
+    def test_cache(self):
+        bpe_results = dcs.BpeResults()
+        cache = dcs.bpe._EvalCache(1000)
+        params = np.array([1., 2.])
+        (results, innovs) = dcs.bpe._function_wrapper(self.opti_opts, bpe_results, params=params, cache=cache)
+        np.testing.assert_array_equal(results, self.results)
+        (results, innovs) = dcs.bpe._function_wrapper(self.opti_opts, bpe_results, params=params, cache=cache)
+        self.assertIsNone(results)
+        np.testing.assert_array_equal(innovs, self.innovs)
+        (results, innovs) = dcs.bpe._function_wrapper(self.opti_opts, bpe_results, params=params, \
+            cache=cache, need_results=True)
+        np.testing.assert_array_equal(results, self.results)
+        self.assertEqual(bpe_results.num_evals, 2)
+        self.assertEqual(bpe_results.num_cache_hits, 1)
+        self.assertEqual(bpe_results.num_cache_misses, 2)
+
+    def test_model_jacobian(self):
+        self.opti_opts.model_func     = lambda **kwargs: (np.array([1, 2, np.nan]), np.eye(3))
+        self.opti_opts.model_jacobian = True
+        jacobians = {}
+        params = np.array([1., 2.])
+        (results, innovs) = dcs.bpe._function_wrapper(self.opti_opts, self.bpe_results, params=params, \
+            jacobians=jacobians)
+        np.testing.assert_array_equal(results, self.results)
+        np.testing.assert_array_equal(innovs, self.innovs)
+        self.assertEqual(list(jacobians), [params.tobytes()])
+        np.testing.assert_array_equal(jacobians[params.tobytes()], np.eye(3))
+
+#%% _incremental_wrapper
+class Test__incremental_wrapper(unittest.TestCase):
+    r"""
+    Tests the _incremental_wrapper function with the following cases:
+        Nominal
+        Aborted
+        Returned results
+    """
+    def setUp(self):
+        self.closed = []
+        def model(scale):
+            try:
+                for i in range(4):
+                    yield np.array([1., np.nan]) * scale * (i + 1)
+            finally:
+                self.closed.append(True)
+        self.opti_opts = dcs.OptiOpts()
+        self.opti_opts.model_func = model
+        self.opti_opts.cost_func  = lambda results, scale: results.copy()
+        self.bpe_results = dcs.BpeResults()
+
+    def test_nominal(self):
+        (results, innovs) = dcs.bpe._incremental_wrapper(self.opti_opts, self.bpe_results, {'scale': 1.}, {})
+        np.testing.assert_array_equal(innovs, [1., 0., 2., 0., 3., 0., 4., 0.])
+        self.assertEqual(len(results), 4)
+        self.assertEqual(len(self.bpe_results.cost_times), 4)
+        self.assertEqual(self.closed, [True])
+
+    def test_aborted(self):
+        (results, innovs) = dcs.bpe._incremental_wrapper(self.opti_opts, self.bpe_results, {'scale': 1.}, {}, \
+            max_cost=2.)
+        self.assertIsNone(results)
+        self.assertIsNone(innovs)
+        self.assertEqual(len(self.bpe_results.cost_times), 2)
+        self.assertEqual(self.bpe_results.num_aborted, 1)
+        self.assertEqual(self.closed, [True])
+
+    def test_returned(self):
+        def model():
+            yield np.array([1.])
+            return 'results'
+        self.opti_opts.model_func = model
+        self.opti_opts.cost_func  = lambda results: results
+        (results, innovs) = dcs.bpe._incremental_wrapper(self.opti_opts, self.bpe_results, {}, {})
+        self.assertEqual(results, 'results')
+        np.testing.assert_array_equal(innovs, [1.])
+
+#%% _EvalCache
+class Test__EvalCache(unittest.TestCase):
+    r"""
+    Tests the _EvalCache class with the following cases:
+        Miss and hit
+        Results
+        Eviction
+        Too big
+    """
+    def setUp(self):
+        self.params = [np.array([1., 2.]), np.array([1., 3.]), np.array([1., 4.])]
+        self.innovs = np.ones(10)
+
+    def test_miss_and_hit(self):
+        cache = dcs.bpe._EvalCache(1000)
+        self.assertIsNone(cache.get(self.params[0]))
+        cache.put(self.params[0], 'results', self.innovs)
+        (results, innovs) = cache.get(self.params[0])
+        self.assertIsNone(results)
+        np.testing.assert_array_equal(innovs, self.innovs)
+
+    def test_results(self):
+        cache = dcs.bpe._EvalCache(1000, keep_results=True)
+        cache.put(self.params[0], 'results', self.innovs)
+        (results, _) = cache.get(self.params[0], need_results=True)
+        self.assertEqual(results, 'results')
+
+    def test_eviction(self):
+        cache = dcs.bpe._EvalCache(2*self.innovs.nbytes)
+        cache.put(self.params[0], None, self.innovs)
+        cache.put(self.params[1], None, self.innovs)
+        cache.get(self.params[0])
+        cache.put(self.params[2], None, self.innovs)
+        self.assertIsNotNone(cache.get(self.params[0]))
+        self.assertIsNone(cache.get(self.params[1]))
+        self.assertIsNotNone(cache.get(self.params[2]))
+        self.assertEqual(cache.num_bytes, 2*self.innovs.nbytes)
+
+    def test_too_big(self):
+        cache = dcs.bpe._EvalCache(10)
+        cache.put(self.params[0], None, self.innovs)
+        self.assertIsNone(cache.get(self.params[0]))
+
+#%% _DiskCache
+class Test__DiskCache(unittest.TestCase):
+    r"""
+    Tests the _DiskCache class with the following cases:
+        Miss and hit
+        Different model version
+        Eviction
+    """
+    def setUp(self):
+        self.folder = os.path.join(dcs.get_tests_dir(), 'temp_eval_cache')
+        self.names  = ['a', 'b']
+        self.params = [np.array([1., 2.]), np.array([1., 3.]), np.array([1., 4.])]
+        self.innovs = np.arange(10.)
+
+    def test_miss_and_hit(self):
+        cache = dcs.bpe._DiskCache(self.folder, self.names, 'v1', 1e6)
+        self.assertIsNone(cache.get(self.params[0]))
+        cache.put(self.params[0], self.innovs)
+        np.testing.assert_array_equal(cache.get(self.params[0]), self.innovs)
+        self.assertIsNone(cache.get(self.params[1]))
+
+    def test_model_version(self):
+        cache = dcs.bpe._DiskCache(self.folder, self.names, 'v1', 1e6)
+        cache.put(self.params[0], self.innovs)
+        cache2 = dcs.bpe._DiskCache(self.folder, self.names, 'v2', 1e6)
+        self.assertIsNone(cache2.get(self.params[0]))
+
+    def test_eviction(self):
+        cache = dcs.bpe._DiskCache(self.folder, self.names, 'v1', 1e6)
+        cache.put(self.params[0], self.innovs)
+        file_size = os.path.getsize(cache._filename(self.params[0]))
+        cache.max_bytes = 2*file_size
+        cache.put(self.params[1], self.innovs)
+        # make the first entry the most recently used
+        os.utime(cache._filename(self.params[1]), (0, 0))
+        self.assertIsNotNone(cache.get(self.params[0]))
+        cache.put(self.params[2], self.innovs)
+        self.assertIsNotNone(cache.get(self.params[0]))
+        self.assertIsNone(cache.get(self.params[1]))
+        self.assertIsNotNone(cache.get(self.params[2]))
+
+    def tearDown(self):
+        if os.path.isdir(self.folder):
+            shutil.rmtree(self.folder)
+
+#%% _SharedArrays
+class Test__SharedArrays(unittest.TestCase):
+    r"""
+    Tests the _SharedArrays class and _attach_shared function with the following cases:
+        Share and attach
+        Memory mapped files
+        Shared memory blocks
+        Small arrays
+    """
+    def setUp(self):
+        self.shared = dcs.bpe._SharedArrays(100)
+        self.sim_params = SimParams(np.arange(1000.), magnitude=3.5, frequency=12, phase=180)
+        self.args = {'sim_params': self.sim_params, 'data': (np.ones(2), np.arange(100))}
+
+    def test_share(self):
+        out = self.shared.share(self.args)
+        self.assertIsInstance(out['sim_params'].time, dcs.bpe._SharedArrayRef)
+        self.assertIs(out['data'][0], self.args['data'][0])
+        self.assertIsInstance(out['data'][1], dcs.bpe._SharedArrayRef)
+        self.assertEqual(out['sim_params'].magnitude, 3.5)
+        # the original is left alone
+        self.assertIsInstance(self.sim_params.time, np.ndarray)
+        attached = []
+        views = dcs.bpe._attach_shared(out, attached)
+        self.assertEqual(len(attached), 2)
+        np.testing.assert_array_equal(views['sim_params'].time, self.sim_params.time)
+        np.testing.assert_array_equal(views['data'][1], np.arange(100))
+        self.assertFalse(views['sim_params'].time.flags.writeable)
+        del views
+        attached.clear()
+
+    def test_files(self):
+        self.shared.use_files = True
+        out = self.shared.share(self.args)
+        self.assertTrue(out['sim_params'].time.is_file)
+        folder = self.shared.folder
+        self.assertEqual(sorted(os.listdir(folder)), ['array0.bin', 'array1.bin'])
+        attached = []
+        views = dcs.bpe._attach_shared(out, attached)
+        np.testing.assert_array_equal(views['sim_params'].time, self.sim_params.time)
+        self.assertFalse(views['data'][1].flags.writeable)
+        del views
+        attached.clear()
+        self.shared.close()
+        self.assertFalse(os.path.isdir(folder))
+        self.assertIsNone(self.shared.folder)
+
+    @unittest.skipIf(not dcs.bpe._SHM_BLOCKS, 'Untracked shared memory blocks are only available in Python v3.13+.')
+    def test_blocks(self):
+        self.shared.use_files = False
+        out = self.shared.share(self.args)
+        self.assertFalse(out['sim_params'].time.is_file)
+        self.assertIsNone(self.shared.folder)
+        attached = []
+        views = dcs.bpe._attach_shared(out, attached)
+        np.testing.assert_array_equal(views['data'][1], np.arange(100))
+        del views
+        for (block, _) in attached:
+            block.close()
+        attached.clear()
+
+    def test_small(self):
+        self.shared.min_bytes = 10000
+        out = self.shared.share(self.args)
+        self.assertIs(out, self.args)
+        self.assertEqual(self.shared.blocks, [])
+
+    def tearDown(self):
+        self.shared.close()
+
+#%% _Evaluator
+class Test__Evaluator(unittest.TestCase):
+    r"""
+    Tests the _Evaluator class with the following cases:
+        Coroutine model
+        Timeouts
+        Bound parameters
+        Given event loop
+        Running event loop
+        Streamed innovations
+    """
+    def setUp(self):
+        time = np.arange(11)
+        self.names = ['magnitude']
+        self.opti_opts = dcs.OptiOpts()
+        self.opti_opts.model_func     = slow_sim_model
+        self.opti_opts.model_args     = {'sim_params': SimParams(time, magnitude=3.5, frequency=12, phase=180)}
+        self.opti_opts.cost_func      = cost_wrapper
+        self.opti_opts.cost_args      = {'results_time': time, 'truth_time': time, 'truth_data': np.zeros(11)}
+        self.opti_opts.set_param_func = set_parameter
+        self.opti_opts.eval_timeout   = 0.5
+        self.bpe_results = dcs.BpeResults()
+        self.evaluator = dcs.bpe._Evaluator(self.opti_opts, self.opti_opts.model_args, self.names)
+
+    def test_async(self):
+        self.assertTrue(self.evaluator.is_async)
+        param_sets = [np.array([3.]), np.array([4.]), np.array([5.])]
+        innovs = self.evaluator.run(self.bpe_results, param_sets)
+        self.assertEqual(self.bpe_results.num_evals, 3)
+        for (values, this_innovs) in zip(param_sets, innovs):
+            sim_params = SimParams(np.arange(11), magnitude=values[0], frequency=12, phase=180)
+            np.testing.assert_array_almost_equal(this_innovs, sim_model(sim_params))
+        # the shared model arguments are only changed when running a single set
+        self.assertEqual(self.opti_opts.model_args['sim_params'].magnitude, 3.5)
+        (results, _) = self.evaluator.run_one(self.bpe_results, np.array([3.]))
+        self.assertEqual(self.opti_opts.model_args['sim_params'].magnitude, 3.)
+        self.assertEqual(results.shape, (11, ))
+
+    def test_timeouts(self):
+        param_sets = [np.array([3.]), np.array([1.])]
+        innovs = self.evaluator.run(self.bpe_results, param_sets, allow_timeouts=True)
+        self.assertIsNotNone(innovs[0])
+        self.assertIsNone(innovs[1])
+        with self.assertRaises(TimeoutError):
+            self.evaluator.run(self.bpe_results, param_sets)
+        with self.assertRaises(TimeoutError):
+            self.evaluator.run_one(self.bpe_results, np.array([1.]))
+
+    def test_bind_params(self):
+        self.opti_opts.bind_params = True
+        evaluator = dcs.bpe._Evaluator(self.opti_opts, self.opti_opts.model_args, ['sim_params.magnitude'])
+        innovs = evaluator.run(self.bpe_results, [np.array([3.]), np.array([4.])])
+        for (magnitude, this_innovs) in zip([3., 4.], innovs):
+            sim_params = SimParams(np.arange(11), magnitude=magnitude, frequency=12, phase=180)
+            np.testing.assert_array_almost_equal(this_innovs, sim_model(sim_params))
+        self.assertEqual(self.opti_opts.model_args['sim_params'].magnitude, 3.5)
+
+    def test_given_loop(self):
+        loop = asyncio.new_event_loop()
+        try:
+            evaluator = dcs.bpe._Evaluator(self.opti_opts, self.opti_opts.model_args, self.names, loop=loop)
+            innovs = evaluator.run(self.bpe_results, [np.array([3.]), np.array([4.])])
+            self.assertEqual(len(innovs), 2)
+            self.assertFalse(loop.is_closed())
+        finally:
+            loop.close()
+
+    def test_stream_innovs(self):
+        # the streamed chunks keep the parameters of their own evaluation
+        self.opti_opts.model_func    = sim_model
+        self.opti_opts.cost_func     = lambda results, sim_params, **kwargs: iter([np.array([sim_params.magnitude])])
+        self.opti_opts.stream_innovs = True
+        evaluator = dcs.bpe._Evaluator(self.opti_opts, self.opti_opts.model_args, self.names)
+        innovs = evaluator.run(self.bpe_results, [np.array([3.]), np.array([4.])])
+        self.assertEqual([list(x) for x in innovs], [[np.array([3.])], [np.array([4.])]])
+
+    def test_running_loop(self):
+        loop = asyncio.new_event_loop()
+        evaluator = dcs.bpe._Evaluator(self.opti_opts, self.opti_opts.model_args, self.names, loop=loop)
+        async def run_within():
+            evaluator.run(self.bpe_results, [np.array([3.])])
+        try:
+            with self.assertRaises(RuntimeError):
+                loop.run_until_complete(run_within())
+        finally:
+            loop.close()
+
+#%% _color_columns
+class Test__color_columns(unittest.TestCase):
+    r"""
+    Tests the _color_columns function with the following cases:
+        Dense
+        Diagonal
+        Block sparse
+    """
+    def test_dense(self):
+        groups = dcs.bpe._color_columns(np.ones((3, 3), dtype=bool))
+        self.assertEqual(groups, [[0], [1], [2]])
+
+    def test_diagonal(self):
+        groups = dcs.bpe._color_columns(np.eye(4, dtype=bool))
+        self.assertEqual(groups, [[0, 1, 2, 3]])
+
+    def test_block_sparse(self):
+        sparsity = np.array([[1, 1, 0, 0], [1, 0, 0, 0], [0, 0, 1, 0], [0, 0, 1, 1]], dtype=bool)
+        groups = dcs.bpe._color_columns(sparsity)
+        self.assertEqual(groups, [[0, 2], [1, 3]])
+
+#%% _BlockArrow
+class Test__BlockArrow(unittest.TestCase):
+    r"""
+    Tests the _BlockArrow class with the following cases:
+        Sparsity
+        Colors
+        Split
+        Gradient
+        Hessian
+        Solve
+        Solve damped
+        Solve without globals
+        Solve with a singular block
+        Covariance
+        Covariance without globals
+        Covariance with a singular block
+    """
+    def setUp(self):
+        self.blocks = dcs.bpe._BlockArrow([None, 'a', 'b', None, 'b'], ['b', 'a', 'a', 'b', 'c', 'b'])
+        self.jacobian = np.array([[1., 0., 2., 0.5, 1.], [2., 1., 0., 0., 0.], [0., 3., 0., 1., 0.], \
+            [1., 0., 1., 2., -1.], [0., 0., 0., 1., 0.], [1., 0., 0., 0., 4.]])
+        self.innovs = np.array([1., -2., 0.5, 3., -1., 2.])
+
+    def test_sparsity(self):
+        sparsity = self.blocks.sparsity()
+        self.assertEqual(sparsity.shape, (6, 5))
+        np.testing.assert_array_equal(sparsity[:, [0, 3]], True)
+        np.testing.assert_array_equal(sparsity[:, 1], [False, True, True, False, False, False])
+        np.testing.assert_array_equal(sparsity[:, 2], [True, False, False, True, False, True])
+        self.assertTrue(np.all(sparsity[self.jacobian != 0]))
+
+    def test_colors(self):
+        self.assertEqual(self.blocks.colors(), [[0], [3], [1, 2], [4]])
+
+    def test_split(self):
+        jacobian = self.blocks.split(self.jacobian)
+        self.assertEqual(jacobian.glob.shape, (6, 2))
+        self.assertEqual([block.shape for block in jacobian.groups], [(2, 1), (3, 2)])
+        np.testing.assert_array_equal(jacobian.toarray(), self.jacobian)
+
+    def test_gradient(self):
+        gradient = self.blocks.gradient(self.blocks.split(self.jacobian), self.innovs)
+        np.testing.assert_array_almost_equal(gradient, self.jacobian.T @ self.innovs)
+
+    def test_hessian(self):
+        hessian = self.blocks.hessian(self.blocks.split(self.jacobian))
+        np.testing.assert_array_almost_equal(hessian, self.jacobian.T @ self.jacobian)
+
+    def test_solve(self):
+        hessian  = self.jacobian.T @ self.jacobian
+        gradient = self.jacobian.T @ self.innovs
+        np.testing.assert_array_almost_equal(self.blocks.solve(hessian, gradient), \
+            np.linalg.solve(hessian, gradient))
+
+    def test_solve_damped(self):
+        hessian  = self.jacobian.T @ self.jacobian
+        gradient = self.jacobian.T @ self.innovs
+        np.testing.assert_array_almost_equal(self.blocks.solve(hessian, gradient, lambda_=0.5), \
+            np.linalg.solve(hessian + 0.5*np.eye(5), gradient))
+
+    def test_no_globals(self):
+        blocks   = dcs.bpe._BlockArrow(['a', 'b', 'b'], ['a', 'b', 'b', 'a'])
+        jacobian = np.array([[1., 0., 0.], [0., 2., 1.], [0., 1., 3.], [2., 0., 0.]])
+        hessian  = jacobian.T @ jacobian
+        gradient = np.array([1., 2., 3.])
+        np.testing.assert_array_almost_equal(blocks.solve(hessian, gradient), np.linalg.solve(hessian, gradient))
+
+    def test_singular_block(self):
+        jacobian = self.jacobian.copy()
+        jacobian[:, 1] = 0
+        hessian  = self.blocks.hessian(self.blocks.split(jacobian))
+        gradient = jacobian.T @ self.innovs
+        solution = self.blocks.solve(hessian, gradient)
+        self.assertEqual(solution[1], 0)
+        np.testing.assert_array_almost_equal(hessian @ solution, gradient)
+
+    def test_covariance(self):
+        hessian = self.jacobian.T @ self.jacobian
+        np.testing.assert_array_almost_equal(self.blocks.covariance(hessian), np.linalg.inv(hessian))
+
+    def test_covariance_no_globals(self):
+        blocks   = dcs.bpe._BlockArrow(['a', 'b', 'b'], ['a', 'b', 'b', 'a'])
+        jacobian = np.array([[1., 0., 0.], [0., 2., 1.], [0., 1., 3.], [2., 0., 0.]])
+        hessian  = jacobian.T @ jacobian
+        np.testing.assert_array_almost_equal(blocks.covariance(hessian), np.linalg.inv(hessian))
+
+    def test_covariance_singular(self):
+        jacobian = self.jacobian.copy()
+        jacobian[:, 1] = 0
+        hessian = self.blocks.hessian(self.blocks.split(jacobian))
+        np.testing.assert_array_almost_equal(self.blocks.covariance(hessian), np.linalg.pinv(hessian))
+
+#%% _BlockJacobian
+class Test__BlockJacobian(unittest.TestCase):
+    r"""
+    Tests the _BlockJacobian class with the following cases:
+        Zeros
+        Set columns
+    """
+    def setUp(self):
+        self.blocks = dcs.bpe._BlockArrow([None, 'a', 'b', 'b'], ['a', 'a', 'b', 'b', 'b'])
+
+    def test_zeros(self):
+        jacobian = dcs.bpe._BlockJacobian.zeros(self.blocks)
+        self.assertEqual(jacobian.glob.shape, (5, 1))
+        self.assertEqual([block.shape for block in jacobian.groups], [(2, 1), (3, 2)])
+        np.testing.assert_array_equal(jacobian.toarray(), np.zeros((5, 4)))
+
+    def test_set_column(self):
+        jacobian = dcs.bpe._BlockJacobian.zeros(self.blocks)
+        dense    = np.arange(20.).reshape(5, 4)
+        for i_param in range(4):
+            jacobian.set_column(i_param, dense[:, i_param])
+        np.testing.assert_array_equal(jacobian.toarray(), np.where(self.blocks.sparsity(), dense, 0.))
+
 #%% _finite_differences
-pass
+class Test__finite_differences(unittest.TestCase):
+    r"""
+    Tests the _finite_differences function with the following cases:
+        One sided
+        Two sided
+        Sparse
+        Bad sparsity pattern
+        Block-arrow
+        Bad innovation groups
+        Complex step
+        Complex step with a real model
+    """
+    def setUp(self):
+        self.logger = dcs.Logger(0)
+        names = ['a', 'b', 'c', 'd']
+        self.model_args = {'sim_params': LinearParams()}
+        self.opti_opts = dcs.OptiOpts()
+        self.opti_opts.model_func     = linear_model
+        self.opti_opts.model_args     = self.model_args
+        self.opti_opts.cost_func      = linear_cost
+        self.opti_opts.cost_args      = {}
+        self.opti_opts.get_param_func = get_parameter
+        self.opti_opts.set_param_func = set_parameter
+        self.opti_opts.params = [dcs.OptiParam(name, minstep=0.01) for name in names]
+        self.bpe_results = dcs.BpeResults()
+        self.bpe_results.param_names = [name.encode('utf-8') for name in names]
+        self.cur_results = dcs.CurrentResults()
+        self.cur_results.trust_rad = 1.
+        self.cur_results.params = get_parameter(names=names, **self.model_args)
+        self.cur_results.innovs = linear_cost(linear_model(**self.model_args), **self.model_args)
+        self.jacobian = np.array([[1., 2., 0., 0.], [3., 0., 0., 0.], [0., 0., 4., 0.], [0., 0., 1., -1.]])
+        self.sparsity = self.jacobian != 0
+
+    def test_one_sided(self):
+        (jacobian, gradient, hessian) = dcs.bpe._finite_differences(self.opti_opts, self.model_args, \
+            self.bpe_results, self.cur_results)
+        np.testing.assert_array_almost_equal(jacobian, self.jacobian)
+        np.testing.assert_array_almost_equal(gradient, jacobian.T @ self.cur_results.innovs)
+        np.testing.assert_array_almost_equal(hessian, jacobian.T @ jacobian)
+        self.assertEqual(self.bpe_results.num_evals, 4)
+
+    def test_two_sided(self):
+        (jacobian, _, _) = dcs.bpe._finite_differences(self.opti_opts, self.model_args, \
+            self.bpe_results, self.cur_results, two_sided=True)
+        np.testing.assert_array_almost_equal(jacobian, self.jacobian)
+        self.assertEqual(self.bpe_results.num_evals, 8)
+
+    def test_sparse(self):
+        self.opti_opts.jacobian_sparsity = self.sparsity
+        (jacobian, _, _) = dcs.bpe._finite_differences(self.opti_opts, self.model_args, \
+            self.bpe_results, self.cur_results)
+        np.testing.assert_array_almost_equal(jacobian, self.jacobian)
+        self.assertEqual(self.bpe_results.num_evals, 2)
+
+    def test_bad_sparsity(self):
+        self.opti_opts.jacobian_sparsity = np.ones((2, 4), dtype=bool)
+        with self.assertRaises(ValueError):
+            dcs.bpe._finite_differences(self.opti_opts, self.model_args, self.bpe_results, self.cur_results)
+
+    def test_block_arrow(self):
+        blocks = dcs.bpe._BlockArrow([None, 'x', 'y', 'y'], ['x', 'x', 'y', 'y'])
+        (jacobian, gradient, hessian) = dcs.bpe._finite_differences(self.opti_opts, self.model_args, \
+            self.bpe_results, self.cur_results, blocks=blocks)
+        self.assertIsInstance(jacobian, dcs.bpe._BlockJacobian)
+        np.testing.assert_array_almost_equal(jacobian.toarray(), self.jacobian)
+        np.testing.assert_array_almost_equal(gradient, self.jacobian.T @ self.cur_results.innovs)
+        np.testing.assert_array_almost_equal(hessian, self.jacobian.T @ self.jacobian)
+        self.assertEqual(self.bpe_results.num_evals, 3)
+
+    def test_bad_innov_groups(self):
+        blocks = dcs.bpe._BlockArrow([None, 'x', 'y', 'y'], ['x', 'y'])
+        with self.assertRaises(ValueError):
+            dcs.bpe._finite_differences(self.opti_opts, self.model_args, self.bpe_results, self.cur_results, \
+                blocks=blocks)
+
+    def test_complex_step(self):
+        (jacobian, gradient, _) = dcs.bpe._finite_differences(self.opti_opts, self.model_args, \
+            self.bpe_results, self.cur_results, complex_step=True)
+        np.testing.assert_array_almost_equal(jacobian, self.jacobian, decimal=14)
+        np.testing.assert_array_almost_equal(gradient, jacobian.T @ self.cur_results.innovs)
+        self.assertFalse(np.iscomplexobj(jacobian))
+        self.assertEqual(self.bpe_results.num_evals, 4)
+
+    def test_complex_step_real_model(self):
+        self.opti_opts.model_func = lambda sim_params: np.real(linear_model(sim_params))
+        with self.assertRaises(dcs.bpe._ComplexStepError):
+            dcs.bpe._finite_differences(self.opti_opts, self.model_args, self.bpe_results, self.cur_results, \
+                complex_step=True)
 
 #%% _levenberg_marquardt
 class Test__levenberg_marquardt(unittest.TestCase):
@@ -389,6 +1285,8 @@ class Test__levenberg_marquardt(unittest.TestCase):
     Tests the _levenberg_marquardt function with the following cases:
         with lambda_
         without lambda_
+        reused SVD
+        reused SVD of a rank deficient jacobian
     """
     def setUp(self):
         self.jacobian    = np.array([[1, 2], [3, 4], [5, 6]])
@@ -405,6 +1303,20 @@ class Test__levenberg_marquardt(unittest.TestCase):
         delta_param = dcs.bpe._levenberg_marquardt(self.jacobian, self.innovs, 0)
         np.testing.assert_array_almost_equal(delta_param, b)
 
+    def test_svd(self):
+        svd = np.linalg.svd(self.jacobian, full_matrices=False)
+        for lambda_ in [0, 1e-3, 5, 1e4]:
+            delta_param = dcs.bpe._levenberg_marquardt(self.jacobian, self.innovs, lambda_, svd=svd)
+            np.testing.assert_array_almost_equal(delta_param, dcs.bpe._levenberg_marquardt(self.jacobian, \
+                self.innovs, lambda_))
+
+    def test_svd_rank_deficient(self):
+        jacobian = np.array([[1., 2.], [2., 4.], [3., 6.]])
+        svd = np.linalg.svd(jacobian, full_matrices=False)
+        b = -np.linalg.pinv(jacobian).dot(self.innovs)
+        delta_param = dcs.bpe._levenberg_marquardt(jacobian, self.innovs, 0, svd=svd)
+        np.testing.assert_array_almost_equal(delta_param, b)
+
 #%% _predict_func_change
 class Test__predict_func_change(unittest.TestCase):
     r"""
@@ -421,6 +1333,71 @@ class Test__predict_func_change(unittest.TestCase):
         delta_func = dcs.bpe._predict_func_change(self.delta_param, self.gradient, self.hessian)
         self.assertEqual(delta_func, self.pred_change)
 
+#%% _broyden_update
+class Test__broyden_update(unittest.TestCase):
+    r"""
+    Tests the _broyden_update function with the following cases:
+        Secant condition
+        Linear model
+        Zero step
+    """
+    def setUp(self):
+        self.jacobian = np.array([[1., 2.], [3., 4.], [5., 6.]])
+
+    def test_secant(self):
+        delta_param  = np.array([0.5, -1.])
+        delta_innovs = np.array([1., 2., 3.])
+        jacobian = dcs.bpe._broyden_update(self.jacobian, delta_param, delta_innovs)
+        np.testing.assert_array_almost_equal(jacobian @ delta_param, delta_innovs)
+
+    def test_linear(self):
+        delta_param = np.array([0.5, -1.])
+        jacobian = dcs.bpe._broyden_update(self.jacobian, delta_param, self.jacobian @ delta_param)
+        np.testing.assert_array_almost_equal(jacobian, self.jacobian)
+
+    def test_zero_step(self):
+        jacobian = dcs.bpe._broyden_update(self.jacobian, np.zeros(2), np.ones(3))
+        np.testing.assert_array_equal(jacobian, self.jacobian)
+
+#%% _quasi_newton_update
+class Test__quasi_newton_update(unittest.TestCase):
+    r"""
+    Tests the _quasi_newton_update function with the following cases:
+        BFGS secant condition
+        BFGS negative curvature
+        SR1 secant condition
+        SR1 already satisfied
+        Bad method
+    """
+    def setUp(self):
+        self.hessian        = np.array([[2., 0.5], [0.5, 1.]])
+        self.delta_param    = np.array([0.5, -1.])
+        self.delta_gradient = np.array([1., -2.5])
+
+    def test_bfgs(self):
+        hessian = dcs.bpe._quasi_newton_update(self.hessian, self.delta_param, self.delta_gradient)
+        np.testing.assert_array_almost_equal(hessian @ self.delta_param, self.delta_gradient)
+        np.testing.assert_array_almost_equal(hessian, hessian.T)
+        self.assertTrue(np.all(np.linalg.eigvalsh(hessian) > 0))
+
+    def test_bfgs_negative_curvature(self):
+        hessian = dcs.bpe._quasi_newton_update(self.hessian, self.delta_param, -self.delta_gradient)
+        np.testing.assert_array_equal(hessian, self.hessian)
+
+    def test_sr1(self):
+        hessian = dcs.bpe._quasi_newton_update(self.hessian, self.delta_param, self.delta_gradient, method='sr1')
+        np.testing.assert_array_almost_equal(hessian @ self.delta_param, self.delta_gradient)
+        np.testing.assert_array_almost_equal(hessian, hessian.T)
+
+    def test_sr1_skip(self):
+        hessian = dcs.bpe._quasi_newton_update(self.hessian, self.delta_param, self.hessian @ self.delta_param, \
+            method='sr1')
+        np.testing.assert_array_equal(hessian, self.hessian)
+
+    def test_bad_method(self):
+        with self.assertRaises(ValueError):
+            dcs.bpe._quasi_newton_update(self.hessian, self.delta_param, self.delta_gradient, method='dfp')
+
 #%% _check_for_convergence
 class Test__check_for_convergence(unittest.TestCase):
     r"""
@@ -485,12 +1462,149 @@ class Test__check_for_convergence(unittest.TestCase):
 #%% _double_dogleg
 pass
 
+#%% _geodesic_acceleration
+class Test__geodesic_acceleration(unittest.TestCase):
+    r"""
+    Tests the _geodesic_acceleration function with the following cases:
+        Linear model
+        Quadratic model
+        Jacobian error
+        Reused SVD
+        Block Jacobian
+    """
+    def setUp(self):
+        self.jacobian = np.array([[1., 2.], [3., 4.], [5., 6.]])
+        self.innovs   = np.array([7., 8., 9.])
+        self.velocity = dcs.bpe._levenberg_marquardt(self.jacobian, self.innovs, 0.5)
+        self.curve    = np.array([1., -1., 2.])
+        # r(x + t*v) = r + t*J*v + t**2/2*curve, so the second directional derivative is the curve
+        self.step_innovs = self.innovs + 0.1 * self.jacobian @ self.velocity + 0.005 * self.curve
+
+    def test_linear(self):
+        step_innovs = self.innovs + 0.1 * self.jacobian @ self.velocity
+        accel = dcs.bpe._geodesic_acceleration(self.jacobian, self.innovs, self.velocity, step_innovs, 0.5)
+        np.testing.assert_array_almost_equal(accel, np.zeros(2))
+
+    def test_quadratic(self):
+        accel = dcs.bpe._geodesic_acceleration(self.jacobian, self.innovs, self.velocity, self.step_innovs, 0.5)
+        np.testing.assert_array_almost_equal(accel, dcs.bpe._levenberg_marquardt(self.jacobian, self.curve, 0.5))
+
+    def test_jacobian_error(self):
+        # an error in the Jacobian is amplified by 2/h into the second derivative
+        error    = np.array([[0.01, 0.], [0., 0.], [0., 0.]])
+        jacobian = self.jacobian + error
+        accel = dcs.bpe._geodesic_acceleration(jacobian, self.innovs, self.velocity, self.step_innovs, 0.5)
+        curve = self.curve - 2/0.1 * error @ self.velocity
+        np.testing.assert_array_almost_equal(accel, dcs.bpe._levenberg_marquardt(jacobian, curve, 0.5))
+
+    def test_svd(self):
+        svd = np.linalg.svd(self.jacobian, full_matrices=False)
+        accel1 = dcs.bpe._geodesic_acceleration(self.jacobian, self.innovs, self.velocity, self.step_innovs, 0.5)
+        accel2 = dcs.bpe._geodesic_acceleration(self.jacobian, self.innovs, self.velocity, self.step_innovs, 0.5, \
+            svd=svd)
+        np.testing.assert_array_almost_equal(accel1, accel2)
+
+    def test_blocks(self):
+        blocks   = dcs.bpe._BlockArrow([None, 'a'], [None, 'a', 'a'])
+        jacobian = dcs.bpe._BlockJacobian.zeros(blocks)
+        jacobian.set_column(0, self.jacobian[:, 0])
+        jacobian.set_column(1, np.array([0., 4., 6.]))
+        full    = jacobian.toarray()
+        hessian = blocks.hessian(jacobian)
+        step_innovs = self.innovs + 0.1 * full @ self.velocity + 0.005 * self.curve
+        accel1 = dcs.bpe._geodesic_acceleration(full, self.innovs, self.velocity, step_innovs, 0.5)
+        accel2 = dcs.bpe._geodesic_acceleration(jacobian, self.innovs, self.velocity, step_innovs, 0.5, \
+            hessian=hessian, blocks=blocks)
+        np.testing.assert_array_almost_equal(accel1, accel2)
+
 #%% _dogleg_search
 pass
 
 #%% _analyze_results
 pass
 
+#%% _BpeHistory
+class Test__BpeHistory(unittest.TestCase):
+    r"""
+    Tests the _BpeHistory class with the following cases:
+        Append and load
+        Innovations and Jacobian history
+        Rewrite from earlier iteration
+    """
+    def setUp(self):
+        self.filename = os.path.join(dcs.get_tests_dir(), 'temp_history.hdf5')
+        self.names = ['a', 'b']
+        self.bpe_results = dcs.BpeResults()
+        self.bpe_results.param_names  = [name.encode('utf-8') for name in self.names]
+        self.bpe_results.begin_params = np.array([1., 2.])
+        self.bpe_results.begin_innovs = np.array([1., 2., 3.])
+        self.bpe_results.begin_cost   = 7.
+        self.cur_results = dcs.CurrentResults()
+        self.cur_results.trust_rad   = 1.
+        self.cur_results.delta_param = np.zeros(2)
+        self.cur_results.jacobian    = np.ones((3, 2))
+
+    def _append(self, history, iteration):
+        self.cur_results.params = np.array([1., 2.]) + iteration
+        self.cur_results.innovs = np.array([1., 2., 3.]) / (iteration + 1)
+        self.cur_results.cost   = 7. / (iteration + 1)
+        self.bpe_results.num_evals    = 4 * iteration
+        self.bpe_results.num_accepted = iteration
+        self.bpe_results.num_rejected = 2 * iteration
+        self.bpe_results.num_aborted  = 3 * iteration
+        self.bpe_results.model_times.extend([0.1 * iteration] * 4)
+        history.append(iteration, self.bpe_results, self.cur_results)
+
+    def test_nominal(self):
+        history = dcs.bpe._BpeHistory(self.filename)
+        history.create(self.bpe_results)
+        for i in range(1, 4):
+            self._append(history, i)
+        cur_results = dcs.load_bpe_iteration(self.filename, 2)
+        np.testing.assert_array_equal(cur_results.params, np.array([3., 4.]))
+        self.assertEqual(cur_results.cost, 7. / 3)
+        self.assertIsNone(cur_results.innovs)
+        self.assertIsNone(cur_results.jacobian)
+        cur_results = dcs.load_bpe_iteration(self.filename)
+        np.testing.assert_array_equal(cur_results.params, np.array([4., 5.]))
+        np.testing.assert_array_equal(cur_results.innovs, np.array([1., 2., 3.]) / 4)
+        (bpe_results, cur_results) = dcs.bpe._load_checkpoint(self.filename, self.names, 2)
+        self.assertEqual(bpe_results.costs, [7., 3.5, 7. / 3])
+        self.assertEqual(bpe_results.num_evals, 8)
+        self.assertEqual(bpe_results.num_iters, 2)
+        self.assertEqual(bpe_results.num_accepted, 2)
+        self.assertEqual(bpe_results.num_rejected, 4)
+        self.assertEqual(bpe_results.num_aborted, 6)
+        np.testing.assert_array_almost_equal(bpe_results.model_times, [0.1] * 4 + [0.2] * 4)
+        self.assertEqual(bpe_results.fd_times, [])
+        with self.assertRaises(ValueError):
+            dcs.bpe._load_checkpoint(self.filename, ['a', 'c'])
+        with self.assertRaises(ValueError):
+            dcs.load_bpe_iteration(self.filename, 4)
+
+    def test_all_fields(self):
+        history = dcs.bpe._BpeHistory(self.filename, save_innovs=True, save_jacobian=True)
+        history.create(self.bpe_results)
+        for i in range(1, 3):
+            self._append(history, i)
+        cur_results = dcs.load_bpe_iteration(self.filename, 1)
+        np.testing.assert_array_equal(cur_results.innovs, np.array([1., 2., 3.]) / 2)
+        np.testing.assert_array_equal(cur_results.jacobian, np.ones((3, 2)))
+
+    def test_rewrite(self):
+        history = dcs.bpe._BpeHistory(self.filename, keep_jacobian=True)
+        history.create(self.bpe_results)
+        for i in range(1, 4):
+            self._append(history, i)
+        self._append(history, 2)
+        cur_results = dcs.load_bpe_iteration(self.filename)
+        np.testing.assert_array_equal(cur_results.params, np.array([3., 4.]))
+        np.testing.assert_array_equal(cur_results.jacobian, np.ones((3, 2)))
+
+    def tearDown(self):
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
+
 #%% validate_opti_opts
 class Test_validate_opti_opts(unittest.TestCase):
     r"""
@@ -571,6 +1685,89 @@ class Test_validate_opti_opts(unittest.TestCase):
         self.opti_opts.search_method = 'wild_ass_guess'
         self.support()
 
+    def test_not_valid11(self):
+        self.opti_opts.jacobian_update = 'bad_update'
+        self.support()
+
+    def test_not_valid12(self):
+        self.opti_opts.stream_innovs   = True
+        self.opti_opts.jacobian_update = 'broyden'
+        self.support()
+
+    def test_not_valid13(self):
+        self.opti_opts.stream_innovs = True
+        self.opti_opts.max_cores     = 2
+        self.support()
+
+    def test_not_valid14(self):
+        self.opti_opts.model_func = async_sim_model
+        self.opti_opts.max_cores  = 2
+        self.support()
+
+    def test_not_valid15(self):
+        self.opti_opts.cost_setup_func = {'sub_truth': 1}
+        self.support()
+
+    def test_not_valid17(self):
+        self.opti_opts.freeze_tol     = 0.1
+        self.opti_opts.freeze_recheck = 0
+        self.support()
+
+    def test_not_valid16(self):
+        self.opti_opts.model_func    = incremental_sim_model
+        self.opti_opts.stream_innovs = True
+        self.support()
+
+    def test_not_valid19(self):
+        self.opti_opts.search_method     = 'geodesic_lm'
+        self.opti_opts.slope_method      = 'two_sided'
+        self.opti_opts.speculative_steps = True
+        self.opti_opts.max_cores         = 2
+        self.support()
+
+    def test_not_valid18(self):
+        self.opti_opts.jacobian_func = sim_jacobian
+        self.opti_opts.stream_innovs = True
+        self.support()
+
+    def test_not_valid20(self):
+        self.opti_opts.params       = [dcs.OptiParam('a'), dcs.OptiParam('b')]
+        self.opti_opts.innov_groups = np.zeros(5)
+        self.support()
+
+    def test_not_valid21(self):
+        self.opti_opts.params          = [dcs.OptiParam('a'), dcs.OptiParam('b', group=0)]
+        self.opti_opts.innov_groups    = np.zeros(5)
+        self.opti_opts.jacobian_update = 'broyden'
+        self.support()
+
+    def test_not_valid22(self):
+        self.opti_opts.search_method = 'geodesic_lm'
+        self.opti_opts.slope_method  = 'two_sided'
+        self.opti_opts.is_max_like   = True
+        self.support()
+
+    def test_not_valid23(self):
+        self.opti_opts.worker_addresses = [('localhost', 6000)]
+        self.support()
+
+    def test_not_valid24(self):
+        self.opti_opts.speculative_steps = True
+        self.support()
+
+    def test_not_valid25(self):
+        self.opti_opts.jacobian_func  = sim_jacobian
+        self.opti_opts.model_jacobian = True
+        self.support()
+
+    def test_not_valid26(self):
+        self.opti_opts.search_method = 'geodesic_lm'
+        self.opti_opts.slope_method  = 'one_sided'
+        self.support()
+        # but the supplied derivatives are accurate enough
+        self.opti_opts.jacobian_func = sim_jacobian
+        self.assertTrue(dcs.validate_opti_opts(self.opti_opts))
+
 #%% run_bpe
 class Test_run_bpe(unittest.TestCase):
     r"""
@@ -622,6 +1819,126 @@ class Test_run_bpe(unittest.TestCase):
         self.opti_opts.is_max_like = True
         dcs.run_bpe(self.opti_opts)
 
+    def test_noise_estimate(self):
+        # the maximum likelihood noise is the RMS of the least squares residuals, and starting below it
+        # keeps the early Gauss-Newton steps from overshooting into the lower bound
+        time = np.linspace(0, 10, 51)
+        truth_data = 0.5 * time + 2 + 0.3 * np.sin(7 * time)
+        self.opti_opts.model_func     = noise_model
+        self.opti_opts.model_args     = {'sim_params': NoiseParams(time)}
+        self.opti_opts.cost_func      = noise_cost
+        self.opti_opts.cost_args      = {'truth_data': truth_data}
+        self.opti_opts.log_det_func   = noise_log_det
+        self.opti_opts.is_max_like    = True
+        self.opti_opts.slope_method   = 'complex_step'
+        self.opti_opts.max_iters      = 60
+        self.opti_opts.tol_delta_cost = 1e-12
+        self.opti_opts.params = [dcs.OptiParam(name, min_=-10, max_=10, minstep=1e-4) for name in ['a', 'b']]
+        self.opti_opts.params.append(dcs.OptiParam('sigma', min_=1e-3, max_=10, minstep=1e-4))
+        design = np.column_stack((time, np.ones(time.size)))
+        fit = np.linalg.lstsq(design, truth_data, rcond=None)[0]
+        expected = np.hstack((fit, np.sqrt(np.mean((design @ fit - truth_data)**2))))
+        self.logger.set_level(0)
+        for search_method in ['trust_region', 'levenberg_marquardt']:
+            for hessian_update in ['gauss_newton', 'bfgs', 'sr1']:
+                self.opti_opts.search_method  = search_method
+                self.opti_opts.hessian_update = hessian_update
+                (bpe_results, _) = dcs.run_bpe(self.opti_opts)
+                np.testing.assert_array_almost_equal(bpe_results.final_params, expected, decimal=5)
+                self.assertAlmostEqual(bpe_results.final_cost, 0.5 * (time.size + 2 * time.size * \
+                    np.log(expected[2])))
+
+    def test_quasi_newton_broyden(self):
+        # the quasi-Newton Hessians carry the curvature between the finite difference refreshes
+        time = np.linspace(-1, 1, 101)
+        self.opti_opts.model_func      = poly_model
+        self.opti_opts.model_args      = {'sim_params': PolyNoiseParams(time, 7)}
+        self.opti_opts.cost_func       = noise_cost
+        self.opti_opts.cost_args       = {'truth_data': np.exp(time) + np.sin(3*time) + 0.05*np.cos(40*time)}
+        self.opti_opts.get_param_func  = get_poly_parameter
+        self.opti_opts.set_param_func  = set_poly_parameter
+        self.opti_opts.log_det_func    = noise_log_det
+        self.opti_opts.is_max_like     = True
+        self.opti_opts.slope_method    = 'complex_step'
+        self.opti_opts.search_method   = 'levenberg_marquardt'
+        self.opti_opts.max_iters       = 100
+        self.opti_opts.tol_delta_cost  = 1e-12
+        self.opti_opts.params = [dcs.OptiParam('c{}'.format(i), min_=-10, max_=10, minstep=1e-4) for i in range(8)]
+        self.opti_opts.params.append(dcs.OptiParam('sigma', min_=1e-3, max_=10, minstep=1e-4))
+        self.logger.set_level(0)
+        self.opti_opts.jacobian_update = 'broyden'
+        (bpe_results1, _) = dcs.run_bpe(self.opti_opts)
+        for hessian_update in ['bfgs', 'sr1']:
+            self.opti_opts.hessian_update  = hessian_update
+            self.opti_opts.jacobian_update = 'finite_diff'
+            (bpe_results2, _) = dcs.run_bpe(self.opti_opts)
+            self.opti_opts.jacobian_update = 'broyden'
+            (bpe_results3, _) = dcs.run_bpe(self.opti_opts)
+            self.assertAlmostEqual(bpe_results3.final_cost, bpe_results1.final_cost)
+            self.assertAlmostEqual(bpe_results3.final_cost, bpe_results2.final_cost)
+            # only some iterations have finite differences, and it takes fewer model runs overall
+            self.assertGreaterEqual(len(bpe_results2.fd_times), bpe_results2.num_iters)
+            self.assertLess(len(bpe_results3.fd_times), bpe_results3.num_iters)
+            self.assertLess(bpe_results3.num_evals, bpe_results1.num_evals)
+            if hessian_update == 'bfgs':
+                self.assertLess(bpe_results3.num_evals, bpe_results2.num_evals)
+
+    def test_batch_param_cost(self):
+        # the noise is only used by the cost function, so it must see each set's parameters
+        time = np.linspace(0, 10, 51)
+        self.opti_opts.model_func     = noise_model
+        self.opti_opts.model_args     = {'sim_params': NoiseParams(time)}
+        self.opti_opts.cost_func      = noise_cost
+        self.opti_opts.cost_args      = {'truth_data': 0.5 * time + 2 + 0.3 * np.sin(7 * time)}
+        self.opti_opts.log_det_func   = noise_log_det
+        self.opti_opts.is_max_like    = True
+        self.opti_opts.max_iters      = 30
+        self.opti_opts.params = [dcs.OptiParam(name, min_=-10, max_=10, minstep=1e-4) for name in ['a', 'b']]
+        self.opti_opts.params.append(dcs.OptiParam('sigma', min_=1e-3, max_=10, minstep=1e-4))
+        self.logger.set_level(0)
+        (bpe_results1, _) = dcs.run_bpe(self.opti_opts)
+        self.opti_opts.batch_model_func = noise_batch_model
+        (bpe_results2, _) = dcs.run_bpe(self.opti_opts)
+        self.assertGreater(abs(bpe_results2.final_params[2] - bpe_results2.begin_params[2]), 0.05)
+        np.testing.assert_array_almost_equal(bpe_results2.final_params, bpe_results1.final_params)
+        self.assertAlmostEqual(bpe_results2.final_cost, bpe_results1.final_cost)
+
+    def test_hierarchical(self):
+        # each cohort's innovations only depend on the global rate and that cohort's own parameters
+        num_cohorts = 6
+        time = np.linspace(0, 10, 21)
+        truth_params = CohortParams(time, num_cohorts)
+        truth_params.rate   = 0.3
+        truth_params.scale  = 1. + np.arange(num_cohorts)
+        truth_params.offset = 0.5 * np.arange(num_cohorts)
+        self.opti_opts.model_func     = cohort_model
+        self.opti_opts.model_args     = {'sim_params': CohortParams(time, num_cohorts)}
+        self.opti_opts.cost_func      = cohort_cost
+        self.opti_opts.cost_args      = {'truth_data': cohort_model(truth_params)}
+        self.opti_opts.get_param_func = None
+        self.opti_opts.set_param_func = None
+        self.opti_opts.bind_params    = True
+        self.opti_opts.max_iters      = 20
+        self.opti_opts.params = [dcs.OptiParam('sim_params.rate', min_=0., max_=5.)]
+        for i in range(num_cohorts):
+            for key in ['scale', 'offset']:
+                self.opti_opts.params.append(dcs.OptiParam('sim_params.{}[{}]'.format(key, i), group=i))
+        expected = np.hstack((truth_params.rate, np.column_stack((truth_params.scale, truth_params.offset)).ravel()))
+        self.logger.set_level(0)
+        for search_method in ['trust_region', 'levenberg_marquardt']:
+            self.opti_opts.search_method = search_method
+            self.opti_opts.innov_groups  = None
+            (bpe_results1, _) = dcs.run_bpe(self.opti_opts)
+            self.opti_opts.innov_groups  = np.repeat(np.arange(num_cohorts), time.size)
+            (bpe_results2, _) = dcs.run_bpe(self.opti_opts)
+            np.testing.assert_array_almost_equal(bpe_results2.final_params, expected)
+            np.testing.assert_array_almost_equal(bpe_results2.final_params, bpe_results1.final_params)
+            self.assertLess(bpe_results2.num_evals, bpe_results1.num_evals)
+            # the covariance from inverting the blocks matches the one from the SVD of the whole Jacobian
+            np.testing.assert_array_almost_equal(bpe_results2.covariance, bpe_results1.covariance)
+            np.testing.assert_array_almost_equal(bpe_results2.correlation, bpe_results1.correlation)
+            self.assertIsNone(bpe_results2.info_svd)
+
     def test_normalized(self):
         pass # TODO: method not yet coded all the way
 
@@ -654,6 +1971,553 @@ class Test_run_bpe(unittest.TestCase):
         else:
             self.assertTrue(False, "Didn't converge")
 
+    def test_parallel(self):
+        self.logger.set_level(0)
+        self.opti_opts.slope_method = 'two_sided'
+        (bpe_results1, results1) = dcs.run_bpe(self.opti_opts)
+        self.opti_opts.max_cores = 2
+        (bpe_results2, results2) = dcs.run_bpe(self.opti_opts)
+        self.assertEqual(bpe_results1.num_evals, bpe_results2.num_evals)
+        np.testing.assert_array_equal(bpe_results1.costs, bpe_results2.costs)
+        np.testing.assert_array_equal(bpe_results1.final_params, bpe_results2.final_params)
+        np.testing.assert_array_equal(results1, results2)
+
+    def test_parallel_cleanup(self):
+        # the worker processes are still closed if setting up the rest of the run fails
+        self.logger.set_level(0)
+        self.opti_opts.max_cores     = 2
+        self.opti_opts.output_folder = dcs.get_tests_dir()
+        self.opti_opts.output_log    = os.path.join('missing_folder', 'bpe_log.jsonl')
+        num_children = len(multiprocessing.active_children())
+        with self.assertRaises(FileNotFoundError):
+            dcs.run_bpe(self.opti_opts)
+        self.assertEqual(len(multiprocessing.active_children()), num_children)
+
+    def test_bind_params(self):
+        self.logger.set_level(0)
+        (bpe_results1, results1) = dcs.run_bpe(self.opti_opts)
+        self.opti_opts.get_param_func = None
+        self.opti_opts.set_param_func = None
+        self.opti_opts.bind_params    = True
+        for param in self.opti_opts.params:
+            param.name = 'sim_params.' + param.name
+        (bpe_results2, results2) = dcs.run_bpe(self.opti_opts)
+        np.testing.assert_array_almost_equal(bpe_results1.costs, bpe_results2.costs)
+        np.testing.assert_array_almost_equal(results1, results2)
+        self.opti_opts.max_cores = 2
+        (bpe_results3, _) = dcs.run_bpe(self.opti_opts)
+        np.testing.assert_array_almost_equal(bpe_results1.costs, bpe_results3.costs)
+
+    def test_cost_setup(self):
+        self.logger.set_level(0)
+        (bpe_results1, results1) = dcs.run_bpe(self.opti_opts)
+        self.opti_opts.cost_func       = setup_cost_wrapper
+        self.opti_opts.cost_setup_func = cost_setup
+        del cost_setup_calls[:]
+        (bpe_results2, results2) = dcs.run_bpe(self.opti_opts)
+        self.assertEqual(len(cost_setup_calls), 1)
+        np.testing.assert_array_almost_equal(bpe_results1.costs, bpe_results2.costs)
+        np.testing.assert_array_almost_equal(results1, results2)
+        self.opti_opts.max_cores = 2
+        (bpe_results3, _) = dcs.run_bpe(self.opti_opts)
+        self.assertEqual(cost_setup_calls, [os.getpid()] * 2)
+        np.testing.assert_array_almost_equal(bpe_results1.costs, bpe_results3.costs)
+
+    def test_freeze_params(self):
+        self.logger.set_level(0)
+        self.opti_opts.max_iters      = 12
+        self.opti_opts.freeze_tol     = 0.1
+        self.opti_opts.freeze_recheck = 5
+        self.opti_opts.output_folder  = dcs.get_tests_dir()
+        self.opti_opts.output_results = 'test_bpe_frozen.hdf5'
+        (bpe_results, _) = dcs.run_bpe(self.opti_opts)
+        frozen = np.array(bpe_results.frozen_params)
+        self.assertEqual(frozen.shape, (bpe_results.num_iters, 3))
+        # the first iteration screens all the parameters, and then they are rechecked every 5 iterations
+        self.assertFalse(np.any(frozen[0]))
+        self.assertFalse(np.any(frozen[5]))
+        self.assertTrue(np.any(frozen[1]))
+        # the frequency is much more sensitive than the others, so is never frozen
+        self.assertFalse(np.any(frozen[:, 1]))
+        self.assertLess(bpe_results.final_cost, bpe_results.begin_cost)
+        # frozen iterations only run the model for the other parameters
+        self.assertLess(bpe_results.num_evals, bpe_results.num_iters * 3 + bpe_results.num_accepted + \
+            bpe_results.num_rejected + 2)
+        # the record is saved with the results and the history
+        saved = dcs.BpeResults.load(os.path.join(self.opti_opts.output_folder, self.opti_opts.output_results))
+        np.testing.assert_array_equal(saved.frozen_params, frozen)
+        (checkpoint, _) = dcs.bpe._load_checkpoint(os.path.join(self.opti_opts.output_folder, \
+            self.opti_opts.output_history), dcs.OptiParam.get_names(self.opti_opts.params), 7)
+        np.testing.assert_array_equal(checkpoint.frozen_params, frozen[:7])
+
+    def test_freeze_converged(self):
+        # a frozen parameter is released to confirm convergence before stopping
+        self.opti_opts.model_func     = weak_linear_model
+        self.opti_opts.model_args     = {'sim_params': LinearParams()}
+        self.opti_opts.cost_func      = weak_linear_cost
+        self.opti_opts.cost_args      = {}
+        self.opti_opts.params         = [dcs.OptiParam(name, minstep=1e-4) for name in ['a', 'b', 'c', 'd']]
+        self.opti_opts.tol_delta_cost = 1e-12
+        self.logger.set_level(0)
+        (bpe_results1, _) = dcs.run_bpe(self.opti_opts)
+        self.logger.set_level(8)
+        self.opti_opts.freeze_tol = 0.01
+        with dcs.capture_output() as out:
+            (bpe_results2, _) = dcs.run_bpe(self.opti_opts)
+        output = out.getvalue()
+        out.close()
+        self.assertIn(' Freezing the insensitive parameters: d', output)
+        self.assertIn('Unfreezing all the parameters to confirm convergence.', output)
+        np.testing.assert_array_almost_equal(bpe_results1.costs, bpe_results2.costs)
+        np.testing.assert_array_almost_equal(bpe_results2.final_params, [2/3, 1/6, 0.75, 4.])
+
+    def test_complex_step(self):
+        self.logger.set_level(0)
+        (bpe_results1, _) = dcs.run_bpe(self.opti_opts)
+        self.opti_opts.slope_method = 'complex_step'
+        (bpe_results2, _) = dcs.run_bpe(self.opti_opts)
+        # the exact derivatives fit the truth data with fewer model runs
+        self.assertLess(bpe_results2.costs[-1], 1e-10)
+        self.assertLessEqual(bpe_results2.num_evals, bpe_results1.num_evals)
+
+    def test_complex_step_fallback(self):
+        self.opti_opts.model_func = real_sim_model
+        self.logger.set_level(0)
+        (bpe_results1, _) = dcs.run_bpe(self.opti_opts)
+        self.opti_opts.slope_method = 'complex_step'
+        self.logger.set_level(2)
+        with dcs.capture_output() as out:
+            (bpe_results2, _) = dcs.run_bpe(self.opti_opts)
+        output = out.getvalue()
+        out.close()
+        self.assertEqual(output.count('so using one sided differences instead.'), 1)
+        np.testing.assert_array_almost_equal(bpe_results1.costs, bpe_results2.costs)
+
+    def test_jacobian_func(self):
+        self.logger.set_level(0)
+        self.opti_opts.slope_method = 'complex_step'
+        (bpe_results1, _) = dcs.run_bpe(self.opti_opts)
+        self.opti_opts.jacobian_func = sim_jacobian
+        (bpe_results2, _) = dcs.run_bpe(self.opti_opts)
+        np.testing.assert_array_almost_equal(bpe_results1.costs, bpe_results2.costs)
+        np.testing.assert_array_almost_equal(bpe_results1.final_params, bpe_results2.final_params)
+        # only one Jacobian call per iteration, instead of a model run per parameter
+        self.assertLess(bpe_results2.num_evals, bpe_results1.num_evals)
+
+    def test_model_jacobian(self):
+        self.logger.set_level(0)
+        self.opti_opts.jacobian_func = sim_jacobian
+        (bpe_results1, results1) = dcs.run_bpe(self.opti_opts)
+        self.opti_opts.jacobian_func  = None
+        self.opti_opts.model_func     = partial(jacobian_sim_model, truth_time=self.opti_opts.cost_args['truth_time'])
+        self.opti_opts.model_jacobian = True
+        (bpe_results2, results2) = dcs.run_bpe(self.opti_opts)
+        np.testing.assert_array_almost_equal(bpe_results1.costs, bpe_results2.costs)
+        np.testing.assert_array_almost_equal(results1, results2)
+        # the derivatives come from the same runs as the innovations, so there are no extra calls for them,
+        # instead of one per iteration, plus the last one that confirmed the convergence
+        self.assertEqual(bpe_results2.num_evals, bpe_results1.num_evals - bpe_results1.num_iters - 1)
+
+    def test_check_jacobian(self):
+        self.opti_opts.jacobian_func  = sim_jacobian
+        self.opti_opts.check_jacobian = 1e-6
+        self.logger.set_level(5)
+        with dcs.capture_output() as out:
+            dcs.run_bpe(self.opti_opts)
+        output = out.getvalue()
+        out.close()
+        self.assertEqual(output.count('Checking the Jacobian function against finite differences.'), 1)
+        self.assertIn('  Jacobian check for phase: relative difference of ', output)
+
+    def test_bad_jacobian(self):
+        self.logger.set_level(0)
+        self.opti_opts.jacobian_func  = sim_jacobian
+        self.opti_opts.check_jacobian = 1e-6
+        self.opti_opts.cost_args['phase_scale'] = 1.
+        self.opti_opts.cost_func = lambda results_data, phase_scale, **kwargs: cost_wrapper(results_data, **kwargs)
+        with self.assertRaises(ValueError) as context:
+            dcs.run_bpe(self.opti_opts)
+        self.assertEqual(str(context.exception), 'The Jacobian function disagrees with finite differences for: phase.')
+
+    def test_incremental(self):
+        self.logger.set_level(0)
+        (bpe_results1, results1) = dcs.run_bpe(self.opti_opts)
+        self.opti_opts.model_func = incremental_sim_model
+        self.opti_opts.cost_func  = incremental_cost_wrapper
+        (bpe_results2, results2) = dcs.run_bpe(self.opti_opts)
+        np.testing.assert_array_almost_equal(bpe_results1.costs, bpe_results2.costs)
+        np.testing.assert_array_almost_equal(results1, results2)
+        self.assertEqual(bpe_results1.num_evals, bpe_results2.num_evals)
+        self.assertEqual(bpe_results1.num_aborted, 0)
+        self.assertGreater(bpe_results2.num_aborted, 0)
+        # every aborted evaluation is a rejected trial
+        self.assertLessEqual(bpe_results2.num_aborted, bpe_results2.num_rejected)
+        # without aborting the trials early
+        self.opti_opts.abort_trials = False
+        (bpe_results3, _) = dcs.run_bpe(self.opti_opts)
+        np.testing.assert_array_almost_equal(bpe_results1.costs, bpe_results3.costs)
+        self.assertEqual(bpe_results3.num_aborted, 0)
+        self.assertGreater(sum(bpe_results3.cost_times), 0)
+
+    def test_incremental_parallel(self):
+        self.logger.set_level(0)
+        (bpe_results1, _) = dcs.run_bpe(self.opti_opts)
+        self.opti_opts.model_func        = incremental_sim_model
+        self.opti_opts.cost_func         = incremental_cost_wrapper
+        self.opti_opts.max_cores         = 2
+        self.opti_opts.speculative_steps = True
+        (bpe_results2, _) = dcs.run_bpe(self.opti_opts)
+        np.testing.assert_array_almost_equal(bpe_results1.costs, bpe_results2.costs)
+        self.assertGreater(bpe_results2.num_aborted, 0)
+
+    def test_log_records(self):
+        self.logger.set_level(0)
+        self.opti_opts.output_folder = dcs.get_tests_dir()
+        (bpe_results, _) = dcs.run_bpe(self.opti_opts)
+        with open(os.path.join(self.opti_opts.output_folder, self.opti_opts.output_log), 'r') as file:
+            records = [json.loads(line) for line in file]
+        self.assertEqual([record['event'] for record in records], ['initial'] + ['iteration'] * \
+            bpe_results.num_iters)
+        self.assertEqual([record['iteration'] for record in records[1:]], list(range(1, bpe_results.num_iters + 1)))
+        np.testing.assert_array_almost_equal([record['cost'] for record in records], \
+            bpe_results.costs[:bpe_results.num_iters + 1])
+        np.testing.assert_array_almost_equal(records[0]['params'], bpe_results.begin_params)
+        self.assertEqual(records[-1]['num_evals'], bpe_results.num_evals - 1)
+        # no records are written once the run is finished
+        filename = os.path.abspath(os.path.join(self.opti_opts.output_folder, self.opti_opts.output_log))
+        self.assertFalse(any(isinstance(handler, logging.FileHandler) and handler.baseFilename == filename \
+            for handler in logging.getLogger('dstauffman.bpe.records').handlers))
+
+    def test_log_stream(self):
+        # the messages go wherever stdout currently is, even for a redirected stream
+        self.logger.set_level(2)
+        with dcs.capture_output() as out:
+            dcs.run_bpe(self.opti_opts)
+        lines = out.getvalue().strip().split('\n')
+        out.close()
+        self.assertEqual(lines[0], '******************************')
+        self.assertEqual(lines[1], 'Running initial simulation.')
+        self.assertIn('Running final simulation.', lines)
+        self.assertNotIn('Validating optimization options.', lines)
+
+    def test_timing(self):
+        self.logger.set_level(0)
+        events = []
+        self.opti_opts.event_hook = lambda event, elapsed: events.append((event, elapsed))
+        (bpe_results, _) = dcs.run_bpe(self.opti_opts)
+        self.assertEqual(len(bpe_results.model_times), bpe_results.num_evals)
+        self.assertEqual(len(bpe_results.cost_times), bpe_results.num_evals)
+        self.assertEqual(len(bpe_results.fd_times), bpe_results.num_iters)
+        self.assertEqual(len(bpe_results.search_times), bpe_results.num_iters)
+        self.assertEqual(len(bpe_results.linalg_times), bpe_results.num_iters + 1)
+        self.assertGreater(bpe_results.num_accepted, 0)
+        self.assertEqual(len(events), sum(len(getattr(bpe_results, key)) for key in \
+            dcs.bpe._TIMING_FIELDS.values()) + bpe_results.num_accepted + bpe_results.num_rejected)
+        self.assertTrue(all(elapsed >= 0 for (_, elapsed) in events))
+        # the hook stays in this process, and the workers send back their times instead
+        del events[:]
+        self.opti_opts.max_cores = 2
+        (bpe_results, _) = dcs.run_bpe(self.opti_opts)
+        self.assertEqual(len(bpe_results.model_times), bpe_results.num_evals)
+        self.assertEqual(sum(1 for (event, _) in events if event == 'model'), bpe_results.num_evals)
+
+    def test_timing_saved(self):
+        self.logger.set_level(6)
+        self.opti_opts.output_folder  = dcs.get_tests_dir()
+        self.opti_opts.output_results = 'test_bpe_timing.hdf5'
+        with dcs.capture_output() as out:
+            (bpe_results, _) = dcs.run_bpe(self.opti_opts)
+        output = out.getvalue()
+        out.close()
+        self.assertIn('Timing summary:', output)
+        self.assertEqual(len(bpe_results.save_times), bpe_results.num_iters + 2)
+        saved = dcs.BpeResults.load(os.path.join(self.opti_opts.output_folder, self.opti_opts.output_results))
+        np.testing.assert_array_equal(saved.model_times, bpe_results.model_times)
+        self.assertEqual(saved.num_rejected, bpe_results.num_rejected)
+
+    def test_share_arrays(self):
+        self.logger.set_level(0)
+        (bpe_results1, results1) = dcs.run_bpe(self.opti_opts)
+        self.opti_opts.max_cores       = 2
+        self.opti_opts.share_arrays    = True
+        self.opti_opts.share_min_bytes = 100
+        (bpe_results2, results2) = dcs.run_bpe(self.opti_opts)
+        np.testing.assert_array_almost_equal(bpe_results1.costs, bpe_results2.costs)
+        np.testing.assert_array_almost_equal(results1, results2)
+
+    def test_speculative_steps(self):
+        self.logger.set_level(0)
+        for search_method in ['trust_region', 'levenberg_marquardt']:
+            self.opti_opts.search_method = search_method
+            self.opti_opts.speculative_steps = False
+            (bpe_results1, _) = dcs.run_bpe(self.opti_opts)
+            self.opti_opts.speculative_steps = True
+            self.opti_opts.max_cores = 2
+            (bpe_results2, _) = dcs.run_bpe(self.opti_opts)
+            self.opti_opts.max_cores = 0
+            np.testing.assert_array_equal(bpe_results1.costs, bpe_results2.costs)
+            np.testing.assert_array_equal(bpe_results1.final_params, bpe_results2.final_params)
+
+    def test_cache(self):
+        self.logger.set_level(0)
+        (bpe_results1, results1) = dcs.run_bpe(self.opti_opts)
+        self.opti_opts.cache_max_bytes = 1e6
+        self.opti_opts.cache_results = True
+        (bpe_results2, results2) = dcs.run_bpe(self.opti_opts)
+        self.assertGreater(bpe_results2.num_cache_hits, 0)
+        self.assertEqual(bpe_results1.num_evals, bpe_results2.num_evals + bpe_results2.num_cache_hits)
+        np.testing.assert_array_equal(bpe_results1.final_params, bpe_results2.final_params)
+        np.testing.assert_array_equal(results1, results2)
+
+    def test_disk_cache(self):
+        self.logger.set_level(0)
+        self.opti_opts.output_folder = os.path.join(dcs.get_tests_dir(), 'temp_bpe_output')
+        self.opti_opts.disk_cache = True
+        self.opti_opts.model_version = 'test'
+        (bpe_results1, results1) = dcs.run_bpe(self.opti_opts)
+        (bpe_results2, results2) = dcs.run_bpe(self.opti_opts)
+        shutil.rmtree(self.opti_opts.output_folder)
+        # only the final simulation needs to be re-run to get the model results
+        self.assertEqual(bpe_results2.num_evals, 1)
+        np.testing.assert_array_equal(bpe_results1.costs, bpe_results2.costs)
+        np.testing.assert_array_equal(results1, results2)
+
+    def test_broyden(self):
+        self.logger.set_level(0)
+        self.opti_opts.max_iters = 30
+        sim_params = self.opti_opts.model_args['sim_params']
+        sim_params.magnitude = 4.5
+        sim_params.frequency = 10.3
+        sim_params.phase     = 95
+        (bpe_results1, _) = dcs.run_bpe(self.opti_opts)
+        self.opti_opts.jacobian_update = 'broyden'
+        (bpe_results2, _) = dcs.run_bpe(self.opti_opts)
+        self.assertLess(bpe_results2.num_evals, bpe_results1.num_evals)
+        np.testing.assert_array_almost_equal(bpe_results1.final_params, bpe_results2.final_params, decimal=6)
+
+    def test_batch_model(self):
+        self.logger.set_level(0)
+        (bpe_results1, results1) = dcs.run_bpe(self.opti_opts)
+        self.opti_opts.batch_model_func = batch_sim_model
+        (bpe_results2, results2) = dcs.run_bpe(self.opti_opts)
+        self.assertEqual(bpe_results1.num_evals, bpe_results2.num_evals)
+        np.testing.assert_array_almost_equal(bpe_results1.costs, bpe_results2.costs)
+        np.testing.assert_array_almost_equal(bpe_results1.final_params, bpe_results2.final_params)
+        np.testing.assert_array_almost_equal(results1, results2)
+        self.opti_opts.speculative_steps = True
+        (bpe_results3, results3) = dcs.run_bpe(self.opti_opts)
+        np.testing.assert_array_almost_equal(bpe_results1.costs, bpe_results3.costs)
+        np.testing.assert_array_almost_equal(results1, results3)
+
+    def test_async_model(self):
+        self.logger.set_level(0)
+        (bpe_results1, results1) = dcs.run_bpe(self.opti_opts)
+        self.opti_opts.model_func = async_sim_model
+        self.opti_opts.speculative_steps = True
+        (bpe_results2, results2) = dcs.run_bpe(self.opti_opts)
+        np.testing.assert_array_almost_equal(bpe_results1.costs, bpe_results2.costs)
+        np.testing.assert_array_almost_equal(bpe_results1.final_params, bpe_results2.final_params)
+        np.testing.assert_array_almost_equal(results1, results2)
+
+    def test_async_timeout(self):
+        self.logger.set_level(0)
+        self.opti_opts.eval_timeout = 0.5
+        self.opti_opts.max_iters = 3
+        (bpe_results1, _) = dcs.run_bpe(self.opti_opts)
+        # the expanded trial step in the first iteration times out and gets rejected
+        self.opti_opts.model_func = slow_sim_model
+        (bpe_results2, _) = dcs.run_bpe(self.opti_opts)
+        self.assertLess(bpe_results2.final_cost, bpe_results2.begin_cost)
+        self.assertNotEqual(bpe_results1.costs[1], bpe_results2.costs[1])
+
+    def test_run_bpe_async(self):
+        self.logger.set_level(0)
+        (bpe_results1, _) = dcs.run_bpe(self.opti_opts)
+        # the model evaluations are awaited on the calling event loop
+        loops = set()
+        async def model_func(sim_params):
+            loops.add(asyncio.get_event_loop())
+            return await async_sim_model(sim_params)
+        self.opti_opts.model_func = model_func
+        loop = asyncio.new_event_loop()
+        try:
+            (bpe_results2, _) = loop.run_until_complete(dcs.run_bpe_async(self.opti_opts))
+        finally:
+            loop.close()
+        np.testing.assert_array_almost_equal(bpe_results1.costs, bpe_results2.costs)
+        self.assertEqual(loops, {loop})
+
+    def _run_workers(self, modes):
+        (bpe_results1, results1) = dcs.run_bpe(self.opti_opts)
+        self.opti_opts.model_func = flaky_sim_model
+        self.opti_opts.worker_authkey = b'test'
+        (self.opti_opts.worker_addresses, self.processes) = start_workers(modes, b'test')
+        (bpe_results2, results2) = dcs.run_bpe(self.opti_opts)
+        np.testing.assert_array_almost_equal(bpe_results1.costs, bpe_results2.costs)
+        np.testing.assert_array_almost_equal(bpe_results1.final_params, bpe_results2.final_params)
+        np.testing.assert_array_almost_equal(results1, results2)
+        self.assertEqual(bpe_results1.num_evals, bpe_results2.num_evals)
+
+    def test_workers(self):
+        self.logger.set_level(0)
+        self._run_workers(['', ''])
+
+    def test_worker_dies(self):
+        self.logger.set_level(0)
+        self._run_workers(['die', ''])
+
+    @unittest.skipIf(not hasattr(signal, 'SIGSTOP'), 'Needs a way to stop a process.')
+    def test_worker_stops(self):
+        self.logger.set_level(0)
+        self.opti_opts.worker_timeout = 1.
+        self._run_workers(['', 'stop'])
+
+    def test_no_workers(self):
+        self.logger.set_level(0)
+        with socket.socket() as sock:
+            sock.bind(('localhost', 0))
+            self.opti_opts.worker_addresses = [('localhost', sock.getsockname()[1])]
+        self.opti_opts.worker_authkey = b'test'
+        with self.assertRaises(ConnectionError):
+            dcs.run_bpe(self.opti_opts)
+
+    def test_worker_no_authkey(self):
+        with self.assertRaises(ValueError):
+            dcs.serve_bpe_worker(('localhost', 0), None)
+        with self.assertRaises(ValueError):
+            dcs.serve_bpe_worker(('localhost', 0), b'')
+
+    def test_stream_innovs(self):
+        self.logger.set_level(0)
+        (bpe_results1, results1) = dcs.run_bpe(self.opti_opts)
+        self.opti_opts.cost_func     = chunked_cost_wrapper
+        self.opti_opts.stream_innovs = True
+        (bpe_results2, results2) = dcs.run_bpe(self.opti_opts)
+        self.assertEqual(bpe_results1.num_evals, bpe_results2.num_evals)
+        np.testing.assert_array_almost_equal(bpe_results1.costs, bpe_results2.costs)
+        np.testing.assert_array_almost_equal(bpe_results1.final_params, bpe_results2.final_params)
+        np.testing.assert_array_almost_equal(bpe_results1.covariance, bpe_results2.covariance)
+        np.testing.assert_array_almost_equal(np.abs(bpe_results1.info_svd), np.abs(bpe_results2.info_svd))
+        np.testing.assert_array_almost_equal(results1, results2)
+        self.assertIsNone(bpe_results2.begin_innovs)
+        self.assertIsNone(bpe_results2.final_innovs)
+
+    def test_stream_innovs_memory(self):
+        # only the results of the base run and the current perturbed runs are held at once
+        live_results = weakref.WeakValueDictionary()
+        peak_results = [0]
+        def model_func(sim_params):
+            results = sim_model(sim_params)
+            live_results[id(results)] = results
+            return results
+        def cost_func(results_data, **kwargs):
+            peak_results[0] = max(peak_results[0], len(live_results))
+            return chunked_cost_wrapper(results_data, **kwargs)
+        self.logger.set_level(0)
+        self.opti_opts.model_func    = model_func
+        self.opti_opts.cost_func     = cost_func
+        self.opti_opts.stream_innovs = True
+        self.opti_opts.slope_method  = 'two_sided'
+        self.opti_opts.max_iters     = 3
+        (bpe_results, _) = dcs.run_bpe(self.opti_opts)
+        self.assertLess(bpe_results.final_cost, bpe_results.begin_cost)
+        self.assertLessEqual(peak_results[0], 3)
+
+    def test_geodesic_lm(self):
+        # the geodesic steps follow a narrow curved valley much better than the plain ones
+        time = np.arange(2)
+        self.opti_opts.model_func    = valley_model
+        self.opti_opts.model_args    = {'sim_params': SimParams(time, magnitude=-1.2, frequency=1, phase=0)}
+        self.opti_opts.cost_args     = {'results_time': time, 'truth_time': time, 'truth_data': np.zeros(2)}
+        self.opti_opts.params        = [dcs.OptiParam('magnitude', best=-1.2, min_=-10, max_=10, typical=1, \
+            minstep=1e-6), dcs.OptiParam('frequency', best=1, min_=-10, max_=10, typical=1, minstep=1e-6)]
+        self.opti_opts.slope_method  = 'complex_step'
+        self.opti_opts.search_method = 'levenberg_marquardt'
+        self.opti_opts.max_iters     = 100
+        self.logger.set_level(0)
+        (bpe_results1, _) = dcs.run_bpe(self.opti_opts)
+        self.opti_opts.search_method = 'geodesic_lm'
+        self.logger.set_level(8)
+        with dcs.capture_output() as out:
+            (bpe_results2, _) = dcs.run_bpe(self.opti_opts)
+        output = out.getvalue()
+        out.close()
+        self.assertIn(' Tried a Geodesic LM step of length: ', output)
+        self.assertLess(bpe_results2.final_cost, 1e-15)
+        self.assertLess(bpe_results2.final_cost, bpe_results1.final_cost)
+        np.testing.assert_array_almost_equal(bpe_results2.final_params, [1., 1.])
+        # including the extra model run for each trial step
+        self.assertLess(bpe_results2.num_evals, bpe_results1.num_evals / 2)
+
+    def test_geodesic_lm_one_sided(self):
+        # one sided Jacobians are too inaccurate to correct
+        self.logger.set_level(0)
+        self.opti_opts.search_method = 'geodesic_lm'
+        with self.assertRaises(AssertionError):
+            dcs.run_bpe(self.opti_opts)
+
+    def test_stream_innovs_lm(self):
+        self.logger.set_level(0)
+        self.opti_opts.search_method = 'levenberg_marquardt'
+        (bpe_results1, _) = dcs.run_bpe(self.opti_opts)
+        self.opti_opts.cost_func     = chunked_cost_wrapper
+        self.opti_opts.stream_innovs = True
+        (bpe_results2, _) = dcs.run_bpe(self.opti_opts)
+        # the steps from the normal equations are only the same to within round off, which eventually
+        # changes which trial steps get accepted
+        np.testing.assert_array_almost_equal(bpe_results1.costs[:3], bpe_results2.costs[:3])
+        self.assertLess(bpe_results2.final_cost, bpe_results2.begin_cost)
+
+    def test_resume(self):
+        self.logger.set_level(0)
+        self.opti_opts.max_iters = 10
+        (bpe_results1, results1) = dcs.run_bpe(self.opti_opts)
+        folder = os.path.join(dcs.get_tests_dir(), 'temp_bpe_output')
+        self.opti_opts.output_folder = folder
+        self.opti_opts.output_results = 'temp_results.hdf5'
+        self.opti_opts.max_iters = 2
+        dcs.run_bpe(self.opti_opts)
+        self.opti_opts.max_iters = 10
+        try:
+            (bpe_results2, results2) = dcs.run_bpe(self.opti_opts, resume_from=True)
+            (bpe_results3, results3) = dcs.run_bpe(self.opti_opts, \
+                resume_from=os.path.join(folder, 'bpe_history.hdf5'), resume_iter=1)
+        finally:
+            shutil.rmtree(folder)
+        np.testing.assert_array_almost_equal(bpe_results1.costs, bpe_results2.costs)
+        np.testing.assert_array_almost_equal(bpe_results1.final_params, bpe_results2.final_params)
+        np.testing.assert_array_almost_equal(results1, results2)
+        np.testing.assert_array_almost_equal(bpe_results1.costs, bpe_results3.costs)
+        np.testing.assert_array_almost_equal(results1, results3)
+        for bpe_results in [bpe_results2, bpe_results3]:
+            self.assertEqual(bpe_results.num_accepted, bpe_results1.num_accepted)
+            self.assertEqual(bpe_results.num_rejected, bpe_results1.num_rejected)
+            self.assertEqual(len(bpe_results.fd_times), len(bpe_results1.fd_times))
+
+    def test_resume_missing(self):
+        self.logger.set_level(0)
+        self.opti_opts.max_iters = 0
+        with self.assertRaises(FileNotFoundError):
+            dcs.run_bpe(self.opti_opts, resume_from=os.path.join(dcs.get_tests_dir(), 'temp_bpe_output'))
+        # nothing to resume from, so starts over
+        (bpe_results, _) = dcs.run_bpe(self.opti_opts, resume_from=True)
+        self.assertIsNotNone(bpe_results.begin_cost)
+        self.assertEqual(bpe_results.num_evals, 2)
+
+    def test_resume_bad_names(self):
+        self.logger.set_level(0)
+        folder = os.path.join(dcs.get_tests_dir(), 'temp_bpe_output')
+        self.opti_opts.output_folder = folder
+        self.opti_opts.output_results = 'temp_results.hdf5'
+        self.opti_opts.max_iters = 1
+        dcs.run_bpe(self.opti_opts)
+        self.opti_opts.params.pop()
+        try:
+            with self.assertRaises(ValueError):
+                dcs.run_bpe(self.opti_opts, resume_from=True)
+        finally:
+            shutil.rmtree(folder)
+
     def test_saving(self):
         self.logger.set_level(0)
         self.opti_opts.max_iters = 0
@@ -663,9 +2527,53 @@ class Test_run_bpe(unittest.TestCase):
         # TODO: test with more iterations and files?
 
     def tearDown(self):
-        filename = os.path.join(self.opti_opts.output_folder, self.opti_opts.output_results)
-        if os.path.isfile(filename):
-            os.remove(filename)
+        for process in getattr(self, 'processes', []):
+            if process.is_alive():
+                os.kill(process.pid, getattr(signal, 'SIGKILL', signal.SIGTERM))
+            process.join()
+        for file in [self.opti_opts.output_results, self.opti_opts.output_history, self.opti_opts.output_log]:
+            filename = os.path.join(self.opti_opts.output_folder, file)
+            if os.path.isfile(filename):
+                os.remove(filename)
+
+#%% _serve_worker_session
+class Test__serve_worker_session(unittest.TestCase):
+    r"""
+    Tests the _serve_worker_session function with the following cases:
+        Heartbeats only while evaluating
+    """
+    def setUp(self):
+        time = np.arange(11)
+        self.opti_opts = dcs.OptiOpts()
+        self.opti_opts.model_func     = sleepy_sim_model
+        self.opti_opts.model_args     = {'sim_params': SimParams(time, magnitude=3.5, frequency=12, phase=180)}
+        self.opti_opts.cost_func      = cost_wrapper
+        self.opti_opts.cost_args      = {'results_time': time, 'truth_time': time, 'truth_data': np.zeros(11)}
+        self.opti_opts.set_param_func = set_parameter
+        evaluator = dcs.bpe._Evaluator(self.opti_opts, self.opti_opts.model_args, ['magnitude'])
+        (self.conn, worker_conn) = multiprocessing.Pipe()
+        self.thread = threading.Thread(target=dcs.bpe._serve_worker_session, args=(worker_conn, 0.05))
+        self.thread.start()
+        self.conn.send(('init', evaluator._worker_opti_opts(), evaluator.names, evaluator.model_args, \
+            evaluator.cost_args))
+
+    def test_heartbeats(self):
+        # nothing is sent while idle, so nothing builds up on the connection
+        time.sleep(0.3)
+        self.assertFalse(self.conn.poll())
+        self.conn.send(('eval', 0, np.array([3.])))
+        messages = [self.conn.recv()]
+        while messages[-1][0] == 'heartbeat':
+            messages.append(self.conn.recv())
+        self.assertGreater(len(messages), 1)
+        self.assertEqual(messages[-1][:2], ('result', 0))
+        time.sleep(0.3)
+        self.assertFalse(self.conn.poll())
+
+    def tearDown(self):
+        self.conn.send(('close',))
+        self.thread.join()
+        self.conn.close()
 
 #%% plot_bpe_results
 class Test_plot_bpe_results(unittest.TestCase):